@@ -0,0 +1,99 @@
+#!/usr/bin/python
+
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Annotates the IP addresses of a column of a (large) CSV, TSV or JSON-lines file with their ASN
+# and prefix, and optionally AS name (see pyasn.annotate). The file is streamed in chunks, which
+# are looked up in a pool of processes sharing the loaded database; the output keeps the order
+# of the input. Files ending in .gz or .zst are decompressed (and compressed) on the fly.
+
+from __future__ import print_function, division
+from pyasn import pyasn
+from pyasn.annotate import annotate_file, FORMATS
+from pyasn.mrtx import _open_compressed
+from argparse import ArgumentParser
+from time import time
+from sys import stdin, stdout, stderr
+import io
+
+
+parser = ArgumentParser(description="Script to annotate the IP addresses of a column of a CSV, "
+                        "TSV or JSON-lines file with their ASN and prefix (and AS name).")
+parser.add_argument("ipasn_db", metavar="IPASN.DAT", help="IPASN database to look up in")
+parser.add_argument("input", metavar="INPUT", nargs="?", default="-",
+                    help="file to annotate (default: stdin)")
+parser.add_argument("-o", "--output", metavar="FILE", default="-",
+                    help="file to write (default: stdout)")
+parser.add_argument("-c", "--column", required=True,
+                    help="column of the IP addresses: a header name or number (from 1) for "
+                         "csv/tsv, a key for jsonl")
+parser.add_argument("-f", "--format", choices=FORMATS,
+                    help="input format (default: from the file name; csv)")
+parser.add_argument("--no-header", action="store_true",
+                    help="the csv/tsv input has no header line (--column is then a number)")
+parser.add_argument("--asnames", metavar="ASNAMES", action="store",
+                    help="AS names file (JSON, or a store of pyasn_util_asnames.py --binary); "
+                         "adds an as_name column")
+parser.add_argument("-p", "--processes", type=int, default=None,
+                    help="processes to annotate with (default: one per CPU; 0 for none)")
+parser.add_argument("--chunk-rows", type=int, default=20000,
+                    help="records per chunk (default 20000)")
+parser.add_argument("-q", "--quiet", action="store_true", help="don't report progress")
+args = parser.parse_args()
+
+
+def open_text(name, mode):
+    if name == '-':
+        stream = stdin if mode == 'r' else stdout
+        return io.TextIOWrapper(stream.buffer, encoding='utf-8', errors='replace', newline='')
+    return io.TextIOWrapper(_open_compressed(name, mode + 'b'), encoding='utf-8',
+                            errors='replace', newline='')
+
+
+fmt = args.format
+if not fmt:
+    name = args.input.lower()
+    for ext in ('.gz', '.zst'):
+        name = name[:-len(ext)] if name.endswith(ext) else name
+    fmt = ('tsv' if name.endswith(('.tsv', '.tab')) else
+           'jsonl' if name.endswith(('.jsonl', '.json', '.ndjson')) else 'csv')
+column = args.column
+if fmt != 'jsonl' and (args.no_header or column.isdigit()):
+    column = int(column) - 1
+    if column < 0:
+        parser.error("column numbers start from 1")
+
+t0 = time()
+asndb = pyasn(args.ipasn_db, as_names_file=args.asnames)
+if not args.quiet:
+    print("Loaded %s in %.1fs" % (args.ipasn_db, time() - t0), file=stderr)
+
+infile, outfile = open_text(args.input, 'r'), open_text(args.output, 'w')
+try:
+    rows, seconds = annotate_file(asndb, infile, outfile, fmt, column, bool(args.asnames),
+                                  not args.no_header, args.processes, args.chunk_rows,
+                                  not args.quiet, args.ipasn_db, args.asnames)
+finally:
+    outfile.close()
+    infile.close()
+if not args.quiet:
+    print("Annotated %d rows in %.1fs, %.0f rows/s" % (rows, seconds, rows / max(seconds, 1e-6)),
+          file=stderr)
@@ -20,11 +20,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import re
 import codecs
 import argparse
 import logging
-from sys import version_info
+from sys import version_info, stdout
+from pyasn.asnames import iter_autnums, write_asnames_store, AsNamesStore, AsNameIndex
 
 try:
     import ujson as json
@@ -41,7 +41,6 @@ logger = logging.getLogger(__name__)
 
 ASNAMES_URL = 'http://www.cidr-report.org/as2.0/autnums.html'
 HTML_FILENAME = "autnums.html"
-EXTRACT_ASNAME_C = re.compile(r"<a .+>AS(?P<code>.+?)\s*</a>\s*(?P<name>.*)", re.U)
 
 
 def get_parser():
@@ -56,45 +55,63 @@ def get_parser():
         '-p', '--persist-html',
         dest='persist_html', action='store_true',
         help='persist intermediary html file? (autnums.html)', default=False)
+    parser.add_argument(
+        '-b', '--binary', dest='binary', action='store_true', default=False,
+        help='write a binary AS names store (memory-mapped by pyasn, instead of loaded) '
+             'rather than json, with a name search index (OUTPUT.tri); needs --output')
     return parser
 
 
 def main(args):
-    data = None
+    if args.binary and not args.output:
+        raise SystemExit("--binary needs an --output file")
 
-    # html source available?
+    # html source available? it is parsed line by line as it is read, also when downloading
     if args.input:
         logger.debug("using %s as html source" % args.input)
-
-        with codecs.open(args.input, encoding="utf-8") as fs:
-            data = fs.read()
-
-    # data is not available yet? Let's download it!
-    if data is None:
+        source = open(args.input, 'rb')
+        lines, encoding = source, 'utf-8'
+    else:
         logger.debug("fetching asn names from remote")
-        data = download_asnames()
-
+        source = urlopen(ASNAMES_URL)
+        lines, encoding = source, 'latin-1'
         # only works if fetching from remote
         if args.persist_html:
-            with codecs.open(HTML_FILENAME, "w", encoding='utf-8') as fs:
-                fs.write(data)
-
-    # parse it to json
-    data_dict = _html_to_dict(data)
-    data_json = json.dumps(data_dict)
-
-    # output to file?
-    if args.output:
-        with codecs.open(args.output, 'w', encoding="utf-8") as fs:
-            fs.write(data_json)
-    else:
-        # defaults to console
-        print(data_json)
-
-
-def __parse_asname_line(line):
-    match = EXTRACT_ASNAME_C.match(line)
-    return match.groups()
+            lines = _persisted(source, HTML_FILENAME)
+
+    try:
+        if args.binary:
+            count = write_asnames_store(iter_autnums(lines, encoding), args.output)
+            logger.debug("%d asnames stored in %s" % (count, args.output))
+            # and the trigram index for name searches, which pyasn finds next to the store
+            AsNameIndex.build(AsNamesStore(args.output)).save(args.output + '.tri')
+        elif args.output:
+            with codecs.open(args.output, 'w', encoding="utf-8") as fs:
+                _write_json(iter_autnums(lines, encoding), fs)
+        else:
+            # defaults to console
+            _write_json(iter_autnums(lines, encoding), stdout)
+            stdout.write('\n')
+    finally:
+        source.close()
+
+
+def _persisted(lines, file_name):
+    # passes lines through, saving them (utf-8) to file_name
+    with codecs.open(file_name, "w", encoding='utf-8') as fs:
+        for line in lines:
+            fs.write(line.decode('latin-1'))
+            yield line
+
+
+def _write_json(names, fs):
+    # writes (asn, name) pairs as a json object, one pair at a time
+    fs.write('{')
+    sep = ''
+    for asn, name in names:
+        fs.write('%s%s: %s' % (sep, json.dumps(str(asn)), json.dumps(name)))
+        sep = ', '
+    fs.write('}')
 
 
 def _html_to_dict(data):
@@ -106,10 +123,7 @@ def _html_to_dict(data):
     :return:
     :rtype: dict
     """
-    split = data.split("\n")
-    split = filter(lambda line: line.startswith("<a"), split)
-    fn = __parse_asname_line
-    return dict(map(fn, split))
+    return dict((str(asn), name) for asn, name in iter_autnums(data.split("\n")))
 
 
 def download_asnames():
@@ -28,9 +28,10 @@ from __future__ import print_function, division
 from pyasn import mrtx, __version__
 from time import time
 from sys import argv, exit, stdout
+from os import path, rename, remove
 from glob import glob
 from datetime import datetime, timedelta
-from subprocess import call
+from multiprocessing import Pool, cpu_count
 from argparse import ArgumentParser
 
 
@@ -43,39 +44,165 @@ group.add_argument("--single", nargs=2, metavar=("RIBFILE", "IPASN.DAT"), action
                    help="convert single file (use bz2 or gz suffix)")
 group.add_argument("--dump-screen", nargs=1, metavar="RIBFILE", action="store",
                    help="parse and dump archive to screen")
+group.add_argument("--build-index", nargs=1, metavar="RIBFILE", action="store",
+                   help="index the records of an archive (as RIBFILE.idx), so that --dump-screen "
+                   "--record-from N seeks straight to record N")
 group.add_argument("--bulk", nargs=2, metavar=("START-DATE", "END-DATE"), action="store",
-                   help="bulk conversion (dates are Y-M-D, files need to be "
-                   "named rib.xxxxxxxx.bz2 and in current directory)")
+                   help="bulk conversion (dates are Y-M-D, files need to be named "
+                   "rib.YYYYMMDD.HHMM[.bz2|.gz] and in current directory); dates already "
+                   "converted are skipped")
+group.add_argument("--merge", nargs='+', metavar=("IPASN.DAT", "RIBFILE"), action="store",
+                   help="merge several RIB files (e.g. of multiple collectors) into one database")
 group.add_argument("--version", action="store_true")
 # FIXME: tie --no-progress/--compress/--skip and --record-xx to respective options above
-parser.add_argument("--compress", action="store_true",  # in place of --binary (20160105)
-                    help="gzip the IPASN output files (with --single)")
+parser.add_argument("--compress", nargs='?', const='gzip', choices=('gzip', 'zstd'),
+                    help="compress the IPASN output files, with gzip (default) or zstd; zstd "
+                    "needs the 'zstandard' module (with --single/--bulk/--merge)")
+parser.add_argument("--binary", action="store_true",
+                    help="write the compact binary IPASN format, which is read back with "
+                    "mrtx.read_ipasn_binary_file(), not pyasn (with --single/--bulk/--merge)")
 parser.add_argument("--no-progress", action="store_true",
                     help="don't show conversion progress (with --single)")
 parser.add_argument("--skip-on-error", action="store_true",
                     help="skip records which fail conversion, instead of stopping (with --single)")
+parser.add_argument("--only-networks", metavar="FILE", action="store",
+                    help="only convert prefixes overlapping the networks in FILE, one NETWORK/MASK "
+                    "per line (with --single)")
+parser.add_argument("--only-family", type=int, choices=(4, 6), action="store",
+                    help="only convert IPv4 or IPv6 prefixes (with --single)")
+parser.add_argument("--peers", metavar="PEER[,PEER...]", action="store",
+                    help="take origins only from these peers, given by IP address, BGP ID or "
+                    "ASN (with --single)")
+parser.add_argument("--stats-json", metavar="FILE", action="store",
+                    help="append conversion statistics (timings, throughput, counts) as JSON "
+                    "lines to FILE, for progress monitoring (with --single)")
+parser.add_argument("--checkpoint-every", type=int, metavar="N", action="store",
+                    help="save a checkpoint (as IPASN.DAT.ckpt) every N records, to be able to "
+                    "resume an interrupted conversion (with --single)")
+parser.add_argument("--resume", action="store_true",
+                    help="continue from the checkpoint of an interrupted conversion, if there is "
+                    "one; implies --checkpoint-every (with --single)")
 parser.add_argument("--record-from", type=int, metavar="N", action="store",
                     help="start dump from record N (with --dump-screen)")
 parser.add_argument("--record-to", type=int, metavar="N", action="store",
                     help="end dump at record N (with --dump-screen)")
+parser.add_argument("--policy", choices=mrtx.MERGE_POLICIES, default="majority",
+                    help="how to choose among differing origins (with --merge)")
+parser.add_argument("--stats-file", metavar="FILE", action="store",
+                    help="save per-prefix origin confidence statistics (with --merge)")
+parser.add_argument("--processes", type=int, metavar="N", action="store",
+                    help="number of parallel processes, default all cores (with --merge/--bulk)")
 args = parser.parse_args()
 
 
+def find_rib_files(dt):
+    # files named "rib.YYYYMMDD.HHMM.bz2" are the default used by routeviews, and downloaded by
+    # pyasn_util_download.py; we also accept gzip, xz, zstd and uncompressed archives
+    files = glob("rib.%4d%02d%02d.????*" % (dt.year, dt.month, dt.day))
+    return sorted(f for f in files if f[17:] in ('', '.bz2', '.gz', '.xz', '.zst'))
+
+
+def convert_bulk_file(job):
+    # worker process for --bulk: converts one archive. Output is first written to a temporary
+    # name, checked, then renamed, so that a failed or interrupted run never leaves a
+    # complete-looking database behind; a failed one removes it.
+    dump_file, out_file, compress, binary, skip_on_error = job
+    t0 = time()
+    tmp_file = out_file + '.part'
+    try:
+        prefixes = mrtx.parse_mrt_file(dump_file, skip_record_on_error=skip_on_error, compact=True)
+        try:
+            mrtx.dump_prefixes_to_file(prefixes, tmp_file, dump_file, compress=compress,
+                                       binary=binary)
+            if mrtx.check_ipasn_file(tmp_file) is None:
+                raise IOError("incomplete output file '%s'" % tmp_file)
+            rename(tmp_file, out_file)
+        except Exception:
+            if path.exists(tmp_file):
+                remove(tmp_file)
+            raise
+    except Exception as e:
+
+        return dump_file, out_file, None, "%s: %s" % (type(e).__name__, e), time() - t0
+    return dump_file, out_file, len(prefixes), path.getsize(dump_file), time() - t0
+
+
+out_suffix = {'gzip': '.gz', 'zstd': '.zst'}.get(args.compress, '')
+compress = args.compress or False
+
+
 if args.version:
     print("MRT/RIB converter version %s." % __version__)
 
 
 if args.single:
+    stats_file = open(args.stats_json, 'a') if args.stats_json else None
+    stats = mrtx.ConversionStats(mrtx.json_lines_callback(stats_file)) if stats_file else None
+    prefix_filter = None
+    if args.only_networks or args.only_family:
+        networks = None
+        if args.only_networks:
+            with open(args.only_networks) as f:
+                networks = [line.strip() for line in f if line.strip() and line[0] not in ';#']
+        prefix_filter = mrtx.PrefixFilter(networks, args.only_family)
+    peers = None
+    if args.peers:
+        peers = set(int(peer) if peer.isdigit() else peer for peer in args.peers.split(','))
+    checkpoint = None
+    if args.checkpoint_every or args.resume:
+        checkpoint = mrtx.ConversionCheckpoint(args.single[1] + '.ckpt', resume=args.resume,
+                                               interval=args.checkpoint_every or 500000)
     prefixes = mrtx.parse_mrt_file(args.single[0],
                                    print_progress=not args.no_progress,
-                                   skip_record_on_error=args.skip_on_error)
-    mrtx.dump_prefixes_to_file(prefixes, args.single[1], args.single[0])
+                                   skip_record_on_error=args.skip_on_error,
+                                   compact=True,
+                                   stats=stats,
+                                   prefix_filter=prefix_filter,
+                                   peers=peers,
+                                   checkpoint=checkpoint)
+    if stats_file:
+        stats_file.close()
+    out_file = args.single[1] + out_suffix
+    mrtx.dump_prefixes_to_file(prefixes, out_file, args.single[0], compress=compress,
+                               binary=args.binary)
+    if checkpoint:
+        checkpoint.remove()
     if not args.no_progress:
-        v6 = sum(1 for x in prefixes if ':' in x)
-        v4 = len(prefixes) - v6
+        v4, v6 = mrtx.count_prefixes(prefixes)
         print('IPASN database saved (%d IPV4 + %d IPV6 prefixes)' % (v4, v6))
-    if args.compress:
-        call(['gzip', args.single[1]])
+
+
+if args.merge and __name__ == '__main__':  # guard needed for multiprocessing
+    if len(args.merge) < 2:
+        parser.error("--merge needs an output file, and one or more RIB files")
+    out_file, rib_files = args.merge[0] + out_suffix, args.merge[1:]
+    prefixes, stats = mrtx.parse_mrt_files_merged(rib_files,
+                                                  policy=args.policy,
+                                                  processes=args.processes,
+                                                  print_progress=not args.no_progress,
+                                                  skip_record_on_error=args.skip_on_error)
+    mrtx.dump_prefixes_to_file(prefixes, out_file,
+                               "%s (merged: %s)" % (", ".join(rib_files), args.policy),
+                               compress=compress, binary=args.binary)
+    if args.stats_file:
+        with open(args.stats_file, 'w') as fw:
+            fw.write('; prefix\torigin\tvotes\ttotal-votes\tarchives\tconfidence\n')
+            for prefix, (votes, total, archives) in stats.items():
+                origin = prefixes[prefix]
+                origin = ",".join(str(asn) for asn in sorted(origin)) \
+                    if isinstance(origin, set) else origin
+                fw.write('%s\t%s\t%d\t%d\t%d\t%.3f\n' % (prefix, origin, votes, total, archives,
+                                                         votes / total))
+    if not args.no_progress:
+        v4, v6 = mrtx.count_prefixes(prefixes)
+        print('IPASN database saved (%d IPV4 + %d IPV6 prefixes, merged from %d files)'
+              % (v4, v6, len(rib_files)))
+
+
+if args.build_index:
+    index = mrtx.build_mrt_index(args.build_index[0])
+    print("Indexed %d records (%d prefixes) of %s" % (index.records, index.prefix_count,
+                                                       args.build_index[0]))
 
 
 if args.dump_screen:
@@ -85,7 +212,7 @@ if args.dump_screen:
                               screen=stdout)
 
 
-if args.bulk:
+if args.bulk and __name__ == '__main__':  # guard needed for multiprocessing
     try:
         dt = datetime.strptime(args.bulk[0], '%Y-%m-%d').date()  # TODO:
         dt_end = datetime.strptime(args.bulk[1], '%Y-%m-%d').date()
@@ -94,23 +221,41 @@ if args.bulk:
         exit()
     print("Starting bulk RIB conversion, from %s to %s..." % (dt, dt_end))
     stdout.flush()
+    jobs, skipped = [], 0
     while dt <= dt_end:
-        # for each day, process first file named "rib.YYYYMMDD.xxxx.bz2". (what about .gz?)
-        # this is default filename used by routeviews and downloaded by pyasn_wget_rib.py
-        files = glob("rib.%4d%02d%02d.????.bz2" % (dt.year, dt.month, dt.day))
-        if not files:
-            dt += timedelta(1)
-            continue
-        if len(files) > 1:
-            print("warning: multiple files on %s, only converting first." % dt)
-        dump_file = files[0]
-        print("%s... " % dump_file[4:-4])
-        stdout.flush()
-        dat = mrtx.parse_mrt_file(dump_file)
-        out_file = "ipasn_%d%02d%02d.dat" % (dt.year, dt.month, dt.day)
-        mrtx.dump_prefixes_to_file(dat, out_file, dump_file)
-        if args.compress:
-            call(['gzip', out_file])
+        # for each day, process the first RIB archive of the day
+        files = find_rib_files(dt)
+        if files:
+            if len(files) > 1:
+                print("warning: multiple files on %s, only converting first." % dt)
+            out_file = "ipasn_%d%02d%02d.dat" % (dt.year, dt.month, dt.day)
+            out_file += out_suffix
+            if mrtx.check_ipasn_file(out_file):
+                skipped += 1  # converted in an earlier run
+            else:
+                jobs.append((files[0], out_file, compress, args.binary, args.skip_on_error))
         dt += timedelta(1)
+    if skipped:
+        print("%d dates already converted, skipping them." % skipped)
+
+    t0, done, failed, n_prefixes, n_bytes = time(), 0, 0, 0, 0
+    processes = min(args.processes or cpu_count(), len(jobs)) or 1
+    pool = Pool(processes)
+    for dump_file, out_file, count, info, seconds in pool.imap_unordered(convert_bulk_file, jobs):
+        if count is None:
+            failed += 1
+            print("%s... FAILED (%s)" % (dump_file, info))
+        else:
+            done += 1
+            n_prefixes += count
+            n_bytes += info
+            print("%s... %s, %d prefixes in %.fs" % (dump_file, out_file, count, seconds))
+        stdout.flush()
+    pool.close()
+    pool.join()
     #
-    print('Finished!')
+    elapsed = max(time() - t0, 1e-6)
+    print('Finished! %d converted, %d failed, %d skipped, using %d processes.'
+          % (done, failed, skipped, processes))
+    print('Throughput: %.2f files/min, %.1f MB/s of archives, %.f prefixes/s (%.fs total)'
+          % (done * 60 / elapsed, n_bytes / 1e6 / elapsed, n_prefixes / elapsed, elapsed))
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Snapshot diff: prefixes added, removed, or with a changed origin, between two IPASN databases
+# (text or binary, plain or compressed) or MRT/RIB archives, e.g. for a daily hijack report.
+
+from __future__ import print_function, division
+from pyasn import mrtx
+from time import time
+from sys import stdout, stderr
+from argparse import ArgumentParser
+
+
+parser = ArgumentParser(description="Script to diff two IPASN databases or MRT/RIB archives.",
+                        epilog="Writes one line per change: kind (added, removed or changed), "
+                        "prefix, old origin, new origin (tab separated, '-' if none).")
+parser.add_argument("old", metavar="OLD", help="older IPASN file or RIB archive")
+parser.add_argument("new", metavar="NEW", help="newer IPASN file or RIB archive")
+parser.add_argument("-o", "--output", metavar="FILE", action="store",
+                    help="write the changes to FILE, instead of the screen")
+parser.add_argument("--kinds", metavar="KIND[,KIND...]", default="added,removed,changed",
+                    help="only list these kinds of change (the summary counts all)")
+parser.add_argument("--summary-only", action="store_true",
+                    help="don't list the changes, only print the summary counts")
+args = parser.parse_args()
+
+
+def format_origin(origin):
+    if origin is None:
+        return '-'
+    if isinstance(origin, set):
+        return ",".join(str(asn) for asn in sorted(origin))
+    return str(origin)
+
+
+kinds = set(args.kinds.split(','))
+if not kinds <= set(('added', 'removed', 'changed')):
+    parser.error("--kinds takes 'added', 'removed' and/or 'changed'")
+t0, counts = time(), {}
+fw = open(args.output, 'w') if args.output else stdout
+for change in mrtx.diff_prefixes(args.old, args.new, counts):
+    if not args.summary_only and change.kind in kinds:
+        fw.write("%s\t%s\t%s\t%s\n" % (change.kind, change.prefix, format_origin(change.old),
+                                       format_origin(change.new)))
+if args.output:
+    fw.close()
+print("%d added, %d removed, %d changed, %d unchanged prefixes (%.1fs)"
+      % (counts['added'], counts['removed'], counts['changed'], counts['unchanged'], time() - t0),
+      file=stderr)
@@ -26,20 +26,19 @@
 from __future__ import print_function, division
 from datetime import date, datetime
 from time import time
-from ftplib import FTP
 from argparse import ArgumentParser
-from subprocess import call
-from sys import argv, exit, stdout, version_info
+from sys import argv, exit, stdout
+from shutil import copyfile
+from pyasn.download import download_ribs, download_and_convert, Downloader, ArchiveCache, \
+    ArchiveIndex, ROUTEVIEWS_URL
 try:
     from pyasn import __version__
 except:
     pass  # not fatal if we can't get version
-if version_info[0] < 3:
-    from urllib2 import urlopen
-else:
-    from urllib.request import urlopen
 
 
+ROUTEVIEWS_FTP_URL = 'ftp://archive.routeviews.org/'  # latest archives are found over FTP
+
 # Parse command line options
 # Note: --latest might be changes to --46, instead of --4, in the future
 parser = ArgumentParser(description="Script to download MRT/RIB BGP archives (from RouteViews).")
@@ -50,73 +49,62 @@ group.add_argument('--latestv6', '-6', action='store_true', help='Grab lastest I
 group.add_argument('--latestv46', '-46', action='store_true', help='Grab lastest IPV4/V6 data')
 group.add_argument('--version', action='store_true')
 group.add_argument('--dates-from-file', '-f', action='store',
-                   help='Grab IPV4 archives for specifc dates (one date, YYYYMMDD, per line)')
+                   help='Grab archives for specifc dates (one date, YYYYMMDD, per line)')
 parser.add_argument('--filename', action='store', help="Specify name with which the file will be saved")
+parser.add_argument('--ipv', choices=('4', '6', '46'), default='4',
+                    help='collector to grab archives from: IPV4, IPV6 or IPV4/V6 '
+                    '(with --dates-from-file, default 4)')
+parser.add_argument('--workers', type=int, default=4, metavar='N',
+                    help='number of parallel downloads (with --dates-from-file, default 4)')
+parser.add_argument('--convert', metavar='IPASN.DAT', action='store',
+                    help='convert the archive to an IPASN database while it downloads, instead of '
+                    'after (with --latestv4/v6/v46; use a .gz suffix to compress)')
+parser.add_argument('--cache-dir', metavar='DIR', action='store',
+                    help='keep archives in a local cache, with a manifest of their sizes and '
+                    'checksums; archives already in it are not downloaded again')
+parser.add_argument('--archive-url', metavar='URL',
+                    help='root of the archive, e.g. a mirror (default %s, or %s with '
+                    '--dates-from-file)' % (ROUTEVIEWS_FTP_URL, ROUTEVIEWS_URL))
+parser.add_argument('--index-file', metavar='FILE', action='store',
+                    help='keep the archive listings in this index file, to reuse them while '
+                    'fresh; it can be shared between hosts')
+parser.add_argument('--index-ttl', type=int, default=3600, metavar='SECONDS',
+                    help='age after which listings of the current month are refreshed '
+                    '(default 3600; listings of past months are kept)')
 args = parser.parse_args()
 
 
-def ftp_download(server, remote_dir, remote_file, local_file, print_progress=True):
-    """Downloads a file from an FTP server and stores it locally"""
-    ftp = FTP(server)
-    ftp.login()
-    ftp.cwd(remote_dir)
+def archive_download(url, print_progress=True):
+    """Downloads a file, storing it locally (resuming a partial download), or in the cache"""
     if print_progress:
-        print('Downloading ftp://%s/%s/%s' % (server, remote_dir, remote_file))
-    filesize = ftp.size(remote_file)
-
-    filename = args.filename if args.filename is not None else local_file
-    # perhaps warn before overwriting file?
-    with open(filename, 'wb') as fp:
-        def recv(s):
-            fp.write(s)
-            recv.chunk += 1
-            recv.bytes += len(s)
-            if recv.chunk % 100 == 0 and print_progress:
-                print('\r %.f%%, %.fKB/s' % (recv.bytes*100 / filesize,
-                      recv.bytes / (1000*(time()-recv.start))), end='')
-                stdout.flush()
-        recv.chunk, recv.bytes, recv.start = 0, 0, time()
-        ftp.retrbinary('RETR %s' % remote_file, recv)
-    ftp.close()
+        print('Downloading %s' % url)
+    filename = args.filename if args.filename is not None else url.rsplit('/', 1)[1]
+    t0 = time()
+    downloader = Downloader(1, print_progress=print_progress)
+    if args.cache_dir:
+        cached = ArchiveCache(args.cache_dir).fetch(downloader, url)
+        if args.filename is not None:
+            copyfile(cached, filename)
+        filename = cached
+    else:
+        downloader.download(url, filename)
+    downloader.close()
     if print_progress:
-        print('\nDownload complete.')
+        print('Download complete: %s (%.fs).' % (filename, time() - t0))
 
 
-def find_latest_in_ftp(server, archive_root, sub_dir, print_progress=True):
-    """Returns (server, filepath, filename) for the most recent file in an FTP archive"""
-    if print_progress:
-        print('Connecting to ftp://' + server)
-    ftp = FTP(server)
-    ftp.login()
-    months = sorted(ftp.nlst(archive_root), reverse=True)  # e.g. 'route-views6/bgpdata/2016.12'
-    filepath = '/%s/%s' % (months[0], sub_dir)
-    if print_progress:
-        print("Finding most recent archive in %s ..." % filepath)
-    ftp.cwd(filepath)
-    fls = ftp.nlst()
-    if not fls:
-        filepath = '/%s/%s' % (months[1], sub_dir)
-        if print_progress:
-            print("Finding most recent archive in %s ..." % filepath)
-        ftp.cwd(filepath)
-        fls = ftp.nlst()
-        if not fls:
-            raise LookupError("Cannot find file to download. Please report a bug on github?")
-    filename = max(fls)
-    ftp.close()
-    return (server, filepath, filename)
-
-
-def find_latest_routeviews(archive_ipv):
+def find_latest_routeviews(archive_ipv, print_progress=True):
     # RouteViews archives are as follows:
     # ftp://archive.routeviews.org/datapath/YYYYMM/ribs/XXXX
+    # Months are listed through the archive index, which skips listings that are still fresh
     archive_ipv = str(archive_ipv)
     assert archive_ipv in ('4', '6', '46', '64')
-    return find_latest_in_ftp(server='archive.routeviews.org',
-                              archive_root='bgpdata' if archive_ipv == '4' else
-                                           'route-views6/bgpdata' if archive_ipv == '6' else
-                                           'route-views4/bgpdata',  # 4+6
-                              sub_dir='RIBS')
+    index = ArchiveIndex(args.archive_url or ROUTEVIEWS_FTP_URL, args.index_file, args.index_ttl)
+    if print_progress:
+        print('Finding most recent archive in %s ...' % index.base_url)
+    url = index.latest('46' if archive_ipv == '64' else archive_ipv)
+    index.close()
+    return url
 
 
 if args.version:
@@ -125,12 +113,22 @@ if args.version:
 
 if args.latestv4 or args.latestv6 or args.latestv46:
     # Download latest RouteViews MRT/RIB archive
-    srvr, rp, fn = find_latest_routeviews(4 if args.latestv4 else 6 if args.latestv6 else '46')
-    ftp_download(srvr, rp, fn, fn)
+    url = find_latest_routeviews(4 if args.latestv4 else 6 if args.latestv6 else '46')
+    if args.convert:
+        print('Downloading and converting %s' % url)
+        t0 = time()
+        prefixes = download_and_convert(url, args.convert, args.filename or url.rsplit('/', 1)[1],
+                                        cache=ArchiveCache(args.cache_dir) if args.cache_dir
+                                        else None,
+                                        print_progress=True)
+        print('IPASN database saved (%d IPV4 + %d IPV6 prefixes, %.fs)'
+              % (prefixes.family_counts() + (time() - t0,)))
+    else:
+        archive_download(url)
 
 
 if args.dates_from_file:
-    # read dates from a local file and use wget to download range
+    # read dates from a local file, and download their archives with a pool of workers
     dates_to_get = []
     f = open(args.dates_from_file)
     if not f:
@@ -142,40 +140,21 @@ if args.dates_from_file:
         dt = date(int(s[:4]), int(s[4:6]), int(s[6:8]))  # Dates are strangely YYYYMMDD :)
         dates_to_get.append(dt)
 
-    for dt in dates_to_get:
-        # FIXME: currently v4 only. should understand v4/v6 options, and possibly use FTP method
-        url_dir = 'http://archive.routeviews.org/bgpdata/%d.%02d/RIBS/' % (dt.year, dt.month)
-        print('Searching %s for %d-%02d-%02d...' % (url_dir, dt.year, dt.month, dt.day), end=' ')
-        stdout.flush()
-
-        html = str(urlopen(url_dir).read())
-        str_find = 'rib.%d%02d%02d' % (dt.year, dt.month, dt.day)
-
-        ix = html.find(str_find + '.06')  # get the file saved at 6 AM for consistency
-        if ix == -1:
-            ix = html.find(str_find + '.05')  # if not, try 5 AM
-            if ix == -1:
-                ix = html.find(str_find + '.00')  # last resort, try the one saved at midnight
-                if ix == -1:
-                    print('=> ERROR - NOT FOUND.')
-                    continue
-
-        fname = html[ix:ix+21]
-        s = html[ix+80:ix+150]
-        ix = s.find('"right"')
-        assert ix != -1
-        s = s[ix+8:]
-        ix = s.find("</td>")
-        assert ix != -1
-        size = s[:ix]
-
-        url_full = url_dir + fname
-        print('downloading...', end=' ')
-        stdout.flush()
-        # FIXME: Why using urllib AND wget? Can urllib do listing AND downloading? (OR ftp...)
-        ret = call(['wget', '-q', url_full])  # wget in quiet mode
-        print()
-        ret = "" if ret == 0 else "[FAIL:%d]" % ret
-
-        print('%s\t%s\t%s\t%s' % (dt, size, url_full, ret))
+    print('Downloading %d archives (IPV%s), %d at a time...' % (len(dates_to_get), args.ipv,
+                                                               args.workers))
+    stdout.flush()
+    t0, total = time(), 0
+    index = ArchiveIndex(args.archive_url or ROUTEVIEWS_URL, args.index_file, args.index_ttl) \
+        if args.index_file else None
+    for dt, url, local_file, size, error in download_ribs(dates_to_get, args.ipv, args.workers,
+                                                          args.archive_url or ROUTEVIEWS_URL,
+                                                          cache_dir=args.cache_dir, index=index):
+        if url is None:
+            print('%s => ERROR - %s.' % (dt, 'NOT FOUND' if error == 'not found' else error))
+        else:
+            total += size or 0
+            print('%s\t%s\t%s\t%s' % (dt, size, url, "" if error is None else "[FAIL:%s]" % error))
         stdout.flush()
+    if index is not None:
+        index.close()
+    print('Done, %.1f MB in %.fs.' % (total / 1e6, time() - t0))
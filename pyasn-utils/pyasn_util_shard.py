@@ -0,0 +1,72 @@
+#!/usr/bin/python
+
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Runs a shard worker of a sharded lookup service on this node (see pyasn.shard), or plans the
+# bucket ranges of the shards. Routers (pyasn.shard.ShardRouter) connect to the workers with
+# the same authentication key.
+
+from __future__ import print_function, division
+from pyasn.shard import plan_shards, serve_shard, _is_loopback
+from argparse import ArgumentParser
+from time import time
+from sys import stderr
+
+
+parser = ArgumentParser(description="Script to run a shard worker of a sharded IPASN lookup "
+                        "service, or to plan its shards.")
+group = parser.add_mutually_exclusive_group(required=True)
+group.add_argument("--plan", nargs=2, metavar=("IPASN.DAT", "SHARDS"), action="store",
+                   help="print the bucket ranges (first, last + 1) of SHARDS shards of a database")
+group.add_argument("--serve", nargs=3, metavar=("IPASN.DAT", "FIRST", "END"), action="store",
+                   help="load the prefixes of buckets FIRST to END - 1, and answer routers")
+parser.add_argument("--listen", metavar="HOST:PORT", default="127.0.0.1:0",
+                    help="address to listen on (default 127.0.0.1, any free port)")
+parser.add_argument("--authkey-file", metavar="FILE", action="store",
+                    help="file with the key routers authenticate with (none if not given; "
+                    "required to listen on other than a loopback address)")
+args = parser.parse_args()
+
+
+if args.plan:
+    for first, end in plan_shards(args.plan[0], int(args.plan[1])):
+        print("%d\t%d" % (first, end))
+
+if args.serve:
+    class Ready(object):
+        # reports the listening address once the shard is loaded
+        def send(self, address):
+            print("Shard of %s (buckets %s-%s) loaded in %.1fs; listening on %s:%d"
+                  % (args.serve[0], args.serve[1], args.serve[2], time() - t0, address[0],
+                     address[1]), file=stderr)
+
+        def close(self):
+            pass
+    host, port = args.listen.rsplit(':', 1)
+    if not args.authkey_file and not _is_loopback((host, int(port))):
+        parser.error("--listen on other than a loopback address needs --authkey-file")
+    authkey = None
+    if args.authkey_file:
+        with open(args.authkey_file, 'rb') as f:
+            authkey = f.read().strip()
+    t0 = time()
+    serve_shard(args.serve[0], int(args.serve[1]), int(args.serve[2]), (host, int(port)),
+                authkey, Ready())
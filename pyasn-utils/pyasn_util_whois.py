@@ -0,0 +1,58 @@
+#!/usr/bin/python
+
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Local, offline stand-in for the Team Cymru whois service (whois.cymru.com): answers its single
+# and bulk (begin/end) queries from an IPASN database, so that tools speaking the protocol can be
+# pointed at it instead of the rate-limited public service. Requires Python 3.
+
+from __future__ import print_function, division
+from pyasn import pyasn
+from pyasn.whois import BulkWhoisServer, WHOIS_PORT
+from time import time
+from sys import stderr
+from argparse import ArgumentParser
+
+
+parser = ArgumentParser(description="Script to serve IPASN lookups over the Team Cymru whois "
+                        "protocol (TCP port 43, begin/end bulk queries).",
+                        epilog="e.g.: netcat HOST PORT < queries.txt, with lines 'begin', "
+                        "'verbose', one IP per line, and 'end'")
+parser.add_argument("ipasn_file", metavar="IPASN.DAT", help="IPASN database to answer from")
+parser.add_argument("--asnames", metavar="FILE", action="store",
+                    help="AS names file (json, or a binary store) for the AS Name column")
+parser.add_argument("--host", default="127.0.0.1",
+                    help="address to listen on (default 127.0.0.1; 0.0.0.0 for all)")
+parser.add_argument("--port", type=int, default=WHOIS_PORT,
+                    help="port to listen on (default %d, which needs privileges)" % WHOIS_PORT)
+parser.add_argument("--batch-size", type=int, default=1000, metavar="N",
+                    help="lines of a bulk query looked up at once (default 1000)")
+args = parser.parse_args()
+
+t0 = time()
+asndb = pyasn(args.ipasn_file, as_names_file=args.asnames)
+server = BulkWhoisServer(asndb, args.host, args.port, args.batch_size)
+print("Loaded %s (%.1fs); serving whois on %s:%d" % (args.ipasn_file, time() - t0, args.host,
+                                                    args.port), file=stderr)
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    print("Stopped after %d clients, %d queries" % (server.clients, server.queries), file=stderr)
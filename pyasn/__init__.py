@@ -30,6 +30,7 @@ from ipaddress import collapse_addresses, ip_network
 
 from ._version import __version__
 from .pyasn_radix import Radix
+from .asnames import AsNamesStore, AsNameIndex, is_asnames_store
 
 try:
     import ujson as json
@@ -52,7 +53,9 @@ class pyasn(object):
              scripts provided alongside the pyasn package. Alternatively, you can download
              prebuilt database from the pyasn homepage.)
         :param as_names_file:
-            if given, loads autonomous system names from this file (warning: not fully tested)
+            if given, loads autonomous system names from this file (warning: not fully tested).
+            (A JSON file of {"ASN": "name"}, plain or .gz; or a binary AS names store made by
+             pyasn_util_asnames.py --binary, which is memory-mapped rather than loaded.)
         :param ipasn_string:
             String containing an IP-ASN database to load.
             Only used if ipasn_file is None.
@@ -71,6 +74,11 @@ class pyasn(object):
             # performance note: ipasn_str = subprocess.check_output(['gunzip', '-c', ip_asn_file])
             # is faster, but less portable, hence our choice. we could do hybrid.
             self._records = self.radix.load_ipasndb("", ipasn_str)
+        elif ipasn_file is not None and ipasn_file.endswith(".zst"):
+            import zstandard  # optional dependency, only needed for zstd compressed IPASN files
+            with open(ipasn_file, 'rb') as f:
+                ipasn_str = zstandard.ZstdDecompressor().decompressobj().decompress(f.read())
+            self._records = self.radix.load_ipasndb("", ipasn_str.decode('ascii'))
         elif ipasn_file is not None:
             self._records = self.radix.load_ipasndb(ipasn_file, "")
         elif ipasn_string is not None:
@@ -78,6 +86,7 @@ class pyasn(object):
         else:
             raise ValueError("No data given, all parameters are empty.")
         self._asnames = self._read_asnames() if as_names_file else None
+        self._asnames_index = None  # for search_as_names(), made on first use
         self._as_prefixes = None
 
     def _read_asnames(self):
@@ -88,6 +97,9 @@ class pyasn(object):
         #           - json or csv-file with ASN & AS-NAMES
         #           - gzip of above
         #           - "anydbm" or pickle (pickle gets a bit ugly with unicode)
+        if is_asnames_store(self._asnames_file):
+            return AsNamesStore(self._asnames_file)  # sorted & indexed; mapped on first lookup
+
         if self._asnames_file.endswith('.gz'):
             f = gzip.open(self._asnames_file, 'rt')  # Py2.6 doesn't support 'with' for gzip
             raw_data = f.read()
@@ -132,6 +144,49 @@ class pyasn(object):
         rn = self.radix.search_best(ip_address)
         return (rn.asn, rn.prefix) if rn else (None, None)
 
+    def lookup_many(self, ip_addresses):
+        """
+        Looks up several ip addresses at once (e.g. a batch, in a worker thread).\n
+        :param ip_addresses: iterable of string representations of ip addresses
+        :raises: ValueError if an invalid IP address is passed.
+        :return: list of the (asn, prefix) of each address, in order (see lookup())
+        """
+        search_best = self.radix.search_best
+        results = []
+        append = results.append
+        for ip_address in ip_addresses:
+            rn = search_best(ip_address)
+            append((rn.asn, rn.prefix) if rn else (None, None))
+        return results
+
+    def set_prefix(self, network, masklen, asn):
+        """
+        Sets the origin AS of a prefix, adding the prefix if needed (e.g. for a BGP announcement,
+        see mrtx.apply_bgp_updates()).\n
+        :param network: string representation of the network address, for example "8.8.8.0"
+        :return: True if the prefix was added, False if it was already in the database
+        """
+        node = self.radix.search_exact(network, masklen)
+        added = node is None
+        if added:
+            node = self.radix.add(network, masklen)
+            self._records += 1
+        node.asn = asn
+        self._as_prefixes = None
+        return added
+
+    def remove_prefix(self, network, masklen):
+        """
+        Removes a prefix (e.g. for a BGP withdrawal).\n
+        :return: False if the prefix wasn't in the database
+        """
+        if self.radix.search_exact(network, masklen) is None:
+            return False
+        self.radix.delete(network, masklen)
+        self._records -= 1
+        self._as_prefixes = None
+        return True
+
     def get_as_prefixes(self, asn):
         """ :return: All prefixes advertised by given ASN """
         if not self._as_prefixes:
@@ -193,6 +248,45 @@ class pyasn(object):
             raise Exception("Autonomous system names not loaded during initialization")
         return self._asnames.get(asn, None)
 
+    def has_as_names(self):
+        """Returns True if AS-Names were loaded (as_names_file), for get_as_name(s)()"""
+        return bool(self._asnames)
+
+    def get_as_names(self, asns):
+
+        """
+        Returns the AS-Names of several ASNs at once.\n
+        :param asns: iterable of 32-bit ASNs (None, e.g. as looked up for unrouted IPs, is allowed)
+        :return: list of the AS-Names, in the order of asns (None for ASNs without a name)
+        """
+        if not self._asnames:
+            raise Exception("Autonomous system names not loaded during initialization")
+        if isinstance(self._asnames, AsNamesStore):
+            return self._asnames.get_many(asns)
+        return [self._asnames.get(asn, None) for asn in asns]
+
+    def search_as_names(self, query, limit=20, details=False):
+        """
+        Finds autonomous systems by (part of) their name, e.g. "amazon" or "deutsche telekom".\n
+        :param query: words the AS-Names should all contain (case insensitive)
+        :param limit: maximum number of ASes to return (None for all)
+        :param details: also return the prefixes & size of each AS
+        :return: list of (asn, name), best matches first (names starting with the query, then
+            names with a word starting with it, then the rest; shorter names first). With
+            details=True, a list of (asn, name, get_as_prefixes(asn), get_as_size(asn)).
+        """
+        if not self._asnames:
+            raise Exception("Autonomous system names not loaded during initialization")
+        if getattr(self, '_asnames_index', None) is None:
+            # trigram index: saved next to a binary AS names store, or built (once) from the names
+            self._asnames_index = self._asnames.search_index() \
+                if isinstance(self._asnames, AsNamesStore) else AsNameIndex.build(self._asnames)
+        found = self._asnames_index.search(query, limit)
+        if details:
+            found = [(asn, name, self.get_as_prefixes(asn), self.get_as_size(asn))
+                     for asn, name in found]
+        return found
+
     def __repr__(self):
         ret = "pyasn(ipasndb:'%s'; asnames:'%s') - %d prefixes" % (self._ipasndb_file,
                                                                    self._asnames_file,
@@ -208,6 +302,7 @@ class pyasn(object):
     def __getstate__(self):
         d = self.__dict__.copy()
         del d['radix']
+        d['_asnames_index'] = None  # rebuilt or loaded again when needed
         s = ""
         for elt in self:
             s += "{}\t{}\n".format(elt.prefix, elt.asn)
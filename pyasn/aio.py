@@ -0,0 +1,137 @@
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""pyasn.aio
+Module to look up IP addresses from asyncio code (e.g. web services) without blocking the event
+loop during bursts. Requires Python 3.7+ (asyncio; not installed on older versions).
+
+Other objects:
+   AsyncPyasn: asyncio front-end of a pyasn, coalescing concurrent lookups into micro-batches
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+
+class AsyncPyasn(object):
+    """
+    Asyncio front-end of a pyasn. Concurrent lookup() calls are coalesced into micro-batches:
+    a batch is resolved (pyasn.lookup_many(), in a worker thread) once max_batch lookups are
+    waiting, or max_delay seconds after its first one, whichever comes first. So a burst costs
+    one executor hand-off per batch rather than per lookup, and a lone lookup waits at most
+    max_delay.\n
+    executor: the concurrent.futures executor to resolve batches in (default: a thread of its
+    own). offload=False resolves them on the loop itself instead, which is cheapest when lookups
+    come in small numbers.\n
+    Counters, for monitoring: lookups, batches, largest_batch; loop_time and max_loop_time are
+    the total and longest time (seconds) the event loop was held by this front-end.
+    """
+
+    def __init__(self, asndb, max_batch=256, max_delay=0.001, executor=None, offload=True):
+        self.asndb, self.max_batch, self.max_delay = asndb, max_batch, max_delay
+        self.offload = offload
+        self._executor = executor
+        self._own_executor = executor is None and offload
+        self._pending = []  # [(ip address, future)] of the batch being collected
+        self._timer = None
+        self.lookups = self.batches = self.largest_batch = 0
+        self.loop_time = self.max_loop_time = 0.0
+
+    async def lookup(self, ip_address):
+        """
+        Returns the (asn, prefix) of ip_address, as pyasn.lookup() does.
+        :raises: ValueError if an invalid IP address is passed.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((ip_address, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    async def lookup_many(self, ip_addresses):
+        """Returns the (asn, prefix) of each of ip_addresses, in order"""
+        return await asyncio.gather(*[self.lookup(ip) for ip in ip_addresses])
+
+    def _flush(self):
+        # sends the batch being collected off to be resolved
+        t0 = perf_counter()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self.lookups += len(batch)
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, len(batch))
+            ips = [ip for ip, _ in batch]
+            if self.offload:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(1)
+                resolved = asyncio.get_running_loop().run_in_executor(self._executor,
+                                                                      self._resolve, ips)
+                resolved.add_done_callback(lambda done: self._deliver(batch, done))
+            else:
+                self._deliver(batch, None, self._resolve(ips))
+        self._count_loop_time(t0)
+
+    def _resolve(self, ips):
+        # (asn, prefix) of each address, or the ValueError of an invalid one
+        try:
+            return self.asndb.lookup_many(ips)
+        except ValueError:
+            results = []
+            for ip in ips:
+                try:
+                    results.append(self.asndb.lookup(ip))
+                except ValueError as e:
+                    results.append(e)
+            return results
+
+    def _deliver(self, batch, done, results=None):
+        t0 = perf_counter()
+        if done is not None:
+            if done.cancelled() or done.exception() is not None:
+                error = done.exception() if not done.cancelled() else asyncio.CancelledError()
+                results = [error] * len(batch)
+            else:
+                results = done.result()
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue  # the caller was cancelled
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        self._count_loop_time(t0)
+
+    def _count_loop_time(self, t0):
+        elapsed = perf_counter() - t0
+        self.loop_time += elapsed
+        self.max_loop_time = max(self.max_loop_time, elapsed)
+
+    def close(self):
+        """Shuts down the front-end's own worker thread"""
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
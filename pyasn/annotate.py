@@ -0,0 +1,253 @@
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""pyasn.annotate
+Module to annotate the IP addresses in a column of large CSV, TSV or JSON-lines files with their
+ASN and prefix (and AS name), used by pyasn_util_annotate. Requires Python 3 (multiprocessing
+contexts).
+
+Functions:
+  annotate_file()  -- annotates a file (stream) in chunks, in a pool of processes, in order
+
+Other objects:
+   Annotator: annotates chunks of lines of one format and column
+"""
+
+from __future__ import print_function, division
+from multiprocessing import get_context, cpu_count
+from collections import deque
+from time import time
+from sys import stderr
+import csv
+import json
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+FORMATS = ('csv', 'tsv', 'jsonl')
+ADDED_FIELDS = ('asn', 'prefix', 'as_name')
+
+_annotator = None  # of the pool's processes: inherited from the parent (fork), or made by init
+
+
+class Annotator(object):
+    """
+    Adds the asn, prefix and (with names) as_name of the address in a column to each line of a
+    chunk, using batched lookups: pyasn.lookup_many() and get_as_names() once per chunk.
+    Addresses that are missing or invalid get empty fields (null in JSON).\n
+    column: for csv/tsv, the index of the column (from 0); for jsonl, the key of the address.
+    """
+
+    def __init__(self, asndb, fmt, column, names=False):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown format '%s', use one of %s" % (fmt, ', '.join(FORMATS)))
+        self.asndb, self.fmt, self.column, self.names = asndb, fmt, column, names
+        self.delimiter = '\t' if fmt == 'tsv' else ','
+
+    def header(self, line):
+        """Returns the header line with the added columns (csv/tsv), or None for jsonl"""
+        if self.fmt == 'jsonl':
+            return None
+        return self.annotate_rows([line], header=True)
+
+    def column_index(self, header_line, name):
+        """Returns the index of the column called name in a csv/tsv header line"""
+        row = next(csv.reader([header_line], delimiter=self.delimiter))
+        if name not in row:
+            raise ValueError("No column '%s' in the header: %s" % (name, ', '.join(row)))
+        return row.index(name)
+
+    def _lookup(self, ips):
+        # (asn, prefix) of each address; (None, None) for invalid ones (or None)
+        try:
+            return self.asndb.lookup_many(ips)
+        except (ValueError, TypeError):
+            found = []
+            for ip in ips:
+                try:
+                    found.append(self.asndb.lookup(ip))
+                except (ValueError, TypeError):
+                    found.append((None, None))
+            return found
+
+    def annotate(self, text):
+        """Returns the annotated lines of a chunk (text of whole lines)"""
+        if self.fmt == 'jsonl':
+            return self.annotate_json(text)
+        return self.annotate_rows(_lines(text))
+
+    def annotate_rows(self, lines, header=False):
+        rows = list(csv.reader(lines, delimiter=self.delimiter))
+        out = StringIO()
+        writer = csv.writer(out, delimiter=self.delimiter, lineterminator='\n')
+        if header:
+            for row in rows:
+                writer.writerow(row + list(ADDED_FIELDS[:3 if self.names else 2]))
+            return out.getvalue()
+        ips = [row[self.column].strip() if len(row) > self.column else '' for row in rows]
+        found = self._lookup(ips)
+        names = self.asndb.get_as_names([asn for asn, _ in found]) if self.names else None
+        for i, row in enumerate(rows):
+            asn, prefix = found[i]
+            row += ['' if asn is None else asn, prefix or '']
+            if names is not None:
+                row.append(names[i] or '')
+        writer.writerows(rows)
+        return out.getvalue()
+
+    def annotate_json(self, text):
+        records = [json.loads(line) for line in _lines(text) if line.strip()]
+        ips = [record.get(self.column) if isinstance(record, dict) else None
+               for record in records]
+        found = self._lookup(ips)
+        names = self.asndb.get_as_names([asn for asn, _ in found]) if self.names else None
+        lines = []
+        for i, record in enumerate(records):
+            if isinstance(record, dict):
+                record['asn'], record['prefix'] = found[i]
+                if names is not None:
+                    record['as_name'] = names[i]
+            lines.append(json.dumps(record) + '\n')
+        return ''.join(lines)
+
+
+def _lines(text):
+    # the lines of a chunk, ending at '\n' only: str.splitlines() also ends them at \x1c, \x85,
+    # \u2028 and other separators, which can be inside csv fields and JSON strings
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+
+def _init_worker(ipasn_file, as_names_file, fmt, column, names):
+    # for pools of spawned processes, which don't inherit the parent's database
+    global _annotator
+    from . import pyasn
+    _annotator = Annotator(pyasn(ipasn_file, as_names_file), fmt, column, names)
+
+
+def _annotate_chunk(text):
+    return _annotator.annotate(text)
+
+
+def _ends_quoted(line, delimiter, quoted):
+    # whether a csv/tsv line ends inside a quoted field (the record goes on), given whether it
+    # starts in one; as csv.reader: quotes open a field only at its start, "" inside is a quote
+    if not quoted and '"' not in line:
+        return False
+    i, start = 0, not quoted
+    while True:
+        if quoted:
+            i = line.find('"', i)
+            if i < 0:
+                return True
+            if line.startswith('""', i):
+                i += 2
+            else:
+                quoted, i = False, i + 1
+        elif start and line.startswith('"', i):
+            quoted, start, i = True, False, i + 1
+        else:
+            i = line.find(delimiter, i)
+            if i < 0:
+                return False
+            start, i = True, i + 1
+
+
+def _read_chunks(infile, fmt, chunk_rows):
+    # yields (text, records) chunks of whole records; csv/tsv records can span lines in quotes
+    lines, records, quoted = [], 0, False
+    delimiter = '\t' if fmt == 'tsv' else ','
+    for line in infile:
+        lines.append(line)
+        if fmt != 'jsonl':
+            quoted = _ends_quoted(line, delimiter, quoted)
+        if not quoted and (fmt != 'jsonl' or line.strip()):  # blank jsonl lines are dropped
+            records += 1
+        if records >= chunk_rows and not quoted:
+            yield ''.join(lines), records
+            lines, records = [], 0
+    if lines:
+        yield ''.join(lines), records
+
+
+def annotate_file(asndb, infile, outfile, fmt, column, names=False, header=True, processes=None,
+                  chunk_rows=20000, print_progress=False, ipasn_file=None, as_names_file=None):
+    """
+    Annotates the addresses of a column of a CSV, TSV or JSON-lines stream (see Annotator),
+    writing the lines to outfile in their order. The input is read in chunks of chunk_rows
+    records, annotated in a pool of processes (default: one per CPU; 0 for none). On platforms
+    that fork, the processes share the loaded database (asndb); elsewhere each loads ipasn_file
+    and as_names_file.\n
+    column: csv/tsv column name (with header=True) or index from 0; jsonl key.
+    :return: (rows, seconds)
+    """
+    t0 = time()
+    if fmt != 'jsonl' and header:
+        first = infile.readline()
+        annotator = Annotator(asndb, fmt, 0, names)
+        column = column if isinstance(column, int) else annotator.column_index(first, column)
+        outfile.write(annotator.header(first))
+    annotator = Annotator(asndb, fmt, int(column) if fmt != 'jsonl' else column, names)
+    chunks = _read_chunks(infile, fmt, chunk_rows)
+    processes = cpu_count() if processes is None else processes
+    rows, reported = 0, t0
+
+    def done(text, n):
+        outfile.write(text)
+        if print_progress and time() - reported > 10:
+            print("  %d rows @%.fs, %.0f rows/s" % (rows + n, time() - t0,
+                                                    (rows + n) / (time() - t0)), file=stderr)
+            return n, time()
+        return n, reported
+
+    if not processes:
+        for text, n in chunks:
+            n, reported = done(annotator.annotate(text), n)
+            rows += n
+        return rows, time() - t0
+
+    global _annotator
+    try:
+        context = get_context('fork')
+        _annotator = annotator
+        pool = context.Pool(processes)  # forked after setting _annotator: shares asndb
+    except ValueError:
+        if ipasn_file is None:
+            raise ValueError("Processes can't share the database here; pass ipasn_file")
+        pool = get_context().Pool(processes, _init_worker, (ipasn_file, as_names_file, fmt,
+                                                            annotator.column, names))
+    try:
+        pending = deque()  # results in input order; bounded, so input is read as it's consumed
+        for text, n in chunks:
+            pending.append((pool.apply_async(_annotate_chunk, (text,)), n))
+            if len(pending) >= 2 * processes:
+                result, n = pending.popleft()
+                n, reported = done(result.get(), n)
+                rows += n
+        while pending:
+            result, n = pending.popleft()
+            n, reported = done(result.get(), n)
+            rows += n
+    finally:
+        pool.terminate()
+        _annotator = None
+    return rows, time() - t0
@@ -0,0 +1,381 @@
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""pyasn.asnames
+Module to read autonomous system names (from the CIDR report's autnums.html), and to keep them
+in a compact binary store that is looked up without loading it, used by pyasn & pyasn_util_asnames.
+
+Functions:
+  iter_autnums()  -- parses the lines of autnums.html as they are read, yielding (asn, name)
+  write_asnames_store()  -- writes (asn, name) pairs as a binary AS names store
+  is_asnames_store()  -- tells whether a file is a binary AS names store
+
+Other objects:
+   AsNamesStore: read-only mapping of ASN to name over a (memory-mapped) binary AS names store
+   AsNameIndex: trigram index of AS names, for substring search; built once and saved next to
+                a store, or built in memory
+"""
+
+from __future__ import print_function, division
+from struct import pack, unpack_from
+from mmap import mmap, ACCESS_READ
+from bisect import bisect_left
+from array import array
+from sys import byteorder
+from os import path
+import re
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace  # python 2: replaces the target on posix only
+
+
+ASNAMES_STORE_MAGIC = b'ASNAMES1'
+ASNAME_INDEX_MAGIC = b'ASNTRI01'
+_HEADER_LEN = len(ASNAMES_STORE_MAGIC) + 8  # magic, AS count, name blob length
+
+_AUTNUM_LINE = re.compile(r"<a .+>AS(?P<code>.+?)\s*</a>\s*(?P<name>.*)", re.U)
+
+
+def iter_autnums(lines, encoding='latin-1'):
+    """
+    Parses autnums.html (www.cidr-report.org/as2.0/autnums.html) line by line, as it is read from
+    a file or an HTTP response, without holding it in memory. Lines can be text, or bytes decoded
+    with encoding (latin-1, as served; undecodable bytes are replaced). ASDOT numbers (e.g. AS1.10)
+    are converted to 32-bit ASNs.
+    Yields (asn, name) for each AS, asn as an int.
+    """
+    for line in lines:
+        if not isinstance(line, type(u'')):
+            line = line.decode(encoding, 'replace')
+        if not line.startswith('<a'):
+            continue
+        match = _AUTNUM_LINE.match(line.rstrip('\r\n'))
+        if not match:
+            continue
+        code, name = match.groups()
+        high, _, low = code.partition('.')
+        if not high.isdigit() or (low and not low.isdigit()):
+            continue
+        yield (int(high) << 16) + int(low) if low else int(high), name
+
+
+def write_asnames_store(names, file_name):
+    """
+    Writes AS names to a binary AS names store, read by AsNamesStore.
+    :param names: a dict, or iterable of (asn, name) pairs; later names of an ASN replace earlier
+    :return: the number of ASes stored
+    """
+    if isinstance(names, dict):
+        names = names.items()
+    by_asn = {}
+    for asn, name in names:
+        by_asn[int(asn)] = name
+    asns = sorted(by_asn)
+    blobs = [by_asn[asn].encode('utf-8') for asn in asns]
+    offsets, offset = [], 0
+    for blob in blobs:
+        offsets.append(offset)
+        offset += len(blob)
+    offsets.append(offset)
+    with open(file_name + '.part', 'wb') as f:
+        f.write(ASNAMES_STORE_MAGIC + pack('>II', len(asns), offset))
+        f.write(pack('>%dI' % len(asns), *asns))
+        f.write(pack('>%dI' % len(offsets), *offsets))
+        f.write(b''.join(blobs))
+    replace(file_name + '.part', file_name)
+    return len(asns)
+
+
+def is_asnames_store(file_name):
+    """Returns True if file_name is a binary AS names store (False if not, or if unreadable)"""
+    try:
+        with open(file_name, 'rb') as f:
+            return f.read(len(ASNAMES_STORE_MAGIC)) == ASNAMES_STORE_MAGIC
+    except (IOError, OSError):
+        return False
+
+
+class _BigEndianArray(object):
+    # read-only sequence of the big-endian uint32s at an offset of a buffer, for bisect
+    __slots__ = ('buf', 'offset', 'count')
+
+    def __init__(self, buf, offset, count):
+        self.buf, self.offset, self.count = buf, offset, count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return unpack_from('>I', self.buf, self.offset + 4 * i)[0]
+
+
+class AsNamesStore(object):
+    """
+    AS names from a binary AS names store (see write_asnames_store()): a sorted array of ASNs,
+    an array of offsets into a blob of UTF-8 names, and the blob. The file is memory-mapped on
+    first use, and names are found by binary search; so opening a store costs nothing, and only
+    the names looked up become Python objects.\n
+    Supports the read-only dict operations used on AS names: get(), [], in, len() and items().
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._data = None  # mmap of the file, when first used
+
+    def _open(self):
+        with open(self.file_name, 'rb') as f:
+            data = mmap(f.fileno(), 0, access=ACCESS_READ)
+        if data[:len(ASNAMES_STORE_MAGIC)] != ASNAMES_STORE_MAGIC:
+            data.close()
+            raise ValueError("Not an AS names store: '%s'" % self.file_name)
+        count, blob_len = unpack_from('>II', data, len(ASNAMES_STORE_MAGIC))
+        self._blob_offset = _HEADER_LEN + 8 * count + 4
+        if len(data) != self._blob_offset + blob_len:
+            data.close()
+            raise ValueError("Truncated AS names store: '%s'" % self.file_name)
+        self._asns = _BigEndianArray(data, _HEADER_LEN, count)
+        self._offsets = _BigEndianArray(data, _HEADER_LEN + 4 * count, count + 1)
+        self._data = data
+
+    def _name(self, i):
+        start, end = unpack_from('>II', self._data, self._offsets.offset + 4 * i)
+        return self._data[self._blob_offset + start:self._blob_offset + end].decode('utf-8')
+
+    def _index(self, asn):
+        # position of asn in the ASN array, or None
+        i = bisect_left(self._asns, asn)
+        return i if i < len(self._asns) and self._asns[i] == asn else None
+
+    def get(self, asn, default=None):
+        """Returns the name of asn (an int), or default if it has none"""
+        if self._data is None:
+            self._open()
+        try:
+            i = self._index(int(asn))
+        except (TypeError, ValueError):
+            return default
+        return default if i is None else self._name(i)
+
+    def get_many(self, asns, default=None):
+        """
+        Returns the names of asns, as a list in the same order (default for those without, and
+        for None, as looked up for unrouted addresses)
+        """
+        if self._data is None:
+            self._open()
+        asns = [asn if asn is None else int(asn) for asn in asns]
+        wanted, table = sorted(set(asns) - set([None])), self._asns
+        if len(wanted) * 500 > len(table):
+            # more than a few names: unpacking the ASN array at once (in C) beats unpacking its
+            # items one at a time at each bisect step
+            table = unpack_from('>%dI' % table.count, table.buf, table.offset)
+        found, lo = {}, 0
+        for asn in wanted:  # in order, each search starts where the last one ended
+            lo = bisect_left(table, asn, lo)
+            if lo < len(table) and table[lo] == asn:
+                found[asn] = self._name(lo)
+        return [found.get(asn, default) for asn in asns]
+
+    def search_index(self):
+        """
+        Returns the AsNameIndex of the store: the one saved next to it (file_name + '.tri', see
+        pyasn_util_asnames.py --binary) if there is one, else one built in memory.
+        """
+        if path.exists(self.file_name + '.tri'):
+            return AsNameIndex.load(self.file_name + '.tri', self)
+        return AsNameIndex.build(self)
+
+    def __getitem__(self, asn):
+        name = self.get(asn)
+        if name is None:
+            raise KeyError(asn)
+        return name
+
+    def __contains__(self, asn):
+        return self.get(asn) is not None
+
+    def __len__(self):
+        if self._data is None:
+            self._open()
+        return len(self._asns)
+
+    def __bool__(self):
+        return True  # a store is loaded, even if empty; don't map it just to tell
+
+    __nonzero__ = __bool__
+
+    def items(self):
+        """Yields (asn, name) for every AS, by ASN"""
+        for i in range(len(self)):
+            yield self._asns[i], self._name(i)
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+
+    def __getstate__(self):
+        return {'file_name': self.file_name}  # mmaps aren't pickled; map the file again
+
+    def __setstate__(self, state):
+        self.__init__(state['file_name'])
+
+    def __repr__(self):
+        return "AsNamesStore('%s')" % self.file_name
+
+
+def _trigrams(text):
+    # the byte trigrams of utf-8 text (lower case), as ints; a substring's are among the text's
+    data = bytearray(text.lower().encode('utf-8'))
+    return set((data[i] << 16) | (data[i + 1] << 8) | data[i + 2] for i in range(len(data) - 2))
+
+
+def _match_rank(name, terms):
+    # rank of a name matching all (lower case) terms, lowest first; None if one doesn't match
+    lower = name.lower()
+    positions = [lower.find(term) for term in terms]
+    if -1 in positions:
+        return None
+    first = positions[0]
+    if first == 0:
+        tier = 0  # the name (AS handle) starts with the query
+    elif not lower[first - 1].isalnum():
+        tier = 1  # a word starts with it
+    else:
+        tier = 2
+    return tier, len(name), first
+
+
+class AsNameIndex(object):
+    """
+    Trigram index of AS names, to find the ASes whose names contain a text ("amazon", "telecom")
+    in milliseconds, instead of scanning every name.\n
+    For each (byte) trigram of the lower case names, the index holds the sorted ASNs whose names
+    contain it. A search intersects the ASN lists of the query's trigrams, starting with the
+    shortest, and then checks the few names left. The index is a flat buffer of big-endian
+    arrays (trigrams, list offsets, ASNs), so it is saved as is, and memory-mapped when loaded.\n
+    Build it with AsNameIndex.build(names), and save() it; load it with AsNameIndex.load().
+    """
+
+    def __init__(self, data, names=None):
+        if data[:len(ASNAME_INDEX_MAGIC)] != ASNAME_INDEX_MAGIC:
+            raise ValueError("Not an AS name index")
+        count, total = unpack_from('>II', data, len(ASNAME_INDEX_MAGIC))
+        offset = len(ASNAME_INDEX_MAGIC) + 8
+        if len(data) != offset + 8 * count + 4 + 4 * total:
+            raise ValueError("Truncated AS name index")
+        self._data, self.names = data, names  # names: mapping of ASN to name, for checking matches
+        self._keys = _BigEndianArray(data, offset, count)
+        self._offsets = _BigEndianArray(data, offset + 4 * count, count + 1)
+        self._asns_offset = offset + 8 * count + 4
+
+    @staticmethod
+    def build(names):
+        """
+        Builds the index of names: a dict or AsNamesStore of {asn: name}, which it searches.
+        Takes a few seconds for the full list of ASes.
+        """
+        postings = {}
+        for asn, name in sorted(names.items()):
+            asn = int(asn)
+            for trigram in _trigrams(name):
+                found = postings.get(trigram)
+                if found is None:
+                    found = postings[trigram] = array('I')
+                found.append(asn)
+        keys = sorted(postings)
+        offsets, total = array('I'), 0
+        for key in keys:
+            offsets.append(total)
+            total += len(postings[key])
+        offsets.append(total)
+        asns = array('I')
+        for key in keys:
+            asns.extend(postings[key])
+        parts = [ASNAME_INDEX_MAGIC + pack('>II', len(keys), total)]
+        for a in (array('I', keys), offsets, asns):
+            if byteorder == 'little':
+                a.byteswap()  # stored big-endian
+            parts.append(a.tobytes() if hasattr(a, 'tobytes') else a.tostring())
+        if not isinstance(names, AsNamesStore):
+            names = dict((int(asn), name) for asn, name in names.items())
+        return AsNameIndex(b''.join(parts), names)
+
+    @staticmethod
+    def load(file_name, names):
+        """Loads (memory-maps) a saved index; names are those it was built from"""
+        with open(file_name, 'rb') as f:
+            data = mmap(f.fileno(), 0, access=ACCESS_READ)
+        try:
+            return AsNameIndex(data, names)
+        except ValueError:
+            data.close()
+            raise
+
+    def save(self, file_name):
+        with open(file_name + '.part', 'wb') as f:
+            f.write(self._data[:])
+        replace(file_name + '.part', file_name)
+
+    def _postings(self, trigram):
+        i = bisect_left(self._keys, trigram)
+        if i == len(self._keys) or self._keys[i] != trigram:
+            return ()
+        start, end = unpack_from('>II', self._data, self._offsets.offset + 4 * i)
+        return unpack_from('>%dI' % (end - start), self._data, self._asns_offset + 4 * start)
+
+    def search(self, query, limit=20):
+        """
+        Returns the ASes whose names contain each word of query (case insensitive), as a list of
+        (asn, name), best matches first: names starting with the (first) word, then those with a
+        word starting with it, then the rest; shorter names first within each. limit: the
+        number of matches to return (None for all).
+        """
+        terms = query.lower().split()
+        if not terms:
+            return []
+        trigrams = set()
+        for term in terms:
+            trigrams |= _trigrams(term)
+        if trigrams:
+            lists = sorted((self._postings(trigram) for trigram in trigrams), key=len)
+            candidates = set(lists[0])
+            for found in lists[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(found)
+            candidates = sorted(candidates)
+            names = self.names.get_many(candidates) if isinstance(self.names, AsNamesStore) \
+                else [self.names.get(asn) for asn in candidates]
+            candidates = zip(candidates, names)
+        else:
+            candidates = self.names.items()  # words under 3 bytes: check all names
+        ranked = []
+        for asn, name in candidates:
+            rank = _match_rank(name, terms)
+            if rank is not None:
+                ranked.append((rank, asn, name))
+        ranked.sort()
+        return [(asn, name) for _, asn, name in ranked[:limit]]
+
+    def close(self):
+        if isinstance(self._data, mmap):
+            self._data.close()
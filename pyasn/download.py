@@ -0,0 +1,696 @@
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""pyasn.download
+Module to download MRT/RIB archives (from RouteViews, or a mirror), used by pyasn_util_download.
+
+Functions:
+  download_ribs()  -- downloads the RIB archives of a list of dates, in parallel
+  download_and_convert()  -- converts an archive to an IPASN file while it downloads
+  routeviews_dir_url()  -- URL of the directory of RIB archives of a month (IPv4, IPv6 or both)
+  pick_rib_for_date()  -- chooses the archive of a date from a directory listing
+
+Other objects:
+   Downloader: lists and fetches http(s) and ftp URLs with a pool of worker threads, each
+               keeping its connections open across files; downloads resume where they broke off
+   ArchiveIndex: cached listings of the archive, to find the latest archive or that of a date;
+                 can be kept in a file shared between hosts
+   ArchiveCache: local directory of verified archives, with a manifest of their sizes & checksums
+"""
+
+from __future__ import print_function, division
+from ftplib import FTP, error_temp, error_perm, error_reply
+from multiprocessing.pool import ThreadPool
+from threading import local, Lock, Thread
+from time import time
+from datetime import date
+from calendar import timegm
+from os import path, makedirs, remove, stat, getpid
+from sys import stderr, version_info
+from hashlib import sha256 as new_sha256
+import socket
+import json
+import re
+from . import mrtx
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace  # python 2: replaces the target on posix only
+if version_info[0] < 3:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException, IncompleteRead
+    from urlparse import urlsplit, urljoin
+    from urllib import unquote
+    from Queue import Queue, Full
+else:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException, IncompleteRead
+    from urllib.parse import urlsplit, urljoin, unquote
+    from queue import Queue, Full
+
+
+ROUTEVIEWS_URL = 'http://archive.routeviews.org/'
+# RouteViews collectors, by address family: IPv4, IPv6, and both (route-views4 has both)
+ROUTEVIEWS_DIRS = {'4': 'bgpdata', '6': 'route-views6/bgpdata', '46': 'route-views4/bgpdata'}
+RIB_HOURS = ('06', '05', '00')  # archive of a date: the one saved at 6 AM, else 5 AM, else 0 AM
+
+_HREF = re.compile(r'href\s*=\s*["\']([^"\'?#]+)["\']', re.I)
+_CONTENT_RANGE = re.compile(r'bytes\s+(?:\d+-\d+|\*)/(\d+)')
+
+
+def routeviews_dir_url(dt, ipv='4', base_url=ROUTEVIEWS_URL):
+    """Returns the URL of the RIB archives of the month of dt, for ipv '4', '6' or '46'"""
+    return '%s%s/%d.%02d/RIBS/' % (base_url, ROUTEVIEWS_DIRS[str(ipv)], dt.year, dt.month)
+
+
+def pick_rib_for_date(names, dt, hour=None):
+    """
+    Returns the file name of the RIB archive of date dt among names, or None if there is none.
+    hour: pick the archive saved closest to this hour of the day (e.g. 6), instead of RIB_HOURS.
+    """
+    prefix = 'rib.%d%02d%02d.' % (dt.year, dt.month, dt.day)
+    if hour is not None:
+        target = hour * 60
+        found = []
+        for name in names:
+            hhmm = name[len(prefix):len(prefix) + 4]
+            if name.startswith(prefix) and hhmm.isdigit():
+                found.append((abs(int(hhmm[:2]) * 60 + int(hhmm[2:]) - target), name))
+        return min(found)[1] if found else None
+    for hour in RIB_HOURS:
+        found = sorted(name for name in names if name.startswith(prefix + hour))
+        if found:
+            return found[0]
+    return None
+
+
+class DownloadError(IOError):
+    """An HTTP request for a file that failed (status other than 200)"""
+    pass
+
+
+class Downloader(object):
+    """
+    Fetches http, https and ftp URLs with a bounded pool of worker threads. Each worker keeps its
+    connections (HTTP/1.1 keep-alive, logged in FTP sessions) open across files, so that many small
+    transfers from one server don't each pay for a connection, and the FTP login.\n
+    Directory listings are cached per URL, for the lifetime of the downloader. Downloads resume
+    (FTP REST, HTTP Range) after broken connections, and from the .part files of earlier runs.
+    Call close() at the end to close the connections.
+    """
+    CHUNK = 1 << 16
+
+    def __init__(self, workers=4, timeout=60, retries=3, print_progress=False):
+        self.workers, self.timeout, self.print_progress = workers, timeout, print_progress
+        self.retries = retries  # times a download continues after a broken connection
+        self.connections = 0  # connections opened, for diagnostics
+        self._local = local()  # per thread: {(scheme, host, port): connection}
+        self._lock = Lock()
+        self._open = []
+        self._listings = {}
+        self._listing_lock = Lock()  # one listing at a time, so that each URL is listed once
+
+    def _connection(self, scheme, host, port):
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get((scheme, host, port))
+        if conn is None:
+            if scheme == 'ftp':
+                conn = FTP()
+                conn.connect(host, port or 21, timeout=self.timeout)
+                conn.login()
+            elif scheme in ('http', 'https'):
+                cls = HTTPSConnection if scheme == 'https' else HTTPConnection
+                conn = cls(host, port, timeout=self.timeout)
+            else:
+                raise ValueError("Unsupported URL scheme '%s'" % scheme)
+            conns[(scheme, host, port)] = conn
+            with self._lock:
+                self._open.append(conn)
+                self.connections += 1
+        return conn
+
+    def _drop(self, scheme, host, port):
+        # closes a broken (or idle-timed-out) connection; the next request opens a new one
+        conn = self._local.conns.pop((scheme, host, port), None)
+        if conn is not None:
+            with self._lock:
+                self._open.remove(conn)
+            try:
+                conn.close()
+            except (IOError, OSError):
+                pass
+
+    def _request(self, url, write, offset=0, restart=None):
+        # fetches url from offset, passing its data to write(); retried once on a fresh
+        # connection if the kept-alive one was closed by the server before any data came.
+        # restart() is called if the server can't start at offset, before sending all data.
+        # Returns the size of the file on the server, or None if unknown
+        parts = urlsplit(url)
+        scheme, host, port = parts.scheme, parts.hostname, parts.port
+        written = [0]
+
+        def counting_write(data):
+            written[0] += len(data)
+            write(data)
+        for attempt in (1, 2):
+            conn = self._connection(scheme, host, port)
+            try:
+                if scheme == 'ftp':
+                    return self._request_ftp(conn, unquote(parts.path), counting_write, offset,
+                                             restart)
+                target = parts.path + ('?' + parts.query if parts.query else '')
+                return self._request_http(conn, url, target, counting_write, offset, restart)
+            except DownloadError:
+                raise
+            except (socket.error, HTTPException, EOFError, error_temp):
+                self._drop(scheme, host, port)
+                if attempt == 2 or written[0]:
+                    raise
+
+    def _request_http(self, conn, url, target, write, offset, restart):
+        conn.request('GET', target, headers={'Range': 'bytes=%d-' % offset} if offset else {})
+        response = conn.getresponse()
+        content_range = _CONTENT_RANGE.match(response.getheader('Content-Range') or '')
+        if response.status == 416 and content_range and int(content_range.group(1)) == offset:
+            response.read()
+            return offset  # the partial file is complete
+        if offset and response.status == 200:
+            restart()  # the server doesn't do ranges; all data comes again
+            offset = 0
+        elif response.status not in (200, 206) or (response.status == 206 and not offset):
+            response.read()
+            raise DownloadError("HTTP error %d %s: %s" % (response.status, response.reason, url))
+        if content_range:
+            size = int(content_range.group(1))
+        else:
+            length = response.getheader('Content-Length')
+            size = offset + int(length) if length is not None else None
+        received = offset
+        while True:
+            data = response.read(self.CHUNK)
+            if not data:
+                break
+            write(data)
+            received += len(data)
+        if size is not None and received < size:
+            raise IncompleteRead(b'', size - received)  # the connection broke off
+        return size
+
+    def _request_ftp(self, conn, remote_path, write, offset, restart):
+        conn.voidcmd('TYPE I')
+        try:
+            size = conn.size(remote_path)
+        except error_perm:
+            size = None  # SIZE isn't supported, or no such file (which RETR reports)
+        if offset and size == offset:
+            return size  # the partial file is complete
+        if offset and size is not None and offset > size:
+            restart()  # the file on the server changed
+            offset = 0
+        try:
+            conn.retrbinary('RETR %s' % remote_path, write, self.CHUNK, offset or None)
+        except (error_reply, error_perm):
+            if not offset:
+                raise
+            restart()  # REST isn't supported
+            conn.retrbinary('RETR %s' % remote_path, write, self.CHUNK)
+        return size
+
+    def fetch(self, url):
+        """Returns the content of url"""
+        chunks = []
+        self._request(url, chunks.append)
+        return b''.join(chunks)
+
+    def list_dir(self, url, refresh=False):
+        """
+        Returns the file names in a directory (url ends with '/'), from FTP or an HTML index.
+        refresh: list the directory again, even if it was listed before.
+        """
+        with self._listing_lock:
+            if refresh or url not in self._listings:
+                self._listings[url] = self._list_dir(url)
+            return self._listings[url]
+
+    def _list_dir(self, url):
+        parts = urlsplit(url)
+        if parts.scheme == 'ftp':
+            names = None
+            for attempt in (1, 2):
+                try:
+                    conn = self._connection('ftp', parts.hostname, parts.port)
+                    names = conn.nlst(unquote(parts.path))
+                    break
+                except (socket.error, EOFError, error_temp):
+                    self._drop('ftp', parts.hostname, parts.port)
+                    if attempt == 2:
+                        raise
+        else:
+            html = self.fetch(url).decode('utf-8', 'replace')
+            names = [unquote(href) for href in _HREF.findall(html)]
+            names = [urljoin(url, name) for name in names]
+            names = [name[len(url):] for name in names if name.startswith(url)]
+        return sorted(set(name.rstrip('/').split('/')[-1] for name in names) - set(['']))
+
+    def download(self, url, local_file, resume=True, sha256=None, tee=None):
+        """
+        Downloads url to local_file, through a temporary local_file.part renamed when complete.
+        resume: continue the .part file of an interrupted run; connections that break are
+        resumed in any case (up to `retries` times). The size is checked against the server's
+        (FTP SIZE, HTTP Content-Length), and sha256 is the expected hex digest, if known.
+        tee: optional function that gets all data of the file, in order, as it is downloaded
+        (e.g. to process it meanwhile, see download_and_convert()).
+        :raises: DownloadError if the file is incomplete, or its checksum doesn't match
+        :return: the number of bytes downloaded
+        """
+        t0, tmp_file = time(), local_file + '.part'
+        offset = path.getsize(tmp_file) if resume and path.exists(tmp_file) else 0
+        if tee is not None and offset:
+            with open(tmp_file, 'rb') as f:
+                for data in iter(lambda: f.read(self.CHUNK), b''):
+                    tee(data)  # what the interrupted run got
+        with open(tmp_file, 'ab' if offset else 'wb') as f:
+            def restart():
+                if tee is not None and f.tell():
+                    raise DownloadError("The server can't resume the download: %s" % url)
+                f.seek(0)
+                f.truncate()
+            write = f.write
+            if tee is not None:
+                def write(data):
+                    f.write(data)
+                    tee(data)
+            attempt = 0
+            while True:
+                try:
+                    size = self._request(url, write, f.tell(), restart)
+                    break
+                except DownloadError:
+                    raise
+                except (socket.error, HTTPException, EOFError, error_temp):
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise
+            received = f.tell()
+        if size is not None and received != size:
+            if received > size:
+                remove(tmp_file)
+            raise DownloadError("Incomplete download, %d of %d bytes: %s" % (received, size, url))
+        if sha256 is not None and file_sha256(tmp_file) != sha256.lower():
+            remove(tmp_file)
+            raise DownloadError("Checksum mismatch: %s" % url)
+        replace(tmp_file, local_file)
+        if self.print_progress:
+            print('  %s: %.1f MB in %.1fs%s' % (local_file, (received - offset) / 1e6,
+                                                time() - t0,
+                                                ' (resumed at %d)' % offset if offset else ''),
+                  file=stderr)
+        return received - offset
+
+    def map(self, func, items):
+        """Yields func(item) for each item, as the workers finish them (in any order)"""
+        pool = ThreadPool(min(self.workers, len(items)) or 1)
+        try:
+            for result in pool.imap_unordered(func, items):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    def close(self):
+        """Closes all connections"""
+        with self._lock:
+            conns, self._open = self._open, []
+        for conn in conns:
+            try:
+                if isinstance(conn, FTP):
+                    conn.quit()
+                else:
+                    conn.close()
+            except (IOError, OSError, EOFError, error_temp):
+                pass
+
+
+def file_sha256(file_name):
+    """Returns the hex SHA-256 digest of a file"""
+    digest = new_sha256()
+    with open(file_name, 'rb') as f:
+        for data in iter(lambda: f.read(1 << 20), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class ArchiveCache(object):
+    """
+    Local directory of downloaded archives, laid out like the URL paths they come from, with a
+    manifest (manifest.json) of the URL, size and SHA-256 digest of each one.
+
+    fetch() downloads an archive only if it isn't in the cache already, intact; re-running a
+    download of a cached archive is a no-op. Interrupted downloads are resumed.
+    """
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not path.isdir(cache_dir):
+            makedirs(cache_dir)
+        self._lock = Lock()
+        self.entries = {}  # {file path relative to cache_dir: {'url', 'size', 'sha256', ...}}
+        manifest = path.join(cache_dir, self.MANIFEST)
+        if path.exists(manifest):
+            with open(manifest) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def _key(url):
+        # file path of url in the cache, relative to cache_dir ('/' separated)
+        parts = urlsplit(url)
+        return '/'.join([parts.hostname or 'localhost'] +
+                        [unquote(p) for p in parts.path.split('/') if p not in ('', '.', '..')])
+
+    def local_file(self, url):
+        """Returns the path at which url is (or would be) stored in the cache"""
+        return path.join(self.cache_dir, *self._key(url).split('/'))
+
+    def lookup(self, url, verify=False):
+        """
+        Returns the local file of url if it is in the cache, with its size as downloaded; with
+        verify=True its SHA-256 digest is checked as well. Returns None otherwise.
+        """
+        entry, local_file = self.entries.get(self._key(url)), self.local_file(url)
+        if entry is None or entry['url'] != url or not path.exists(local_file) \
+           or path.getsize(local_file) != entry['size']:
+            return None
+        if verify and file_sha256(local_file) != entry['sha256']:
+            return None
+        return local_file
+
+    def fetch(self, downloader, url, sha256=None, verify=False):
+        """
+        Returns the local file of url, downloading it (with a Downloader) if not cached.
+        sha256: expected hex digest, if known; verify: re-check the digest of a cached file.
+        """
+        local_file = self.lookup(url, verify)
+        if local_file and sha256 in (None, self.entries[self._key(url)]['sha256']):
+            return local_file
+        local_file = self.prepare(url)
+        downloader.download(url, local_file, sha256=sha256)
+        self.add(url, sha256)
+        return local_file
+
+    def prepare(self, url):
+        """Returns the local file of url, making its directory; for downloads made elsewhere"""
+        local_file = self.local_file(url)
+        if not path.isdir(path.dirname(local_file)):
+            try:
+                makedirs(path.dirname(local_file))
+            except OSError:
+                pass  # made by another worker meanwhile
+        return local_file
+
+    def add(self, url, sha256=None):
+        """Adds the (downloaded) local file of url to the manifest"""
+        local_file = self.local_file(url)
+        entry = {'url': url, 'size': path.getsize(local_file),
+                 'sha256': sha256 or file_sha256(local_file), 'downloaded': int(time())}
+        with self._lock:
+            self.entries[self._key(url)] = entry
+            self._save()
+
+    def _save(self):
+        manifest = path.join(self.cache_dir, self.MANIFEST)
+        with open(manifest + '.part', 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        replace(manifest + '.part', manifest)
+
+
+class ArchiveIndex(object):
+    """
+    Index of the RIB archives of RouteViews (or a mirror), made of cached directory listings, to
+    find the latest archive, or that of a date, without listing the archive on every run.\n
+    Each listing is kept with the time it was made. The list of months, and listings of a month
+    made before the month was over, are listed again once older than ttl seconds; the listing of
+    a month made after it was over is final, and kept for past_ttl seconds (default: forever).\n
+    index_file: JSON file to keep the listings in between runs. It can be shared between hosts
+    (e.g. on a network file system): it is re-read when another host has changed it, and is
+    replaced atomically, with the listings of both merged.
+    """
+    GRACE = 86400  # seconds after the end of a month during which late archives may still appear
+    _MONTH = re.compile(r'^(\d{4})\.(\d{2})$')
+
+    def __init__(self, base_url=ROUTEVIEWS_URL, index_file=None, ttl=3600, past_ttl=None,
+                 downloader=None):
+        self.base_url, self.index_file = base_url, index_file
+        self.ttl, self.past_ttl = ttl, past_ttl
+        self.downloader = downloader or Downloader(1)
+        self._own_downloader = downloader is None
+        self.listings = {}  # {directory URL: {'names': [...], 'listed': unix time}}
+        self.listed = 0  # directories listed, rather than answered from the index (diagnostics)
+        self._lock = Lock()
+        self._file_id = None
+        self._reload()
+
+    def months(self, ipv='4'):
+        """Returns the months in the archive of ipv ('4', '6' or '46'), as sorted (year, month)"""
+        root = '%s%s/' % (self.base_url, ROUTEVIEWS_DIRS[str(ipv)])
+        found = (self._MONTH.match(name) for name in self._names(root))
+        return sorted((int(m.group(1)), int(m.group(2))) for m in found if m)
+
+    def latest(self, ipv='4'):
+        """Returns the URL of the latest RIB archive of ipv ('4', '6' or '46')"""
+        months = self.months(ipv)
+        for year, month in reversed(months[-2:]):  # the newest month may have no archives yet
+            dir_url = routeviews_dir_url(date(year, month, 1), ipv, self.base_url)
+            ribs = [name for name in self._names(dir_url, (year, month)) if name.startswith('rib.')]
+            if ribs:
+                return dir_url + max(ribs)
+        raise LookupError("No RIB archives found in the latest months of IPV%s" % ipv)
+
+    def for_date(self, dt, ipv='4', hour=None):
+        """
+        Returns the URL of the RIB archive of date dt (see pick_rib_for_date(); hour=6 picks the
+        one closest to 06:00), or None if there is none.
+        """
+        dir_url = routeviews_dir_url(dt, ipv, self.base_url)
+        name = pick_rib_for_date(self._names(dir_url, (dt.year, dt.month)), dt, hour)
+        return dir_url + name if name else None
+
+    def _names(self, url, month=None):
+        # listing of the directory url, from the index while fresh; month: (year, month) it holds
+        with self._lock:
+            self._reload()
+            entry = self.listings.get(url)
+            if entry is not None and self._fresh(entry, month):
+                return entry['names']
+            names = sorted(self.downloader.list_dir(url, refresh=True))
+            self.listed += 1
+            self.listings[url] = {'names': names, 'listed': time()}
+            self._save()
+            return names
+
+    def _fresh(self, entry, month):
+        ttl = self.ttl
+        if month is not None:
+            year, month = month[0] + month[1] // 12, month[1] % 12 + 1
+            if entry['listed'] >= timegm((year, month, 1, 0, 0, 0)) + self.GRACE:
+                ttl = self.past_ttl
+        return ttl is None or time() - entry['listed'] < ttl
+
+    def _reload(self):
+        # merges the listings of the index file into ours, if it changed since we last read it
+        if not self.index_file or not path.exists(self.index_file):
+            return
+        st = stat(self.index_file)
+        if (st.st_ino, st.st_mtime, st.st_size) == self._file_id:
+            return
+        with open(self.index_file) as f:
+            listings = json.load(f)
+        for url, entry in listings.items():
+            if url not in self.listings or self.listings[url]['listed'] < entry['listed']:
+                self.listings[url] = entry
+        self._file_id = (st.st_ino, st.st_mtime, st.st_size)
+
+    def _save(self):
+        if not self.index_file:
+            return
+        self._reload()  # keep what other hosts listed meanwhile
+        part = '%s.%s-%d.part' % (self.index_file, socket.gethostname(), getpid())
+        with open(part, 'w') as f:
+            json.dump(self.listings, f, indent=1, sort_keys=True)
+        replace(part, self.index_file)
+        st = stat(self.index_file)
+        self._file_id = (st.st_ino, st.st_mtime, st.st_size)
+
+    def close(self):
+        """Closes the connections of the index's own downloader"""
+        if self._own_downloader:
+            self.downloader.close()
+
+
+def download_ribs(dates, ipv='4', workers=4, base_url=ROUTEVIEWS_URL, out_dir='.',
+                  print_progress=False, cache_dir=None, index=None):
+    """
+    Downloads the RIB archive of each date (see pick_rib_for_date()), with a pool of workers.
+    Each month is listed once, and connections are reused across files.\n
+    ipv: collector(s) to use, '4', '6' or '46' (see ROUTEVIEWS_DIRS).
+    base_url: the archive's root, e.g. a local mirror.
+    cache_dir: keep the archives in an ArchiveCache there instead of out_dir, downloading only
+    those not in it yet.
+    index: an ArchiveIndex to find the archives with (its base_url is used), instead of listing
+    each month.
+    Yields (date, url, local file, size, error) as they finish; url is None if no archive is
+    found, and error is None if the download succeeded.
+    """
+    downloader = Downloader(workers, print_progress=print_progress)
+    cache = ArchiveCache(cache_dir) if cache_dir else None
+
+    def job(dt):
+        url = local_file = None
+        try:
+            if index is not None:
+                url = index.for_date(dt, ipv)
+            else:
+                dir_url = routeviews_dir_url(dt, ipv, base_url)
+                name = pick_rib_for_date(downloader.list_dir(dir_url), dt)
+                url = dir_url + name if name else None
+            if url is None:
+                return dt, None, None, None, "not found"
+            name = url.rsplit('/', 1)[1]
+            if cache is not None:
+                local_file = cache.fetch(downloader, url)
+            else:
+                local_file = path.join(out_dir, name)
+                downloader.download(url, local_file)
+            return dt, url, local_file, path.getsize(local_file), None
+        except Exception as e:
+            return dt, url, local_file, None, "%s: %s" % (type(e).__name__, e)
+    try:
+        for result in downloader.map(job, list(dates)):
+            yield result
+    finally:
+        downloader.close()
+
+
+class _StreamPipe(object):
+    # bounded, thread-safe byte pipe from a download (write) to the parser (read)
+    def __init__(self, max_chunks=256):
+        self._queue = Queue(max_chunks)
+        self._buf, self._pos, self._eof = b'', 0, False
+        self.error, self.aborted = None, False
+
+    def _put(self, item):
+        # blocks while the pipe is full, unless the reading side gave up
+        while not self.aborted:
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except Full:
+                pass
+        return False
+
+    def write(self, data):
+        if not self._put(data):
+            raise DownloadError("Aborted, the conversion of the download failed")
+
+    def close(self, error=None):
+        # end of the data; error is the exception that ended the download, if it failed
+        self.error = error
+        self._put(None)
+
+    def read(self, size=-1):
+        # blocks until there are size bytes (all, if size < 0), or the download ends
+        buf, pos = self._buf, self._pos
+        if 0 <= size <= len(buf) - pos:
+            self._pos = pos + size
+            return buf[pos:pos + size]
+        chunks, have = [buf[pos:]], len(buf) - pos
+        while (size < 0 or have < size) and not self._eof:
+            data = self._queue.get()
+            if data is None:
+                self._eof = True
+                if self.error is not None:
+                    raise DownloadError("Download failed: %s" % self.error)
+                break
+            chunks.append(data)
+            have += len(data)
+        buf = b''.join(chunks)
+        if size < 0 or size >= len(buf):
+            self._buf, self._pos = b'', 0
+            return buf
+        self._buf, self._pos = buf, size
+        return buf[:size]
+
+    def close_reader(self):
+        self.aborted = True
+
+
+def download_and_convert(url, ipasn_file, archive_file=None, cache=None, downloader=None,
+                         compress=None, binary=False, print_progress=False, **parse_options):
+    """
+    Downloads an MRT/RIB archive and converts it to an IPASN file in one pass: the data is
+    decompressed and parsed (by mrtx.parse_mrt_file(), which gets parse_options) as it arrives,
+    and saved to archive_file (default: its name in url). As download and parse overlap, this
+    takes about as long as the slower of the two, instead of their sum.\n
+    cache: an ArchiveCache to save the archive in, instead of archive_file; an archive already
+    in it is converted without downloading it.
+    compress, binary: IPASN output options, see mrtx.dump_prefixes_to_file().
+    :return: the prefix table (a CompactPrefixTable)
+    """
+    if cache is not None and cache.lookup(url):
+        prefixes = mrtx.parse_mrt_file(cache.lookup(url), print_progress=print_progress,
+                                       compact=True, **parse_options)
+        mrtx.dump_prefixes_to_file(prefixes, ipasn_file, url, compress=compress, binary=binary)
+        return prefixes
+    if cache is not None:
+        archive_file = cache.prepare(url)
+    elif archive_file is None:
+        archive_file = path.basename(unquote(urlsplit(url).path))
+    own_downloader = downloader is None
+    if own_downloader:
+        downloader = Downloader(1, print_progress=print_progress)
+    pipe = _StreamPipe()
+
+    def fetch():
+        try:
+            downloader.download(url, archive_file, tee=pipe.write)
+        except Exception as e:
+            pipe.close(e)
+            return
+        pipe.close()
+    thread = Thread(target=fetch)
+    thread.daemon = True
+    thread.start()
+    try:
+        prefixes = mrtx.parse_mrt_file(mrtx.open_archive_stream(pipe),
+                                       print_progress=print_progress, compact=True,
+                                       **parse_options)
+        while pipe.read(1 << 20):
+            pass  # anything after the last record; the download has to complete
+    except BaseException:
+        pipe.close_reader()
+        raise
+    finally:
+        thread.join()
+        if own_downloader:
+            downloader.close()
+    if cache is not None:
+        cache.add(url)
+    mrtx.dump_prefixes_to_file(prefixes, ipasn_file, url, compress=compress, binary=binary)
+    return prefixes
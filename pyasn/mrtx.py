@@ -28,87 +28,303 @@ Module to parse MRT/RIB BGP table dumps (in order to create the IPASN database).
 
 Functions:
   parse_mrt_file()  -- main function
-  util_dump_prefixes_to_textfile()
+  open_archive(), open_archive_stream()  -- opens (compressed) MRT archives, from files or streams
+  parse_mrt_file_origin_counts()  -- origins seen by all peers, per prefix
+  parse_mrt_files_merged()  -- merges several MRT/RIB archives (e.g. multiple collectors)
+  apply_bgp_updates()  -- applies MRT BGP4MP update archives to a pyasn, Radix, or prefix table
+  build_mrt_index(), get_record()  -- random access to the records of an archive
+  dump_prefixes_to_file()  -- writes IPASN files (text or binary, optionally compressed)
+  read_ipasn_binary_file()
+  diff_prefixes()  -- changes (PrefixChange) between two IPASN databases, prefix tables or RIBs
 
 Other objects:
+   CompactPrefixTable: memory-compact container for parse_mrt_file() output (compact=True)
+   IpasnWriter: buffered, streaming writer of IPASN files
+   MrtIndex: record offsets and prefix map of an archive (sidecar index file)
+   AsGraph: AS adjacency graph and upstreams of origins, from all AS_PATHs (build_as_graph())
+   PrefixFilter: selects the networks (or address family) parse_mrt_file() converts
+   ConversionStats: timings and counts of a parse_mrt_file() run, with progress callbacks
+   ConversionCheckpoint: periodic saves of a parse_mrt_file() run, to resume it if interrupted
    MRT* and pyasn.mrtx.BGP* classes: internally used to hold and parse the MRT dumps.
 """
 
 from __future__ import print_function, division
 from socket import inet_ntoa, inet_aton, AF_INET, AF_INET6
-from struct import unpack, pack
+from struct import unpack, unpack_from, pack, Struct, error as struct_error
+from io import BufferedReader
+from array import array
+from itertools import chain
 from time import time, asctime
-from sys import stderr, version_info, stdout
-from bz2 import BZ2File
+from sys import stderr, version_info, stdout, byteorder
+from bz2 import BZ2File, decompress as decompress_bz2
+from binascii import hexlify, unhexlify
+from zlib import crc32
+from bisect import bisect_left, bisect_right
+from mmap import mmap, ACCESS_READ
+from os import stat, remove
+from os.path import exists
 from gzip import GzipFile
+from multiprocessing import Pool, cpu_count
+import json
 try:
     from collections import OrderedDict
 except ImportError:
     # python 2.6 support - needs the ordereddict module
     from ordereddict import OrderedDict
 try:
-    from socket import inet_ntop
+    from socket import inet_ntop, inet_pton
 except ImportError:
     # inet_ntop is only available on unix
     pass
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace  # python 2: replaces the target on posix only
+try:
+    from lzma import LZMAFile
+except ImportError:
+    LZMAFile = None  # python 2; needed only for xz archives
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # optional; only needed for zstd archives or compressed IPASN files
 
 IS_PYTHON2 = (version_info[0] == 2)
 
 
-def open_archive(fpath):
-    """Open a bz2 or gzip archive."""
+_ARCHIVE_MAGICS = ((b"\x42\x5a\x68", 'bz2'), (b"\x1f\x8b", 'gzip'), (b"\xfd7zXZ\x00", 'xz'),
+                   (b"\x28\xb5\x2f\xfd", 'zstd'))
+
+
+def _archive_kind(hdr):
+    # archive type from its first 12 bytes: 'bz2', 'gzip', 'xz', 'zstd', 'raw' (MRT), or None
+    for magic, kind in _ARCHIVE_MAGICS:
+        if hdr.startswith(magic):
+            return kind
+    if len(hdr) == 12 and unpack('>IHHI', hdr)[1] in (MrtRecord.TYPE_TABLE_DUMP,
+                                                       MrtRecord.TYPE_TABLE_DUMP_V2,
+                                                       MrtRecord.TYPE_BGP4MP,
+                                                       MrtRecord.TYPE_BGP4MP_ET):
+        return 'raw'
+    return None
+
+
+def open_archive(fpath, raw_file=None):
+    """Open a bz2, gzip, xz or zstd archive, or an uncompressed MRT file (memory-mapped).
+    raw_file: optional file-object of fpath to read the archive through (e.g. to count bytes)."""
     # Thanks to Chris poliquin for this method (https://github.com/poliquin)
-    mode = "rb"
-    GZIP_MAGIC, BZ2_MAGIC = b"\x1f\x8b", b"\x42\x5a\x68"  # magic numbers
-    with open(fpath, mode) as fh:
-        hdr = fh.read(max(len(BZ2_MAGIC), len(GZIP_MAGIC)))
-    if hdr.startswith(BZ2_MAGIC):
-        return BZ2File(fpath, mode)
-    elif hdr.startswith(GZIP_MAGIC):
-        return GzipFile(fpath, mode)
-    else:
+    with open(fpath, "rb") as fh:
+        hdr = fh.read(12)  # long enough for the magic numbers, and an MRT header
+    kind = _archive_kind(hdr)
+    if kind is None:
         raise TypeError("Cannot determine file type '%s'" % fpath)
+    if kind == 'raw' and raw_file is None:
+        return _mmap_file(fpath)  # uncompressed MRT
+    return _open_archive_kind(kind, fpath if raw_file is None else raw_file)
+
+
+def open_archive_stream(stream):
+    """Open a bz2, gzip, xz, zstd or uncompressed MRT archive from a file-like object read from
+    its start (e.g. a download in progress); the kind is recognized from its first bytes."""
+    hdr = stream.read(12)
+    kind = _archive_kind(hdr)
+    if kind is None:
+        raise TypeError("Cannot determine archive type of stream")
+    return _open_archive_kind(kind, _PrefixedReader(hdr, stream))
+
+
+def _open_archive_kind(kind, f):
+    # opens an archive of a known kind, from a path or a file-object
+    is_path = not hasattr(f, 'read')
+    if kind == 'bz2':
+        return BZ2File(f, "rb")
+    elif kind == 'gzip':
+        return GzipFile(f, "rb") if is_path else GzipFile(fileobj=f, mode="rb")
+    elif kind == 'xz':
+        if LZMAFile is None:
+            raise ImportError("xz archives need the 'lzma' module (python 3.3+)")
+        return LZMAFile(f, "rb")
+    elif kind == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd archives need the 'zstandard' module")
+        return BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+            open(f, "rb") if is_path else f, read_across_frames=True))
+    return open(f, "rb") if is_path else f  # raw
+
+
+class _PrefixedReader(object):
+    # file-like object that reads `head` (bytes already read from a stream), then the stream;
+    # tell() is the position in both (streams such as downloads needn't have one), which
+    # checkpoints of raw archives save
+    def __init__(self, head, stream):
+        self._head, self._stream, self._offset = head, stream, 0
+
+    def read(self, size=-1):
+        if not self._head:
+            data = self._stream.read(size)
+        elif size is None or size < 0:
+            data, self._head = self._head + self._stream.read(), b''
+        else:
+            data, self._head = self._head[:size], self._head[size:]
+        self._offset += len(data)
+        return data
+
+    def tell(self):
+        return self._offset
+
+
+    def close(self):
+        self._stream.close()
+
+
+def _mmap_file(fpath):
+    # uncompressed MRT files are memory-mapped: mmap's read() slices records straight from the
+    # page cache, without read system calls and a copy into a read buffer
+    with open(fpath, 'rb') as f:
+        return mmap(f.fileno(), 0, access=ACCESS_READ)
 
 
 def parse_mrt_file(mrt_file,
                    print_progress=False,
-                   skip_record_on_error=False):
-    """parse_file(file, print_progress=False, skip_record_on_error=False):
+                   skip_record_on_error=False,
+                   compact=False,
+                   stats=None,
+                   prefix_filter=None,
+                   peers=None,
+                   checkpoint=None):
+    """parse_file(file, print_progress=False, skip_record_on_error=False, compact=False,
+           stats=None, prefix_filter=None, peers=None, checkpoint=None):
 Parses an MRT/RIB BGP table dump file.\n
     in: file-object or string-path to a MRT/RIB archive (.gz/.bz2)
     out: { "NETWORK/MASK" : ASN | set([Originating ASNs]) }
 \n
 The originating ASN is usually one; however, for some prefixes it can be a set.
+With compact=True, the output is a CompactPrefixTable (same read API, far less memory).
+Pass a ConversionStats object as stats to collect timings and counts (and get progress callbacks).
+A PrefixFilter as prefix_filter limits the output to some networks or an address family; other
+records are skipped before their prefix is formatted or their attributes are parsed.
+With peers (a collection of peer IPs or BGP IDs as strings, and/or peer ASNs as ints), origins
+come only from the routes of those peers; RIB entries of other peers are skipped by length.
+A ConversionCheckpoint as checkpoint periodically saves the parse, and can resume it from there.
 \n
 Both version 1 & 2 TABLE_DUMPS are supported, as well as 32bit ASNs and IPv6."""
-    prefixes, t0, n = OrderedDict(), time(), 0
-
-    if type(mrt_file) is str:
+    prefixes, t0, n = CompactPrefixTable() if compact else OrderedDict(), time(), 0
+    seen_td1 = set()  # dict mode: raw network & mask bytes of TDv1 prefixes, to skip repetitions
+    last_td1 = None  # compact mode: those of the last TDv1 prefix (peers' routes are adjacent)
+    peer_indexes = None  # with peers: positions of the chosen peers in the TDv2 peer index table
+    archive = mrt_file if type(mrt_file) is str else None  # opened here, and closed at the end
+    restored = checkpoint.load(archive, compact) \
+        if checkpoint is not None and checkpoint.resume else None
+    if restored:
+        prefixes, state = restored
+        if state['compact'] != compact or state['peers'] != _peers_state(peers) or \
+           state.get('prefix_filter') != _filter_state(prefix_filter):
+            raise ValueError("Checkpoint '%s' was made with other options" % checkpoint.file_name)
+        n, peer_indexes = state['records'], state['peer_indexes']
+        peer_indexes = frozenset(peer_indexes) if peer_indexes is not None else None
+        if not compact:  # prefixes in the table are what TDv1 repetitions are recognized by
+            for prefix in prefixes:
+                _, network, masklen = CompactPrefixTable._split(prefix)
+                seen_td1.add(network + pack('B', masklen))
+        if print_progress:
+            print('Resuming at MRT record %d, with %d prefixes' % (n, len(prefixes)), file=stderr)
+
+    if stats is not None:
+        mrt_file = stats.start(mrt_file)  # wraps the file to time and count the reads
+    elif type(mrt_file) is str:
         # callee passed a string-path, open it. file will close when this method ends.
         # (we could alternatively try mrt_file.tell() to test if it's file-like.)
         mrt_file = open_archive(mrt_file)
+    if restored:
+        _skip_to(mrt_file, state['offset'])
+    next_checkpoint = n + checkpoint.interval if checkpoint is not None else None
+    read = mrt_file.read
 
     while True:
-        mrt = MrtRecord.next_dump_table_record(mrt_file)
-        if not mrt:
+        if stats is not None:
+            t1 = time()
+        header = read(12)
+        if not header:
             # EOF
             break
+        _, mrt_type, sub_type, data_len = _UNPACK_MRT_HEADER(header)
+        buf = read(data_len)
+        assert len(buf) == data_len
+        if mrt_type == MrtRecord.TYPE_TABLE_DUMP:
+            # TDv1 archives repeat prefixes a lot (once per peer); we keep the first. Repetitions
+            # are recognized by the prefix & mask bytes, and skipped without parsing the record.
+            key = buf[4:9] if sub_type == MrtRecord.T1_AFI_IPv4 else buf[4:21]
+            if (key == last_td1 or
+                    prefixes.has_packed(4 if len(key) == 5 else 6, key[:-1], ord(key[-1:]))
+                    if compact else key in seen_td1):
+                n += 1
+                if stats is not None:
+                    stats.records += 1
+                    stats.duplicates += 1
+                if print_progress and n % 500000 == 0:
+                    print("  MRT record %d @%.fs" % (n, time() - t0), file=stderr)
+                continue
+        mrt = MrtRecord(header)
+        mrt.parse_detail(buf, prefix_filter=prefix_filter)
+        if stats is not None:
+            stats.phase_seconds['records'] += time() - t1  # read time is subtracted at the end
+            stats.records += 1
 
         if not mrt.detail \
            or (mrt.type == mrt.TYPE_TABLE_DUMP_V2 and mrt.sub_type == MrtRecord.T2_PEER_INDEX):
             # not a prefix/as-path entry
             if print_progress:
                 print('Parsing MRT/RIB archive .. ', mrt, file=stderr)
+            if mrt.detail and peers is not None:
+                peer_indexes = mrt.detail.select_peers(peers)
+                if print_progress:
+                    print('  using %d of %d peers' % (len(peer_indexes), mrt.detail.peer_count),
+                          file=stderr)
             continue
+        if mrt.type not in (mrt.TYPE_TABLE_DUMP, mrt.TYPE_TABLE_DUMP_V2):
+            continue  # BGP4MP updates, see apply_bgp_updates()
+        if mrt.detail.filtered_out:
+            continue  # not in prefix_filter
+        if peers is not None and mrt.type == mrt.TYPE_TABLE_DUMP \
+           and mrt.detail.peer_ip not in peers and mrt.detail.peer_as not in peers:
+            continue  # TDv1 records hold the route of one peer
+
+        if compact:
+            # work on the packed prefix; strings are only formatted for warnings
+            family, network, masklen = mrt.packed_prefix
+            if not masklen:
+                continue  # default route, removed below for the dict case
+            is_new = not prefixes.has_packed(family, network, masklen)
+        else:
+            is_new = mrt.prefix not in prefixes
 
-        if mrt.prefix not in prefixes:
+        if is_new:
             try:
-                origin = mrt.get_first_origin_as()
-                prefixes[mrt.prefix] = origin
+                if stats is not None:
+                    t1 = time()
+                    origin = mrt.get_first_origin_as(peer_indexes=peer_indexes)
+                    stats.phase_seconds['origins'] += time() - t1
+                    stats.prefixes += origin is not None
+                    stats.as_sets += isinstance(origin, set)
+                else:
+                    origin = mrt.get_first_origin_as(peer_indexes=peer_indexes)
+                if origin is None:
+                    continue  # none of the chosen peers has a route for the prefix
+                if compact:
+                    prefixes.add(family, network, masklen, origin)
+                else:
+                    prefixes[mrt.prefix] = origin
+                if mrt_type == MrtRecord.TYPE_TABLE_DUMP:
+                    if compact:
+                        last_td1 = key
+                    else:
+                        seen_td1.add(key)
             except IndexError:
                 if skip_record_on_error:
                     if print_progress:
                         print("  WARNING: can't get_origin_as for prefix", mrt.prefix, file=stderr)
+                    if stats is not None:
+                        stats.skipped += 1
                     continue
                 else:
                     raise
@@ -116,6 +332,8 @@ Both version 1 & 2 TABLE_DUMPS are supported, as well as 32bit ASNs and IPv6."""
                 print("  Exception parsing prefix record", mrt.prefix, file=stderr)
                 raise  # raise it again
         else:
+            if stats is not None:
+                stats.duplicates += 1
             # Repeated prefix, WARN if different.
             # In TD1, repeated prefixes were normal. We cared only about 'first-match'...
             # In TD2, until recently (201701), the MRT/RIB files typically didn't repeat prefixes.
@@ -124,41 +342,1076 @@ Both version 1 & 2 TABLE_DUMPS are supported, as well as 32bit ASNs and IPv6."""
             # Note, we check only for TDV2. On 20170102, 4 differ out of 600k prefixes.
             #   In TDv1, there were many many reptitions, bogging the conversion.
             if mrt.type == mrt.TYPE_TABLE_DUMP_V2:
-                was = prefixes[mrt.prefix]
-                new = mrt.get_first_origin_as(ignore_exception=True)
-                if was != new and print_progress:
-                    was = "{%d ASes}" % len(was) if type(was) is set else str(was)
-                    new = "{%d ASes}" % len(new) if type(new) is set else str(new)
-                    print("  WARNING: repeated prefix '%s' maps to different origin (%s vs %s)"
-                          % (mrt.prefix, was, new), file=stderr)
+                _warn_repeated_prefix(mrt.prefix, prefixes[mrt.prefix],
+                                      mrt.get_first_origin_as(ignore_exception=True),
+                                      print_progress)
         #
         n += 1
         if print_progress and n % (100000 if mrt.type == mrt.TYPE_TABLE_DUMP_V2 else 500000) == 0:
             print("  MRT record %d @%.fs" % (n, time() - t0), file=stderr)
+        if stats is not None and n % stats.interval == 0:
+            stats.report()
+        if checkpoint is not None and n >= next_checkpoint:
+            checkpoint.save(prefixes, {'records': n, 'offset': mrt_file.tell(), 'compact': compact,
+                                       'peers': _peers_state(peers),
+                                       'prefix_filter': _filter_state(prefix_filter),
+                                       'peer_indexes': sorted(peer_indexes)
+                                       if peer_indexes is not None else None}, archive)
+            next_checkpoint = n + checkpoint.interval
     #
     if '0.0.0.0/0' in prefixes:
         del prefixes['0.0.0.0/0']  # remove default route - can be parameter
     if '::/0' in prefixes:
         del prefixes['::/0']  # similarly for IPv6
+    if stats is not None:
+        stats.prefixes = len(prefixes)  # without default routes
+        stats.report(finished=True)
+    if archive is not None:
+        mrt_file.close()
     return prefixes
 
 
+class ConversionStats(object):
+    """
+    Instrumentation for parse_mrt_file(..., stats=ConversionStats()). Collects counts, bytes read
+    and time per phase; the numbers are readable as attributes, or as a dict with as_dict().\n
+    Phases: 'read' is reading the archive (I/O and decompression), 'records' is decoding MRT
+    records (headers, prefixes, and for TDv2 the first entry's attributes), 'origins' is getting
+    the origin AS (incl. TDv1 attribute parsing), and 'other' the rest (mostly the prefix table).\n
+    callback(stats) is called every `interval` prefix records and once at the end; e.g. pass
+    json_lines_callback(stream) to write a JSON line each time. Without a stats object,
+    parse_mrt_file() only pays a few 'is None' checks per record.
+    """
+
+    def __init__(self, callback=None, interval=100000):
+        self.callback, self.interval = callback, interval
+        self.archive, self.finished = None, False
+        self.records = self.prefixes = self.duplicates = self.as_sets = self.skipped = 0
+        self.compressed_bytes = self.uncompressed_bytes = None
+        self.phase_seconds = {'read': 0.0, 'records': 0.0, 'origins': 0.0}
+        self.t0 = self.elapsed = 0.0
+
+    def start(self, mrt_file):
+        # opens (if a path) and wraps mrt_file, counting and timing the reads
+        self.t0 = time()
+        raw = None
+        if type(mrt_file) is str:
+            self.archive, self.compressed_bytes = mrt_file, 0
+            raw = open(mrt_file, 'rb')
+            try:
+                mrt_file = open_archive(mrt_file, _StatsReader(raw, self, 'compressed_bytes'))
+            except Exception:
+                raw.close()
+                raise
+        self.uncompressed_bytes = 0
+        return _StatsReader(mrt_file, self, 'uncompressed_bytes', timed=True, owned=raw)
+
+    def report(self, finished=False):
+        self.elapsed, self.finished = time() - self.t0, finished
+        if self.callback:
+            self.callback(self)
+
+    def as_dict(self):
+        elapsed = max(self.elapsed, 1e-9)
+        phases = dict(self.phase_seconds)
+        phases['records'] = max(phases['records'] - phases['read'], 0.0)  # reads are nested
+        phases['other'] = max(elapsed - sum(phases.values()), 0.0)
+        return {'archive': self.archive, 'finished': self.finished, 'elapsed': elapsed,
+                'records': self.records, 'prefixes': self.prefixes,
+                'duplicates': self.duplicates, 'as_sets': self.as_sets, 'skipped': self.skipped,
+                'compressed_bytes': self.compressed_bytes,
+                'uncompressed_bytes': self.uncompressed_bytes,
+                'records_per_sec': self.records / elapsed,
+                'compressed_bytes_per_sec': self.compressed_bytes / elapsed
+                if self.compressed_bytes is not None else None,
+                'uncompressed_bytes_per_sec': self.uncompressed_bytes / elapsed
+                if self.uncompressed_bytes is not None else None,
+                'phase_seconds': phases}
+
+    def __repr__(self):
+        return "ConversionStats(%d records, %d prefixes, %.1fs)" % (self.records, self.prefixes,
+                                                                    self.elapsed)
+
+
+def json_lines_callback(stream):
+    """Returns a ConversionStats callback that writes the stats to stream as JSON lines"""
+    def callback(stats):
+        stream.write(json.dumps(stats.as_dict(), sort_keys=True) + '\n')
+        stream.flush()
+    return callback
+
+
+class _StatsReader(object):
+    # file wrapper for ConversionStats: counts bytes read into a stats attribute (and times reads)
+    def __init__(self, f, stats, counter, timed=False, owned=None):
+        self._f, self._stats, self._counter, self._timed = f, stats, counter, timed
+        self._owned = owned  # the compressed file under f, closed with it
+
+    def read(self, size=-1):
+        if self._timed:
+            t = time()
+            data = self._f.read(size)
+            self._stats.phase_seconds['read'] += time() - t
+        else:
+            data = self._f.read(size)
+        setattr(self._stats, self._counter, getattr(self._stats, self._counter) + len(data))
+        return data
+
+    def close(self):
+        self._f.close()
+        if self._owned is not None:
+            self._owned.close()
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)  # seek, tell, etc.
+
+
+class ConversionCheckpoint(object):
+    """
+    Periodic checkpoints of a parse_mrt_file(..., checkpoint=ConversionCheckpoint(file_name)) run,
+    so that a conversion that dies (bad record, out of memory, preemption) can be resumed.\n
+    Every `interval` records, the position in the uncompressed archive and the partial prefix
+    table are saved to file_name: a binary IPASN file (see read_ipasn_binary_file()) with the
+    parse state as its description, and the prefixes in the order they were added. Single-AS
+    sets, which the binary format writes as plain ASNs, are listed after its trailer, as JSON.
+    It is written to a temporary name first, then renamed.
+    With resume=True, parsing continues from the checkpoint in file_name, if there is one; the
+    records before it are decompressed, but not parsed, and the output is the same as that of an
+    uninterrupted run. Resuming needs the same archive and options (compact, peers, prefix
+    filter) as the interrupted run; stats count the resumed part.
+    Call remove() once the output is saved.
+    """
+    MAGIC = 'pyasn-mrt-checkpoint'
+
+    def __init__(self, file_name, interval=500000, resume=False):
+        self.file_name, self.interval, self.resume = file_name, interval, resume
+        self.saved = 0  # checkpoints written
+
+    @staticmethod
+    def _identity(archive):
+        # archive name, size and modification time, if parse_mrt_file() was given a path
+        if archive is None:
+            return None
+        st = stat(archive)
+        return [archive, st.st_size, int(st.st_mtime)]
+
+    def save(self, prefixes, state, archive=None):
+        """Saves a prefix table (dict or compact), and the parse state (a dict, stored as JSON)"""
+        state = dict(state, magic=self.MAGIC, archive=self._identity(archive))
+        tmp_file = self.file_name + '.part'
+        writer = IpasnWriter(tmp_file, json.dumps(state, sort_keys=True), binary=True)
+        single_sets = []  # written as plain ASNs
+        if isinstance(prefixes, CompactPrefixTable):
+            for family, network, masklen, origin in prefixes.iter_packed():
+                writer.write_packed(family, network, masklen, origin)
+                if isinstance(origin, set) and len(origin) == 1:
+                    single_sets.append(CompactPrefixTable.format_prefix(family, network, masklen))
+        else:
+            for prefix, origin in prefixes.items():
+                writer.write(prefix, origin)
+                if isinstance(origin, set) and len(origin) == 1:
+                    single_sets.append(prefix)
+        writer.close(appendix=json.dumps({'single_sets': single_sets}).encode('utf-8'))
+        replace(tmp_file, self.file_name)
+        self.saved += 1
+
+    def load(self, archive=None, compact=True):
+        """
+        Returns (prefix table, parse state) from the checkpoint file, or None if there is none.
+        The table is a CompactPrefixTable, or with compact=False an OrderedDict in the order the
+        prefixes were added.
+        :raises: ValueError if the checkpoint is of another archive, or not a checkpoint file
+        """
+        if not exists(self.file_name):
+            return None
+        with open(self.file_name, 'rb') as f:
+            head = f.read(len(BINARY_IPASN_MAGIC) + 7)
+            if not head.startswith(BINARY_IPASN_MAGIC):
+                raise ValueError("Not a checkpoint file: '%s'" % self.file_name)
+            state = f.read(unpack_from('>H', head, len(head) - 2)[0])
+        try:
+            state = json.loads(state.decode('utf-8'))
+        except ValueError:
+            state = None
+        if not isinstance(state, dict) or state.get('magic') != self.MAGIC:
+            raise ValueError("Not a checkpoint file: '%s'" % self.file_name)
+        if state['archive'] != self._identity(archive):
+            raise ValueError("Checkpoint '%s' is of another archive (%s)"
+                             % (self.file_name, state['archive'] and state['archive'][0]))
+        if compact:
+            table = CompactPrefixTable()
+            add = table.add
+        else:
+            table, counts = OrderedDict(), {4: 0, 6: 0}
+
+            def add(family, network, masklen, origin):
+                network = CompactPrefixTable._pad(family, network)
+                table[CompactPrefixTable.format_prefix(family, network, masklen)] = origin
+                counts[family] += 1
+        _, trailer_counts, appendix = _read_ipasn_binary(self.file_name, add)
+        if trailer_counts != (table.family_counts() if compact else (counts[4], counts[6])):
+            raise ValueError("Prefix counts don't match in checkpoint '%s'" % self.file_name)
+        for prefix in json.loads(appendix.decode('utf-8'))['single_sets']:
+            table[prefix] = set([table[prefix]])
+        return table, state
+
+
+    def remove(self):
+        """Removes the checkpoint file, e.g. after the conversion output is saved"""
+        for file_name in (self.file_name, self.file_name + '.part'):
+            if exists(file_name):
+                remove(file_name)
+
+    def __repr__(self):
+        return "ConversionCheckpoint('%s', every %d records)" % (self.file_name, self.interval)
+
+
+def _peers_state(peers):
+    # parse_mrt_file() peers argument, as stored in checkpoints
+    return sorted(str(peer) for peer in peers) if peers is not None else None
+
+
+def _filter_state(prefix_filter):
+    # parse_mrt_file() prefix_filter argument, as stored in checkpoints
+    if prefix_filter is None:
+        return None
+    return [prefix_filter.family, prefix_filter.networks]
+
+
+def _skip_to(f, offset):
+    # moves an archive opened at its start to an uncompressed offset; compressed streams (and
+    # wrapped files) are read up to it, which is still much faster than parsing the records
+    if isinstance(f, mmap):
+        f.seek(offset)
+        return
+    while offset > 0:
+        data = f.read(min(offset, 1 << 20))
+        if not data:
+            raise ValueError("Archive is shorter than its checkpoint")
+        offset -= len(data)
+
+
+def _warn_repeated_prefix(prefix, was, new, print_progress):
+    if was != new and print_progress:
+        was = "{%d ASes}" % len(was) if type(was) is set else str(was)
+        new = "{%d ASes}" % len(new) if type(new) is set else str(new)
+        print("  WARNING: repeated prefix '%s' maps to different origin (%s vs %s)"
+              % (prefix, was, new), file=stderr)
+
+
+class PrefixFilter(object):
+    """
+    Selects the prefixes to parse, for parse_mrt_file(..., prefix_filter=PrefixFilter(...)).
+    It is checked on the raw prefix bytes of each record, before anything else is decoded.\n
+    networks: "NETWORK/MASK" strings; prefixes overlapping any of them are kept, i.e. their more
+    specifics, and the covering less specifics that lookups in the networks can fall back to.
+    family: 4 or 6, to keep only one address family (alone, or together with networks).
+    """
+    BITS = {4: 32, 6: 128}
+
+    def __init__(self, networks=None, family=None):
+        self.family = family
+        self.networks = sorted(networks) if networks is not None else None
+        self._masks = None  # per family: {mask length: set(networks >> host bits)}
+        self._starts = None  # per family: sorted network start addresses
+        if networks is not None:
+            self._masks, self._starts = {4: {}, 6: {}}, {4: [], 6: []}
+            for net in networks:
+                parts = CompactPrefixTable._split(net)
+                if parts is None:
+                    raise ValueError("Invalid network '%s'" % net)
+                family, network, masklen = parts
+                shift = self.BITS[family] - masklen
+                value = self._int(family, network) >> shift
+                self._masks[family].setdefault(masklen, set()).add(value)
+                self._starts[family].append(value << shift)
+            for family in (4, 6):
+                self._starts[family].sort()
+
+    @staticmethod
+    def _int(family, network):
+        # packed (possibly truncated) network -> integer
+        if family == 4:
+            return unpack('>I', network.ljust(4, b'\0'))[0]
+        high, low = unpack('>QQ', network.ljust(16, b'\0'))
+        return high << 64 | low
+
+    def match(self, family, network, masklen):
+        """Checks a prefix given as family (4/6), packed network (can be truncated), mask length"""
+        if self.family and family != self.family:
+            return False
+        if self._masks is None:
+            return True
+        bits = self.BITS[family]
+        start = self._int(family, network)
+        for k, values in self._masks[family].items():
+            if k <= masklen and start >> (bits - k) in values:
+                return True  # covered by a network
+        # or covers a network: one of them starts within the prefix
+        starts = self._starts[family]
+        i = bisect_left(starts, start)
+        return i < len(starts) and starts[i] < start + (1 << (bits - masklen))
+
+
+def parse_mrt_file_origin_counts(mrt_file, skip_record_on_error=False, optimize_parse=True):
+    """
+    Parses an MRT/RIB BGP table dump file, looking at the routes of all peers (not just the first).\n
+    out: { "NETWORK/MASK" : { ASN | frozenset([Originating ASNs]) : number of peers } }
+\n
+With optimize_parse (default), only the last AS_PATH segments of each entry are decoded, straight
+from the raw record; otherwise all attributes of all entries are parsed (much slower, same result).
+As it decodes every RIB entry (one per peer, often 30 or more per prefix) rather than the first,
+this takes about 4 times as long as parse_mrt_file(), even with optimize_parse.
+    """
+
+    prefixes = OrderedDict()
+    if type(mrt_file) is str:
+        mrt_file = open_archive(mrt_file)
+
+    while True:
+        mrt = MrtRecord.next_dump_table_record(mrt_file, optimize_parse=optimize_parse)
+        if not mrt:
+            break  # EOF
+        if not mrt.prefix:
+            continue  # not a prefix/as-path entry (or a BGP4MP update)
+
+        counts = prefixes.setdefault(mrt.prefix, {})
+        for origin in mrt.get_all_origins(ignore_exception=skip_record_on_error):
+            origin = frozenset(origin) if isinstance(origin, set) else origin
+            counts[origin] = counts.get(origin, 0) + 1
+        if not counts:
+            del prefixes[mrt.prefix]  # all entries failed, and skip_record_on_error is set
+    #
+    for default_route in ('0.0.0.0/0', '::/0'):
+        if default_route in prefixes:
+            del prefixes[default_route]
+    return prefixes
+
+
+MERGE_POLICIES = ('majority', 'peer-count', 'first-seen')
+
+
+def _parse_for_merge(job):
+    # worker of parse_mrt_files_merged(); runs in a separate process, hence the single argument
+    mrt_file, policy, skip_record_on_error = job
+    if policy == 'peer-count':
+        return parse_mrt_file_origin_counts(mrt_file, skip_record_on_error=skip_record_on_error)
+    return parse_mrt_file(mrt_file, skip_record_on_error=skip_record_on_error, compact=True)
+
+
+def parse_mrt_files_merged(mrt_files,
+                           policy='majority',
+                           processes=None,
+                           print_progress=False,
+                           skip_record_on_error=False):
+    """
+    Parses several MRT/RIB archives concurrently (one process per archive, up to 'processes',
+    default all cores) and merges the per-prefix origins, e.g. of multiple RouteViews and RIPE RIS
+    collectors.\n
+    The policy decides the origin of prefixes whose collectors disagree:
+      'majority'   -- origin chosen by most archives (each picks its origin like parse_mrt_file)
+      'peer-count' -- origin seen by most peers, counting all RIB entries of all archives
+      'first-seen' -- origin of the first archive (in the given order) with the prefix
+    Ties are broken in favour of the origin seen first.\n
+    out: (prefixes, stats)
+        prefixes: { "NETWORK/MASK" : ASN | set([Originating ASNs]) }
+        stats: { "NETWORK/MASK" : (votes for the chosen origin, total votes, archives with prefix) }
+        where votes are archives, or peers with 'peer-count'. votes/total is the confidence.
+    """
+    if policy not in MERGE_POLICIES:
+        raise ValueError("Unknown merge policy '%s', must be one of %s" % (policy, MERGE_POLICIES))
+    t0 = time()
+    jobs = [(mrt_file, policy, skip_record_on_error) for mrt_file in mrt_files]
+    processes = min(processes or cpu_count(), len(jobs))
+    if processes > 1:
+        pool = Pool(processes)
+        try:
+            results = pool.imap(_parse_for_merge, jobs)  # in order of mrt_files
+            votes = _merge_origin_votes(results, mrt_files, policy, print_progress, t0)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = (_parse_for_merge(job) for job in jobs)
+        votes = _merge_origin_votes(results, mrt_files, policy, print_progress, t0)
+
+    prefixes, stats = OrderedDict(), OrderedDict()
+    for prefix, (origins, archives) in votes.items():
+        if policy == 'first-seen':
+            origin = next(iter(origins))  # origins are kept in the order first seen
+        else:
+            origin = max(origins, key=lambda o: (origins[o][0], -origins[o][1]))
+        total = sum(count for count, _ in origins.values())
+        stats[prefix] = (origins[origin][0], total, archives)
+        prefixes[prefix] = set(origin) if isinstance(origin, frozenset) else origin
+    return prefixes, stats
+
+
+def _merge_origin_votes(results, mrt_files, policy, print_progress, t0):
+    # returns {prefix: ({origin: [votes, rank first seen]}, number of archives with prefix)}
+    votes, rank = OrderedDict(), 0
+    for mrt_file, result in zip(mrt_files, results):
+        if print_progress:
+            print("  Merging %s (%d prefixes) @%.fs" % (mrt_file, len(result), time() - t0),
+                  file=stderr)
+        for prefix, origins in result.items():
+            if policy != 'peer-count':
+                origins = {frozenset(origins) if isinstance(origins, set) else origins: 1}
+            entry = votes.get(prefix)
+            if entry is None:
+                entry = votes[prefix] = [OrderedDict(), 0]
+            for origin, count in origins.items():
+                if origin not in entry[0]:
+                    entry[0][origin] = [0, rank]
+                    rank += 1
+                entry[0][origin][0] += count
+            entry[1] += 1
+    return votes
+
+
+def iter_bgp_updates(mrt_file, skip_record_on_error=False):
+    """
+    Yields the MrtRecords holding BGP UPDATE messages (BGP4MP/BGP4MP_ET) in an MRT archive.
+    With skip_record_on_error, records that can't be parsed (malformed messages) are skipped.
+    """
+    if type(mrt_file) is str:
+        mrt_file = open_archive(mrt_file)
+    while True:
+        header = mrt_file.read(12)
+        if not header:
+            break  # EOF
+        mrt = MrtRecord(header)
+        buf = mrt_file.read(mrt.data_len)
+        assert len(buf) == mrt.data_len
+        try:
+            mrt.parse_detail(buf)
+        except Exception:
+            if not skip_record_on_error:
+                raise
+            continue
+        if isinstance(mrt.detail, MrtBgp4mpRecord) and mrt.detail.is_update:
+            yield mrt
+
+
+def apply_bgp_updates(mrt_file, target, peers=None, print_progress=False,
+                      skip_record_on_error=False):
+    """
+    Applies the BGP UPDATE messages in an MRT updates archive (e.g. RouteViews updates.*.bz2,
+    RIPE RIS updates.*.gz) to a live database: a pyasn, a Radix, a CompactPrefixTable, or a
+    parse_mrt_file() dict. Announced prefixes get their new origin, withdrawn prefixes are removed.
+    Messages are applied in archive order, so the last announcement or withdrawal wins.\n
+    A withdrawal by one peer removes the prefix even if other peers still route it. To track a
+    consistent view, restrict updates to one (or a few) full-feed peers, by IP address or ASN.\n
+    Announcements with an empty AS_PATH (routes originated in the peer's own AS, as sent on iBGP
+    and some route-server sessions) have no origin to apply, and are skipped.\n
+    :param peers: optional collection of peer IPs (strings) and/or peer ASNs (ints) to accept
+    :param skip_record_on_error: skip messages that can't be parsed, instead of raising
+    :return: (number of prefixes announced, number withdrawn)
+    """
+    table = _UpdateTarget(target)
+    announced = withdrawn = 0
+    t0 = time()
+    for n, mrt in enumerate(iter_bgp_updates(mrt_file, skip_record_on_error)):
+        update = mrt.detail
+        if peers is not None and update.peer_ip not in peers and update.peer_as not in peers:
+            continue
+        for family, network, masklen in update.withdrawn:
+            if masklen:  # default route ignored, as in parse_mrt_file()
+                table.remove(family, network, masklen)
+                withdrawn += 1
+        if update.announced:
+            try:
+                origin = update.get_origin_as()
+            except Exception:
+                if not skip_record_on_error:
+                    raise
+                origin = None
+            if origin is None:
+                if print_progress:
+                    print("  WARNING: no origin for the %d prefixes announced by %s"
+                          % (len(update.announced), update.peer_ip), file=stderr)
+                continue
+            for family, network, masklen in update.announced:
+                if masklen:
+                    table.set(family, network, masklen, origin)
+                    announced += 1
+        if print_progress and (n + 1) % 100000 == 0:
+            print("  BGP update %d @%.fs" % (n + 1, time() - t0), file=stderr)
+    return announced, withdrawn
+
+
+class _UpdateTarget:
+    # adapter used by apply_bgp_updates(), to set/remove packed prefixes in various tables
+    def __init__(self, target):
+        self.radix = getattr(target, 'radix', target)  # a pyasn instance, or a bare Radix
+        self.asndb = target if hasattr(target, 'radix') else None
+        self.is_radix = hasattr(self.radix, 'search_exact')
+        self.table = target
+
+    def set(self, family, network, masklen, origin):
+        if isinstance(self.table, CompactPrefixTable):
+            self.table.set_packed(family, network, masklen, origin)
+            return
+        network = CompactPrefixTable._pad(family, network)
+        if not self.is_radix:
+            self.table[CompactPrefixTable.format_prefix(family, network, masklen)] = origin
+            return
+        if isinstance(origin, set):
+            origin = list(origin)[0]  # the radix holds one AS, chosen as in dump_prefixes_to_file
+        ip = inet_ntoa(network) if family == 4 else inet_ntop(AF_INET6, network)
+        if self.asndb is not None:
+            self.asndb.set_prefix(ip, masklen, origin)  # keeps pyasn's count & caches consistent
+            return
+        node = self.radix.search_exact(ip, masklen)
+        if node is None:
+            node = self.radix.add(ip, masklen)
+        node.asn = origin
+
+    def remove(self, family, network, masklen):
+        if isinstance(self.table, CompactPrefixTable):
+            self.table.discard_packed(family, network, masklen)
+            return
+        network = CompactPrefixTable._pad(family, network)
+        if not self.is_radix:
+            self.table.pop(CompactPrefixTable.format_prefix(family, network, masklen), None)
+            return
+        ip = inet_ntoa(network) if family == 4 else inet_ntop(AF_INET6, network)
+        if self.asndb is not None:
+            self.asndb.remove_prefix(ip, masklen)
+        elif self.radix.search_exact(ip, masklen) is not None:
+            self.radix.delete(ip, masklen)
+
+
+def iter_as_paths(mrt_file, skip_record_on_error=False, prefix_filter=None):
+    """
+    Streams the AS_PATHs of all entries (peers) of an MRT/RIB archive's TDv1/TDv2 records.
+    Yields (packed prefix, [path]) per record; packed prefix is (family, network, mask) and each
+    path a list of (segment type, tuple of ASNs), see fast_as_path().
+    """
+    if type(mrt_file) is str:
+        mrt_file = open_archive(mrt_file)
+    while True:
+        mrt = MrtRecord.next_dump_table_record(mrt_file, prefix_filter=prefix_filter)
+        if not mrt:
+            break
+        if mrt.type not in (mrt.TYPE_TABLE_DUMP, mrt.TYPE_TABLE_DUMP_V2) or not mrt.detail \
+           or mrt.detail.prefix_len is None or mrt.detail.filtered_out:
+            continue  # peer index, BGP4MP, or filtered out
+        yield mrt.packed_prefix, mrt.detail.get_entry_paths(ignore_exception=skip_record_on_error)
+
+
+class _PackedCounts(object):
+    # counts of 64-bit keys, kept in sorted packed arrays (16 bytes a key); new counts go to a
+    # dict first, which is folded into the arrays when it holds `buffered` keys
+    def __init__(self, buffered=1 << 18):
+        self.keys, self.counts = array(_OFFSET_TYPECODE), array(_OFFSET_TYPECODE)
+        self.recent, self.buffered = {}, buffered
+
+    def fold(self):
+        keys, counts, new, i = self.keys, self.counts, [], 0
+        for key, n in sorted(self.recent.items()):
+            i = bisect_left(keys, key, i)
+            if i < len(keys) and keys[i] == key:
+                counts[i] += n
+            else:
+                new.append((i, key, n))  # i: where it goes in the arrays
+        self.recent = {}
+        if not new:
+            return
+        merged_keys, merged_counts, i = array(_OFFSET_TYPECODE), array(_OFFSET_TYPECODE), 0
+        for j, key, n in new:
+            merged_keys.extend(keys[i:j])
+            merged_counts.extend(counts[i:j])
+            merged_keys.append(key)
+            merged_counts.append(n)
+            i = j
+        merged_keys.extend(keys[i:])
+        merged_counts.extend(counts[i:])
+        self.keys, self.counts = merged_keys, merged_counts
+
+    def get(self, key):
+        i = bisect_left(self.keys, key)
+        found = self.counts[i] if i < len(self.keys) and self.keys[i] == key else 0
+        return found + self.recent.get(key, 0)
+
+    def folded(self):
+        if self.recent:
+            self.fold()
+        return self
+
+
+class AsGraph(object):
+    """
+    AS-level adjacency graph, from the AS_PATHs of MRT/RIB archives (see build_as_graph()).\n
+    Keeps the links between neighbouring ASes of the paths, as left AS (nearer the collector's
+    peer) -> right AS, counting the paths (RIB entries) they're on; and the upstreams of each
+    origin AS, i.e. the AS before it. Links are 64-bit integers (left << 32 | right), kept with
+    their counts in sorted packed arrays, so memory is 16 bytes a distinct link, whatever the
+    size of the RIBs. Prepending is ignored; AS_SETs, confederation segments and bogus ASNs (see
+    is_asn_bogus()) break a path.
+    """
+    _SEQUENCE = 2  # BgpPathSegment.AS_SEQUENCE
+    _LOW = 0xffffffff
+
+    def __init__(self):
+        self.paths = 0
+        self._links = _PackedCounts()  # left << 32 | right: paths
+        self._upstreams = _PackedCounts()  # origin << 32 | upstream: paths
+        self._reverse = None  # right << 32 | left of the links, sorted; for lookups by right AS
+
+    def add_path(self, segments):
+        """Adds an AS_PATH, given as a list of (segment type, ASNs), see fast_as_path()"""
+        links, prev, last = self._links.recent, None, None
+        for seg_type, asns in segments:
+            if seg_type != self._SEQUENCE:
+                prev = last = None
+                continue
+            for asn in asns:
+                if asn == prev:
+                    continue  # prepending
+                if is_asn_bogus(asn):
+                    prev = last = None
+                    continue
+                if prev is not None:
+                    last = prev << 32 | asn
+                    links[last] = links.get(last, 0) + 1
+                prev = asn
+        if last is not None and prev is not None:
+            key = prev << 32 | last >> 32  # the path's last link: upstream -> origin
+            upstreams = self._upstreams.recent
+            upstreams[key] = upstreams.get(key, 0) + 1
+            if len(upstreams) >= self._upstreams.buffered:
+                self._upstreams.fold()
+        if len(links) >= self._links.buffered:
+            self._links.fold()
+        self.paths += 1
+        self._reverse = None
+
+    def __len__(self):
+        return len(self._links.folded().keys)
+
+    def links(self):
+        """Iterates over the links as (left AS, right AS, paths), sorted"""
+        links = self._links.folded()
+        for key, n in zip(links.keys, links.counts):
+            yield key >> 32, key & self._LOW, n
+
+    def link_count(self, left, right):
+        """Returns the number of paths with right after left (0 if none)"""
+        return self._links.get(left << 32 | right)
+
+    def neighbours(self, asn):
+        """Returns { neighbour AS: paths } of an AS, on either side"""
+        links = self._links.folded()
+        found = {}
+        for i in self._range(links.keys, asn):
+            found[links.keys[i] & self._LOW] = links.counts[i]
+        if self._reverse is None:
+            self._reverse = array(_OFFSET_TYPECODE, sorted((key & self._LOW) << 32 | key >> 32
+                                                           for key in links.keys))
+        for i in self._range(self._reverse, asn):
+            left = self._reverse[i] & self._LOW
+            found[left] = found.get(left, 0) + links.get(left << 32 | asn)
+        return found
+
+    def upstreams(self, origin):
+        """Returns { upstream AS: paths } of an origin AS"""
+        upstreams = self._upstreams.folded()
+        return dict((upstreams.keys[i] & self._LOW, upstreams.counts[i])
+                    for i in self._range(upstreams.keys, origin))
+
+    def origins(self):
+        """Returns the set of origin ASes that have upstreams"""
+        return set(key >> 32 for key in self._upstreams.folded().keys)
+
+    def as_count(self):
+        """Returns the number of distinct ASes in the links"""
+        keys = self._links.folded().keys
+        ases = set(key >> 32 for key in keys)
+        ases.update(key & self._LOW for key in keys)
+        return len(ases)
+
+    @staticmethod
+    def _range(keys, asn):
+        return range(bisect_left(keys, asn << 32), bisect_left(keys, (asn + 1) << 32))
+
+    def __repr__(self):
+        return "AsGraph(%d paths, %d links)" % (self.paths, len(self))
+
+
+def build_as_graph(mrt_file, graph=None, print_progress=False, skip_record_on_error=False,
+                   prefix_filter=None):
+    """
+    Builds an AsGraph from the AS_PATHs of all entries (peers) of an MRT/RIB archive; pass graph
+    to add to an existing one (e.g. for several collectors). Paths are streamed, not kept.
+    """
+    graph = AsGraph() if graph is None else graph
+    t0, n = time(), 0
+    for _, paths in iter_as_paths(mrt_file, skip_record_on_error, prefix_filter):
+        for path in paths:
+            graph.add_path(path)
+        n += 1
+        if print_progress and n % 100000 == 0:
+            print("  MRT record %d @%.fs, %d links" % (n, time() - t0, len(graph)), file=stderr)
+    return graph
+
+
+MRT_INDEX_MAGIC = b'MRTINDX1'
+_BZ2_BLOCK_MAGIC, _BZ2_EOS_MAGIC = 0x314159265359, 0x177245385090  # 48-bit, not byte aligned
+_INDEX_KEY_LEN = 18  # family, mask length, network padded to 16 octets
+try:
+    array('Q')
+    _OFFSET_TYPECODE = 'Q'
+except ValueError:
+    _OFFSET_TYPECODE = 'L'  # python 2
+
+
+def _int_from_bytes(data):
+    return int(hexlify(data), 16) if data else 0
+
+
+def _int_to_bytes(value, length):
+    return unhexlify('%0*x' % (length * 2, value))
+
+
+def _bz2_markers(data):
+    # bit offsets of the bzip2 block and end-of-stream magics in data (sorted), as two lists.
+    # bzip2 blocks are bit-aligned, so we search for 40 bits of the magic at all 8 bit shifts.
+    found = []
+    for magic in (_BZ2_BLOCK_MAGIC, _BZ2_EOS_MAGIC):
+        bits = set()
+        for shift in range(8):
+            window = _int_to_bytes(magic << (8 - shift), 7)
+            pattern, skip = (window[:6], 0) if shift == 0 else (window[1:6], 1)
+            pos = data.find(pattern)
+            while pos != -1:
+                start = pos - skip
+                if start >= 0 and len(data) >= start + 7 and \
+                   _int_from_bytes(data[start:start + 7]) >> (8 - shift) & 0xffffffffffff == magic:
+                    bits.add(start * 8 + shift)
+                pos = data.find(pattern, pos + 1)
+        found.append(sorted(bits))
+    return found
+
+
+def _bz2_decompress_block(data, start_bit, end_bit):
+    # decompresses one bzip2 block, found at a bit offset of a bz2 file, by shifting it into a
+    # stream of its own (which bzip2recover does too). Its CRC doubles as the stream's CRC.
+    first, last = start_bit // 8, (end_bit + 7) // 8
+    nbits = end_bit - start_bit
+    block = _int_from_bytes(data[first:last]) >> (last * 8 - end_bit) & ((1 << nbits) - 1)
+    crc = block >> (nbits - 80) & 0xffffffff  # 48-bit magic, then the block's CRC
+    block = (((block << 48) | _BZ2_EOS_MAGIC) << 32) | crc
+    nbits += 80
+    return decompress_bz2(b'BZh9' + _int_to_bytes(block << (-nbits % 8), (nbits + 7) // 8))
+
+
+def _index_key(mrt_type, sub_type, body):
+    # packed prefix of a TDv1/TDv2 RIB record body, as a fixed size index key; None if no prefix
+    if mrt_type == MrtRecord.TYPE_TABLE_DUMP:
+        octs = 4 if sub_type == MrtRecord.T1_AFI_IPv4 else 16
+        network, masklen = body[4:4 + octs], _UNPACK_B(body, 4 + octs)[0]
+    elif mrt_type == MrtRecord.TYPE_TABLE_DUMP_V2 and sub_type in (MrtRecord.T2_RIB_IPV4,
+                                                                   MrtRecord.T2_RIB_IPV6):
+        masklen = _UNPACK_B(body, 4)[0]
+        network = body[5:5 + (masklen + 7) // 8]
+        octs = 4 if sub_type == MrtRecord.T2_RIB_IPV4 else 16
+    else:
+        return None
+    return pack('>BB', 4 if octs == 4 else 6, masklen) + network + b'\0' * (16 - len(network))
+
+
+class MrtIndex(object):
+    """
+    Sidecar index of an MRT archive, for random access to its records: the (uncompressed) offset
+    of every Nth record, and the first record of each prefix. For bz2 archives it also keeps the
+    bit offsets of the bzip2 blocks, which can be decompressed on their own; so a seek costs at
+    most a block (900 kB uncompressed). Uncompressed archives are seeked directly; gzip, xz and
+    zstd streams have no seek points, and are decompressed (but not parsed) up to the record.\n
+    Records are numbered from 1, as in dump_screen_mrt_file(). Build with build_mrt_index().
+    """
+    KINDS = ('raw', 'gzip', 'bz2', 'xz', 'zstd')
+
+    def __init__(self, archive):
+        self.archive, self.kind, self.every = archive, 'raw', 1000
+        self.archive_size, self.archive_mtime, self.records = 0, 0.0, 0
+        self.checkpoints = array(_OFFSET_TYPECODE)  # offset of records 1, 1 + every, ...
+        self.block_starts = array(_OFFSET_TYPECODE)  # bz2: bit offsets where blocks start
+        self.block_ends = array(_OFFSET_TYPECODE)  # bz2: ... and end
+        self.block_offsets = array(_OFFSET_TYPECODE)  # bz2: uncompressed offset of each block
+        self._keys, self._key_records = b'', array('I')  # sorted prefix keys, first records
+
+    def _iter_chunks(self, data):
+        # (block number, uncompressed data) of the archive; blocks are None if not bz2
+        if self.kind == 'bz2':
+            starts, ends = _bz2_markers(data)
+            markers = sorted(starts + ends)
+            offset, i = 0, 0
+            while i < len(starts):
+                j = bisect_right(markers, starts[i])
+                while True:
+                    # a marker lookalike in compressed data fails; try the marker after it
+                    end = markers[j] if j < len(markers) else len(data) * 8
+                    try:
+                        chunk = _bz2_decompress_block(data, starts[i], end)
+                        break
+                    except (IOError, OSError, ValueError, EOFError):
+                        if j >= len(markers):
+                            return  # truncated archive; index the complete blocks
+                        j += 1
+                self.block_starts.append(starts[i])
+                self.block_ends.append(end)
+                self.block_offsets.append(offset)
+                offset += len(chunk)
+                yield len(self.block_offsets) - 1, chunk
+                while i < len(starts) and starts[i] < end:
+                    i += 1
+        else:
+            f = open_archive(self.archive)
+            try:
+                while True:
+                    chunk = f.read(1 << 20)
+                    if not chunk:
+                        break
+                    yield None, chunk
+            except (EOFError, IOError):
+                pass  # truncated gzip archive; index the complete records
+            finally:
+                f.close()
+
+    @staticmethod
+    def build(archive, every=1000):
+        """Reads an MRT archive (path) in one pass, and returns its index"""
+        index = MrtIndex(archive)
+        index.every = every
+        st = stat(archive)
+        index.archive_size, index.archive_mtime = st.st_size, st.st_mtime
+        f = open(archive, 'rb')
+        index.kind = _archive_kind(f.read(12))
+        if index.kind is None:
+            raise TypeError("Cannot determine file type '%s'" % archive)
+        data = mmap(f.fileno(), 0, access=ACCESS_READ) if index.kind == 'bz2' else None
+        keys = {}
+        buf, pos, n = b'', 0, 0  # pos: offset of buf in the uncompressed stream
+        for _, chunk in index._iter_chunks(data):
+            buf += chunk
+            i = 0
+            while len(buf) - i >= 12:
+                _, mrt_type, sub_type, data_len = unpack_from('>IHHI', buf, i)
+                if len(buf) - i < 12 + data_len:
+                    break
+                if n % every == 0:
+                    index.checkpoints.append(pos + i)
+                n += 1
+                key = _index_key(mrt_type, sub_type, buf[i + 12:i + 12 + data_len])
+                if key is not None and key not in keys:
+                    keys[key] = n
+                i += 12 + data_len
+            buf, pos = buf[i:], pos + i
+        if data is not None:
+            data.close()
+        f.close()
+        index.records = n
+        index._keys = b''.join(sorted(keys))
+        index._key_records = array('I', (keys[index._keys[i:i + _INDEX_KEY_LEN]]
+                                         for i in range(0, len(index._keys), _INDEX_KEY_LEN)))
+        return index
+
+    def save(self, index_file):
+        with open(index_file, 'wb') as f:
+            f.write(MRT_INDEX_MAGIC + pack('>BQdIIII', self.KINDS.index(self.kind),
+                                           self.archive_size, self.archive_mtime, self.every,
+                                           self.records, len(self.block_offsets),
+                                           len(self._key_records)))
+            for a in (self.checkpoints, self.block_starts, self.block_ends, self.block_offsets,
+                      self._key_records):
+                _write_array(f, a)
+            f.write(self._keys)
+
+    @staticmethod
+    def load(archive, index_file):
+        """
+        Loads the index of an archive.
+        :raises: ValueError if index_file is not an index, or the archive changed since
+        """
+        index = MrtIndex(archive)
+        with open(index_file, 'rb') as f:
+            if f.read(len(MRT_INDEX_MAGIC)) != MRT_INDEX_MAGIC:
+                raise ValueError("Not an MRT index file: '%s'" % index_file)
+            kind, index.archive_size, index.archive_mtime, index.every, index.records, \
+                n_blocks, n_keys = unpack('>BQdIIII', f.read(33))
+            index.kind = MrtIndex.KINDS[kind]
+            n_checkpoints = (index.records + index.every - 1) // index.every
+            index.checkpoints = _read_array(f, _OFFSET_TYPECODE, n_checkpoints)
+            index.block_starts = _read_array(f, _OFFSET_TYPECODE, n_blocks)
+            index.block_ends = _read_array(f, _OFFSET_TYPECODE, n_blocks)
+            index.block_offsets = _read_array(f, _OFFSET_TYPECODE, n_blocks)
+            index._key_records = _read_array(f, 'I', n_keys)
+            index._keys = f.read(n_keys * _INDEX_KEY_LEN)
+            if len(index._keys) != n_keys * _INDEX_KEY_LEN:
+                raise ValueError("Truncated MRT index file: '%s'" % index_file)
+        st = stat(archive)
+        if (st.st_size, st.st_mtime) != (index.archive_size, index.archive_mtime):
+            raise ValueError("MRT index '%s' is out of date" % index_file)
+        return index
+
+    @property
+    def prefix_count(self):
+        return len(self._key_records)
+
+    def find_prefix(self, prefix):
+        """
+        Returns the number of the first record of prefix ("NETWORK/MASK"), or None if it's not
+        in the archive. :raises: ValueError if prefix is not a valid prefix
+        """
+        split = CompactPrefixTable._split(prefix)
+        if split is None:
+            raise ValueError("Invalid prefix '%s'" % prefix)
+        family, network, masklen = split
+        key = pack('>BB', family, masklen) + network + b'\0' * (16 - len(network))
+        lo, hi = 0, len(self._key_records)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._keys[mid * _INDEX_KEY_LEN:(mid + 1) * _INDEX_KEY_LEN] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._key_records) and \
+           self._keys[lo * _INDEX_KEY_LEN:(lo + 1) * _INDEX_KEY_LEN] == key:
+            return self._key_records[lo]
+        return None
+
+    def open_at(self, n):
+        """
+        Opens the archive at the indexed record nearest before record n.
+        :return: (file-object, number of the record it's positioned at)
+        """
+        if not 1 <= n <= self.records:
+            raise IndexError("record %d not in archive (%d records)" % (n, self.records))
+        first = (n - 1) // self.every * self.every + 1
+        offset = self.checkpoints[(first - 1) // self.every]
+        if self.kind == 'bz2':
+            block = bisect_right(self.block_offsets, offset) - 1
+            f = _Bz2BlockReader(self, block)
+            f.read(offset - self.block_offsets[block])
+        elif self.kind == 'raw':
+            f = open_archive(self.archive)
+            f.seek(offset)
+        else:
+            f = open_archive(self.archive)
+            while offset:
+                offset -= len(f.read(min(offset, 1 << 20)))  # decompress up to offset
+        return f, first
+
+
+class _Bz2BlockReader(object):
+    # file-like reader of a bz2 archive from one of its blocks on, see MrtIndex
+    def __init__(self, index, block):
+        self._f, self._index, self._block, self._buf = open(index.archive, 'rb'), index, block, b''
+
+    def read(self, size):
+        index = self._index
+        while len(self._buf) < size and self._block < len(index.block_starts):
+            start, end = index.block_starts[self._block], index.block_ends[self._block]
+            self._f.seek(start // 8)
+            data = self._f.read((end + 7) // 8 - start // 8)
+            self._buf += _bz2_decompress_block(data, start % 8, end - start // 8 * 8)
+            self._block += 1
+        data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+    def close(self):
+        self._f.close()
+
+
+def _write_array(f, a):
+    # arrays are stored big-endian
+    if byteorder == 'little':
+        a = array(a.typecode, a)
+        a.byteswap()
+    f.write(a.tobytes() if hasattr(a, 'tobytes') else a.tostring())
+
+
+def _read_array(f, typecode, count):
+    a = array(typecode)
+    data = f.read(a.itemsize * count)
+    if len(data) != a.itemsize * count:
+        raise ValueError("Truncated MRT index file")
+    a.frombytes(data) if hasattr(a, 'frombytes') else a.fromstring(data)
+    if byteorder == 'little':
+        a.byteswap()
+    return a
+
+
+def build_mrt_index(mrt_path, every=1000, index_file=None):
+    """
+    Indexes an MRT archive for get_record() and dump_screen_mrt_file(), and saves the index
+    next to it (mrt_path + '.idx'), or as index_file. Returns the MrtIndex.
+    """
+    index = MrtIndex.build(mrt_path, every)
+    index.save(index_file or mrt_path + '.idx')
+    return index
+
+
+def load_mrt_index(mrt_path, index_file=None):
+    """Returns the saved MrtIndex of an MRT archive, or None if missing or out of date"""
+    try:
+        return MrtIndex.load(mrt_path, index_file or mrt_path + '.idx')
+    except (IOError, OSError, ValueError, struct_error):
+        return None
+
+
+def get_record(mrt_path, key, index_file=None):
+    """
+    Returns a record of an MRT archive (path) as an MrtRecord, by number (from 1) or by prefix
+    ("NETWORK/MASK", the first record of the prefix); None if there's no such prefix.
+    Uses the archive's index, which is built (and saved, if possible) when missing.
+    :raises: IndexError for a record number not in the archive, ValueError for an invalid prefix
+    """
+    index = load_mrt_index(mrt_path, index_file)
+    if index is None:
+        index = MrtIndex.build(mrt_path)
+        try:
+            index.save(index_file or mrt_path + '.idx')
+        except (IOError, OSError):
+            pass  # e.g. read-only archive directory; just not cached
+    n = key if isinstance(key, int) else index.find_prefix(key)
+    if n is None:
+        return None
+    f, i = index.open_at(n)
+    try:
+        while True:
+            mrt = MrtRecord.next_dump_table_record(f, optimize_parse=False)
+            if i == n:
+                return mrt
+            i += 1
+    finally:
+        f.close()
+
+
 def dump_screen_mrt_file(mrt_file, record_from=None, record_to=None, screen=stderr):
     """
     Parses and dumps an MRT/RIB archive to screen. For debugging purposes.
+    If the archive has an index (see build_mrt_index()), it seeks straight to record_from.
     """
+    n = 0
     if type(mrt_file) is str:
-        mrt_file = open_archive(mrt_file)
+        index = load_mrt_index(mrt_file) if record_from and record_from > 1 else None
+        if index and record_from <= index.records:
+            mrt_file, n = index.open_at(record_from)
+            n -= 1
+        else:
+            mrt_file = open_archive(mrt_file)
     print("Dumping MRT/RIB archive to screen:", file=screen)
 
-    n = 0
     while True:
         mrt = MrtRecord.next_dump_table_record(mrt_file, optimize_parse=False)
         if not mrt:
             break  # EOF
-        if mrt.type not in (mrt.TYPE_TABLE_DUMP, mrt.TYPE_TABLE_DUMP_V2):
-            print("ERROR: dump_screen_mrt_file() supports only TDv1/TDv2 (type 12/13). Encountered"
-                  " type %d, quitting.\n" % (mrt.TYPE_TABLE_DUMP_V2, mrt.type), file=screen)
+        if mrt.type not in (mrt.TYPE_TABLE_DUMP, mrt.TYPE_TABLE_DUMP_V2,
+                            mrt.TYPE_BGP4MP, mrt.TYPE_BGP4MP_ET):
+            print("ERROR: dump_screen_mrt_file() supports only TDv1/TDv2/BGP4MP (type 12/13/16/17)."
+                  " Encountered type %d, quitting.\n" % mrt.type, file=screen)
             break
 
         n += 1
@@ -169,6 +1422,10 @@ def dump_screen_mrt_file(mrt_file, record_from=None, record_to=None, screen=stde
 
         print('\nRecord #%06d:' % n, mrt, file=screen)
 
+        if mrt.type == mrt.TYPE_TABLE_DUMP_V2 and mrt.sub_type == MrtRecord.T2_PEER_INDEX:
+            for i, (bgp_id, ip, asn) in enumerate(mrt.detail.peers):
+                print("\t Peer %02d: BGP ID %s, IP %s, AS%d" % (i, bgp_id, ip, asn), file=screen)
+
         if mrt.type == mrt.TYPE_TABLE_DUMP_V2 \
           and mrt.sub_type in (MrtRecord.T2_RIB_IPV4, MrtRecord.T2_RIB_IPV6):
             for i, entry in enumerate(mrt.detail.entries):
@@ -177,6 +1434,16 @@ def dump_screen_mrt_file(mrt_file, record_from=None, record_to=None, screen=stde
             origin = mrt.get_first_origin_as(ignore_exception=True)
             print("\t => pyasn choice: AS", origin, file=screen)
 
+        if mrt.type in (mrt.TYPE_BGP4MP, mrt.TYPE_BGP4MP_ET) and mrt.detail.is_update:
+            for attr in mrt.detail.attrs:
+                print("\t\t", attr, file=screen)
+            for action, prefixes in (("announced", mrt.detail.announced),
+                                     ("withdrawn", mrt.detail.withdrawn)):
+                for family, network, masklen in prefixes:
+                    network = CompactPrefixTable._pad(family, network)
+                    print("\t\t %s: %s" % (action, CompactPrefixTable.format_prefix(
+                        family, network, masklen)), file=screen)
+
         if mrt.type == mrt.TYPE_TABLE_DUMP:
             for i, attr in enumerate(mrt.detail.attrs):
                 print("\t\t", attr, file=screen)
@@ -185,25 +1452,204 @@ def dump_screen_mrt_file(mrt_file, record_from=None, record_to=None, screen=stde
             # print("\t => pyasn choice: AS", origin, file=stderr)
 
 
+def count_prefixes(prefixes):
+    """Returns (IPv4, IPv6) prefix counts of a parse_mrt_file() result (dict or compact table)"""
+    if isinstance(prefixes, CompactPrefixTable):
+        return prefixes.family_counts()  # no need to look at prefix strings
+    n6 = sum(1 for x in prefixes if ':' in x)
+    return len(prefixes) - n6, n6
+
+
 def dump_prefixes_to_file(prefixes,
                           ipasn_file_name,
                           source_description="",
-                          debug_write_sets=False
+                          debug_write_sets=False,
+                          compress=None,
+                          binary=False
                           ):
-    if IS_PYTHON2:
-        fw = open(ipasn_file_name, 'wt')
+    """
+    Writes parse_mrt_file() output (dict or compact table) to an IPASN file, in one buffered pass.
+    compress: 'gzip' (or True), 'zstd', or False; by default chosen by a '.gz' or '.zst' suffix.
+    binary: write the binary IPASN format (see read_ipasn_binary_file()) instead of text.
+    """
+    writer = IpasnWriter(ipasn_file_name, source_description, count_prefixes(prefixes),
+                         compress=compress, binary=binary, debug_write_sets=debug_write_sets)
+    if isinstance(prefixes, CompactPrefixTable):
+        for family, network, masklen, origin in prefixes.iter_packed():
+            writer.write_packed(family, network, masklen, origin)
     else:
-        fw = open(ipasn_file_name, 'wt', encoding='ASCII')
-    fw.write('; IP-ASN32-DAT file\n; Original source: %s\n' % source_description)
-    n6 = sum(1 for x in prefixes if ':' in x)
-    n4 = len(prefixes) - n6
-    fw.write('; Converted on  : %s\n; Prefixes-v4   : %s\n; Prefixes-v6   : %s\n; \n' %
-             (asctime(), n4, n6))
-    for prefix, origin in prefixes.items():
-        if not debug_write_sets and isinstance(origin, set):
-            origin = list(origin)[0]  # get an AS randomly, or the only AS if one, from the set
-        fw.write('%s\t%s\n' % (prefix, origin))
-    fw.close()
+        for prefix, origin in prefixes.items():
+            writer.write(prefix, origin)
+    writer.close()
+
+
+BINARY_IPASN_MAGIC = b'IPASNBIN'
+BINARY_IPASN_VERSION = 2  # 2: 16-bit AS counts (1: 8-bit, still read)
+
+
+def _open_compressed(file_name, mode, compress=None):
+    # opens a plain, gzip or zstd file in binary mode; compress is by file suffix if None
+    if compress is None:
+        compress = 'gzip' if file_name.endswith('.gz') else \
+            'zstd' if file_name.endswith('.zst') else False
+    if compress in (True, 'gzip'):
+        return GzipFile(file_name, mode, compresslevel=6)  # level 6 like gzip; 9 is much slower
+    elif compress == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd compression needs the 'zstandard' module")
+        if 'w' in mode:
+            return zstandard.ZstdCompressor().stream_writer(open(file_name, mode))
+        return BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(file_name, mode)))
+    elif compress:
+        raise ValueError("Unknown compression '%s', use 'gzip' or 'zstd'" % compress)
+    return open(file_name, mode)
+
+
+class IpasnWriter(object):
+    """
+    Buffered single-pass writer of IPASN databases: the text format loaded by pyasn, or a compact
+    binary format (see read_ipasn_binary_file()). Output is compressed in-process as it is written,
+    with gzip, or zstd if the 'zstandard' module is installed.\n
+    The text header needs the prefix counts up front (free with a CompactPrefixTable); the binary
+    format keeps the counts, made while writing, in a trailer. Call close() at the end.
+    """
+    BUFFER_RECORDS = 8192
+
+    def __init__(self, file_name, source_description="", counts=None, compress=None,
+                 binary=False, debug_write_sets=False):
+        self._fw = _open_compressed(file_name, 'wb', compress)
+        self._binary, self._write_sets = binary, debug_write_sets
+        self._buf, self.counts = [], {4: 0, 6: 0}
+        self._expected_counts = counts
+        if binary:
+            # header: magic, version, conversion time, source description
+            desc = source_description.encode('utf-8')[:65535]
+            self._buf.append(BINARY_IPASN_MAGIC +
+                             pack('>BIH', BINARY_IPASN_VERSION, int(time()), len(desc)) + desc)
+        else:
+            if counts is None:
+                raise ValueError("The text header needs the IPv4/IPv6 prefix counts")
+            self._buf.append('; IP-ASN32-DAT file\n; Original source: %s\n' % source_description)
+            self._buf.append('; Converted on  : %s\n; Prefixes-v4   : %s\n; Prefixes-v6   : %s\n'
+                             '; \n' % (asctime(), counts[0], counts[1]))
+
+    def write_packed(self, family, network, masklen, origin):
+        """Writes a prefix given as family (4/6), packed network (can be truncated), mask length"""
+        self.counts[family] += 1
+        if self._binary:
+            # record: family, mask length, network octets covered by mask, AS count, ASNs
+            origins = sorted(origin) if isinstance(origin, set) else [origin]
+            self._buf.append(pack('>BB', family, masklen) + bytes(network[:(masklen + 7) // 8]) +
+                             pack('>H%dI' % len(origins), len(origins), *origins))
+        else:
+            if not self._write_sets and isinstance(origin, set):
+                origin = list(origin)[0]  # get an AS randomly, or the only AS if one, from the set
+            network = CompactPrefixTable._pad(family, network)
+            self._buf.append('%s\t%s\n' % (CompactPrefixTable.format_prefix(family, network,
+                                                                          masklen), origin))
+        if len(self._buf) >= self.BUFFER_RECORDS:
+            self._flush()
+
+    def write(self, prefix, origin):
+        """Writes a "NETWORK/MASK" prefix"""
+        if self._binary:
+            self.write_packed(*(CompactPrefixTable._split(prefix) + (origin,)))
+            return
+        self.counts[6 if ':' in prefix else 4] += 1
+        if not self._write_sets and isinstance(origin, set):
+            origin = list(origin)[0]
+        self._buf.append('%s\t%s\n' % (prefix, origin))
+        if len(self._buf) >= self.BUFFER_RECORDS:
+            self._flush()
+
+    def _flush(self):
+        if self._buf:
+            data = b''.join(self._buf) if self._binary else ''.join(self._buf).encode('ascii')
+            self._fw.write(data)
+            self._buf = []
+
+    def close(self, appendix=b''):
+        """Finishes the file; appendix: bytes to write after the binary trailer (readers skip it)"""
+        if self._binary:
+            self._buf.append(pack('>BBII', 0, 0, self.counts[4], self.counts[6]))  # trailer
+            self._buf.append(appendix)
+        self._flush()
+        self._fw.close()
+        if not self._binary and (self.counts[4], self.counts[6]) != tuple(self._expected_counts):
+            raise ValueError("Prefix counts in the header don't match the prefixes written")
+
+
+def read_ipasn_binary_file(file_name):
+    """
+    Reads a binary IPASN file (plain, .gz or .zst), as written by dump_prefixes_to_file(...,
+    binary=True), into a CompactPrefixTable. AS_SET origins are kept as sets.
+    :raises: ValueError if the file is not a binary IPASN file, or is truncated
+    """
+    table = CompactPrefixTable()
+    _, counts, _ = _read_ipasn_binary(file_name, table.add)
+    if counts != table.family_counts():
+        raise ValueError("Prefix counts don't match in binary IPASN file: '%s'" % file_name)
+    return table
+
+
+def _read_ipasn_binary(file_name, add):
+    # calls add(family, network, masklen, origin) for each prefix of a binary IPASN file, in
+    # order; returns (description, (IPv4, IPv6) prefix counts of the trailer, data after it)
+    f = _open_compressed(file_name, 'rb')
+    data = f.read()
+    f.close()
+    if not data.startswith(BINARY_IPASN_MAGIC):
+        raise ValueError("Not a binary IPASN file: '%s'" % file_name)
+    offset = len(BINARY_IPASN_MAGIC)
+    version, _, desc_len = unpack_from('>BIH', data, offset)
+    if version not in (1, BINARY_IPASN_VERSION):
+        raise ValueError("Unsupported binary IPASN file version %d" % version)
+    description = data[offset + 7:offset + 7 + desc_len]
+    offset += 7 + desc_len
+    count_len, unpack_count = (1, _UNPACK_B) if version == 1 else (2, _UNPACK_H)
+    try:
+        while True:
+            family, masklen = _UNPACK_BB(data, offset)
+            if not family:
+                counts = unpack_from('>II', data, offset + 2)
+                break
+            octets = (masklen + 7) // 8
+            network = data[offset + 2:offset + 2 + octets]
+            n = unpack_count(data, offset + 2 + octets)[0]
+            origins = unpack_from('>%dI' % n, data, offset + 2 + count_len + octets)
+            add(family, network, masklen, origins[0] if n == 1 else set(origins))
+            offset += 2 + count_len + octets + 4 * n
+    except struct_error:
+        raise ValueError("Truncated binary IPASN file: '%s'" % file_name)
+    return description, counts, data[offset + 10:]
+
+
+def check_ipasn_file(ipasn_file_name):
+    """
+    Checks that an IPASN file (text or binary, plain or compressed) was written completely: the
+    prefix counts in its header (trailer for binary files) should match the prefixes in the file.
+    :return: (IPv4, IPv6) prefix counts if valid, None if not (or if the file doesn't exist)
+    """
+    counts, n = {}, 0
+    try:
+        f = _open_compressed(ipasn_file_name, 'rb')
+        try:
+            head = f.read(len(BINARY_IPASN_MAGIC))
+            if head == BINARY_IPASN_MAGIC:
+                return read_ipasn_binary_file(ipasn_file_name).family_counts()
+            for line in chain([head + f.readline()], f):
+                if line.startswith(b';'):
+                    if line.startswith((b'; Prefixes-v4', b'; Prefixes-v6')):
+                        counts[line[12:13]] = int(line.split(b':')[1])
+                elif line.strip():
+                    n += 1
+        finally:
+            f.close()
+    except (IOError, OSError, EOFError, ValueError, ImportError):
+        return None  # missing, truncated/corrupt, or zstd without the zstandard module
+    if len(counts) != 2 or counts[b'4'] + counts[b'6'] != n:
+        return None
+    return counts[b'4'], counts[b'6']
 
 
 def dump_prefixes_to_text_file(ipasn_data,
@@ -218,6 +1664,387 @@ def dump_prefixes_to_text_file(ipasn_data,
 # dump_prefixes_to_binary_file():
 # DEPRECATED because our binary format lacked IPv6 support, and its loader wasn't fully tested.
 # In place, pyasn_util_convert has '--compress' now, and pyasn can load gzipped IPASN files.
+# The newer binary format (dump_prefixes_to_file(..., binary=True)) has IPv6 and AS_SETs; it is
+# read back with read_ipasn_binary_file(), e.g. for diffs and merges, but pyasn loads text files.
+
+
+class PrefixChange(object):
+    """
+    A difference between two prefix tables, as yielded by diff_prefixes(): kind is ADDED (old is
+    None), REMOVED (new is None) or CHANGED (origin differs); old/new are the origins (ASN or set).
+    """
+    ADDED, REMOVED, CHANGED = 'added', 'removed', 'changed'
+    __slots__ = ('kind', 'prefix', 'old', 'new')
+
+    def __init__(self, kind, prefix, old, new):
+        self.kind, self.prefix, self.old, self.new = kind, prefix, old, new
+
+    def __eq__(self, other):
+        return isinstance(other, PrefixChange) and \
+            (self.kind, self.prefix, self.old, self.new) == \
+            (other.kind, other.prefix, other.old, other.new)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "PrefixChange(%s %s: %s -> %s)" % (self.kind, self.prefix, self.old, self.new)
+
+
+def _iter_sorted_prefixes(source):
+    # yields [(family, network, masklen), origin, prefix string] of a prefix table, in the order
+    # of the keys (network is packed, full length). Either key or string may be None, to be
+    # filled in by diff_prefixes() only when needed
+    if isinstance(source, (str, type(u''))):
+        source = _load_prefix_table(source)
+    radix = getattr(source, 'radix', source)  # a pyasn instance, or a bare Radix
+    if isinstance(source, CompactPrefixTable):
+        for family, network, masklen, origin in source.iter_sorted():
+            yield [(family, network, masklen), origin, None]
+    elif hasattr(radix, 'nodes'):
+        # the radix walk is pre-order, 0-bit branch first, IPv4 before IPv6: already sorted
+        for node in radix.nodes():
+            yield [None, node.asn, node.prefix]
+    else:
+        split = CompactPrefixTable._split
+        for key, prefix in sorted((split(prefix), prefix) for prefix in source):
+            yield [key, source[prefix], prefix]
+
+
+def _load_prefix_table(file_name):
+    # prefix table of a file: binary or text IPASN file (plain or compressed), or MRT archive
+    try:
+        f = open_archive(file_name)
+    except TypeError:
+        f = open(file_name, 'rb')  # uncompressed IPASN file
+    head = f.read(12)
+    f.close()
+    if head.startswith(BINARY_IPASN_MAGIC):
+        return read_ipasn_binary_file(file_name)
+    if _archive_kind(head) == 'raw':
+        return parse_mrt_file(file_name, compact=True)
+    from .pyasn_radix import Radix  # the C loader is much faster than parsing lines here
+    f = _open_compressed(file_name, 'rb')
+    data = f.read().decode('ascii')
+    f.close()
+    radix = Radix()
+    radix.load_ipasndb("", data)
+    return radix
+
+
+def _same_origin(a, b):
+    # an AS_SET origin matches a single ASN of the set: text IPASN files keep one AS of a set,
+    # and binary ones store single-AS sets as plain ASNs
+    if isinstance(a, set):
+        return not isinstance(b, set) and b in a
+    return isinstance(b, set) and a in b
+
+
+def diff_prefixes(old, new, counts=None):
+    """
+    Yields the differences between two prefix tables as PrefixChange objects, in a single linear
+    merge of the sorted tables (IPv4 then IPv6, by network then mask length).\n
+    old, new: a pyasn instance, Radix, CompactPrefixTable, prefix dict (as parse_mrt_file()
+    returns), or the name of an IPASN file (text or binary, plain or compressed) or MRT archive.
+    An AS_SET origin is taken to match any single ASN of it (text IPASN files keep just one).
+    counts: optional dict, updated with the number of 'added', 'removed', 'changed' and
+    'unchanged' prefixes (complete once the generator is exhausted).
+    """
+    if counts is None:
+        counts = {}
+    for kind in (PrefixChange.ADDED, PrefixChange.REMOVED, PrefixChange.CHANGED, 'unchanged'):
+        counts.setdefault(kind, 0)
+    old_iter, new_iter = _iter_sorted_prefixes(old), _iter_sorted_prefixes(new)
+    a, b = next(old_iter, None), next(new_iter, None)
+    while a is not None and b is not None:
+        if a[2] is not None and a[2] == b[2]:
+            order = 0  # same prefix string: no need to parse it (the common case)
+        else:
+            _fill_prefix_key(a)
+            _fill_prefix_key(b)
+            order = 0 if a[0] == b[0] else -1 if a[0] < b[0] else 1
+        if order == 0:
+            if a[1] == b[1] or _same_origin(a[1], b[1]):
+                counts['unchanged'] += 1
+            else:
+                counts[PrefixChange.CHANGED] += 1
+                yield PrefixChange(PrefixChange.CHANGED, _prefix_string(a), a[1], b[1])
+            a, b = next(old_iter, None), next(new_iter, None)
+        elif order < 0:
+            counts[PrefixChange.REMOVED] += 1
+            yield PrefixChange(PrefixChange.REMOVED, _prefix_string(a), a[1], None)
+            a = next(old_iter, None)
+        else:
+            counts[PrefixChange.ADDED] += 1
+            yield PrefixChange(PrefixChange.ADDED, _prefix_string(b), None, b[1])
+            b = next(new_iter, None)
+    for c in chain([a] if a is not None else [], old_iter):
+        counts[PrefixChange.REMOVED] += 1
+        yield PrefixChange(PrefixChange.REMOVED, _prefix_string(c), c[1], None)
+    for c in chain([b] if b is not None else [], new_iter):
+        counts[PrefixChange.ADDED] += 1
+        yield PrefixChange(PrefixChange.ADDED, _prefix_string(c), None, c[1])
+
+
+def _fill_prefix_key(item):
+    if item[0] is None:
+        item[0] = CompactPrefixTable._split(item[2])
+
+
+def _prefix_string(item):
+    if item[2] is None:
+        item[2] = CompactPrefixTable.format_prefix(*item[0])
+    return item[2]
+
+
+class CompactPrefixTable(object):
+    """
+    Memory-compact container for the output of parse_mrt_file(compact=True).\n
+    Prefixes are kept per address family in packed arrays (network bytes, mask length, origin
+    ASN), with a side table for AS_SET origins. It works like the prefix dict, keyed by
+    "NETWORK/MASK" strings: len(), in, [], get(), keys(), values(), items(), and also del/[]= for
+    incremental updates (see apply_bgp_updates()).
+    Iteration yields the IPv4 prefixes first, then the IPv6 ones, each in insertion order.
+    iter_packed() walks the table without formatting any strings.
+    """
+    OCTETS = {4: 4, 6: 16}
+    _ASN_TYPECODE = 'I' if array('I').itemsize >= 4 else 'L'
+    _SET_ORIGIN = 0  # origin placeholder of AS_SET rows; AS0 rows hold it too, but no set
+
+    def __init__(self):
+        self._nets = {4: bytearray(), 6: bytearray()}
+        self._masks = {4: array('B'), 6: array('B')}
+        self._origins = {4: array(self._ASN_TYPECODE), 6: array(self._ASN_TYPECODE)}
+        self._sets = {}  # {(family, row): set(origins)}
+        self._deleted = set()  # {(family, row)} of removed prefixes, dropped by the next rehash
+        # open-addressing hash of the rows (row + 1; 0 is empty), to find prefixes & repetitions
+        # without a Python object per prefix; removed rows stay in it until it is rebuilt
+        self._slots = dict((family, array(self._ASN_TYPECODE, [0]) * 8) for family in (4, 6))
+        self._count = 0
+        self._index = None  # {family: array of rows sorted by prefix}, built by iter_sorted()
+
+    @classmethod
+    def _pad(cls, family, network):
+        # TDv2 stores only the octets covered by the mask; pad to the full address length
+        return bytes(network) + b'\0' * (cls.OCTETS[family] - len(network))
+
+    @staticmethod
+    def _split(prefix):
+        # "NETWORK/MASK" -> (family, packed network, mask), or None if not a valid prefix
+        try:
+            net, mask = prefix.split('/')
+            if ':' in net:
+                return 6, inet_pton(AF_INET6, net), int(mask)
+            return 4, inet_aton(net), int(mask)
+        except (AttributeError, ValueError, OSError, IOError):
+            return None
+
+    @staticmethod
+    def format_prefix(family, network, masklen):
+        """Returns the "NETWORK/MASK" string of a packed (full length) network"""
+        if family == 4:
+            return "%s/%d" % (inet_ntoa(network), masklen)
+        return "%s/%d" % (inet_ntop(AF_INET6, network), masklen)
+
+    def has_packed(self, family, network, masklen):
+        return self._find_packed(family, network, masklen) is not None
+
+    def add(self, family, network, masklen, origin):
+        """
+        Adds a prefix given its family (4 or 6), packed network (may be truncated to the mask)
+        and mask length. Returns False, leaving the table unchanged, if it already exists.
+        """
+        network = self._pad(family, network)
+        if 2 * (len(self._masks[family]) + 1) > len(self._slots[family]):
+            self._rehash(family)  # may drop removed rows
+        row = len(self._masks[family])
+        found, slot = self._probe(family, network, masklen)
+
+        if found is not None:
+            return False
+        self._slots[family][slot] = row + 1
+        self._nets[family] += network
+        self._masks[family].append(masklen)
+        self._origins[family].append(self._SET_ORIGIN)
+        self._set_origin(family, row, origin)
+        self._count += 1
+        self._index = None
+        return True
+
+    def set_packed(self, family, network, masklen, origin):
+        """Sets the origin of a prefix, adding it if needed. Returns True if it was added."""
+        if self.add(family, network, masklen, origin):
+            return True
+        self._set_origin(*(self._find_packed(family, network, masklen) + (origin,)))
+        return False
+
+    def discard_packed(self, family, network, masklen):
+        """Removes a prefix. Returns False if it wasn't in the table."""
+        found = self._find_packed(family, network, masklen)
+        if not found:
+            return False
+        self._sets.pop(found, None)
+        self._deleted.add(found)
+        self._count -= 1
+        return True
+
+    def _set_origin(self, family, row, origin):
+        if isinstance(origin, set):
+            self._sets[(family, row)] = origin
+            origin = self._SET_ORIGIN
+        else:
+            self._sets.pop((family, row), None)
+        self._origins[family][row] = origin
+
+    def _row(self, family, row):
+        octs = self.OCTETS[family]
+        network = bytes(self._nets[family][row * octs:(row + 1) * octs])
+        origin = self._origins[family][row]
+        if origin == self._SET_ORIGIN:
+            origin = self._sets.get((family, row), origin)  # or an AS0 origin (seen in RIBs)
+
+        return network, self._masks[family][row], origin
+
+    def _insert_slot(self, family, row, network, masklen):
+        slots = self._slots[family]
+        mask = len(slots) - 1
+        i = crc32(network, masklen) & mask
+        while slots[i]:
+            i = (i + 1) & mask
+        slots[i] = row + 1
+
+    def _rehash(self, family):
+        # rebuilds the hash of a family's rows, at most half full with room to double, after
+        # dropping the removed rows from the arrays (so updates don't grow them, or the hash)
+        if any(f == family for f, _ in self._deleted):
+            self._drop_deleted(family)
+        octs, nets, masks = self.OCTETS[family], self._nets[family], self._masks[family]
+        size = 8
+        while size < 4 * (len(masks) + 1):
+            size <<= 1
+        self._slots[family] = array(self._ASN_TYPECODE, [0]) * size
+        for r in range(len(masks)):
+            self._insert_slot(family, r, bytes(nets[r * octs:(r + 1) * octs]), masks[r])
+
+    def _drop_deleted(self, family):
+        # compacts a family's arrays to the rows not removed, in order, renumbering their sets
+        octs, nets, masks = self.OCTETS[family], self._nets[family], self._masks[family]
+        deleted = sorted(r for f, r in self._deleted if f == family)
+        live = [r for r in range(len(masks)) if (family, r) not in self._deleted]
+        self._nets[family] = bytearray(b''.join(nets[r * octs:(r + 1) * octs] for r in live))
+        self._masks[family] = array('B', (masks[r] for r in live))
+        self._origins[family] = array(self._ASN_TYPECODE,
+                                      (self._origins[family][r] for r in live))
+        self._sets = dict(((f, r - bisect_left(deleted, r)) if f == family else (f, r), origin)
+                          for (f, r), origin in self._sets.items())
+        self._deleted = set(key for key in self._deleted if key[0] != family)
+        self._index = None
+
+
+    def _find_packed(self, family, network, masklen):
+        # returns (family, row) of a prefix, or None
+        return self._probe(family, self._pad(family, network), masklen)[0]
+
+    def _probe(self, family, network, masklen):
+        # linear probing in the hash of rows, for a (padded) network: returns ((family, row),
+        # its slot) if the prefix is in the table, or (None, the empty slot to add it at)
+        octs, nets, masks, slots = (self.OCTETS[family], self._nets[family], self._masks[family],
+                                    self._slots[family])
+        mask = len(slots) - 1
+        i = crc32(network, masklen) & mask
+        while True:
+            r = slots[i]
+            if not r:
+                return None, i
+            r -= 1
+            if masks[r] == masklen and nets[r * octs:(r + 1) * octs] == network \
+               and not (self._deleted and (family, r) in self._deleted):
+                return (family, r), i
+            i = (i + 1) & mask
+
+    def _build_index(self):
+        self._index = {}
+        for family in (4, 6):
+            octs, nets, masks = self.OCTETS[family], self._nets[family], self._masks[family]
+            rows = sorted((r for r in range(len(masks)) if (family, r) not in self._deleted),
+                          key=lambda r: (nets[r * octs:(r + 1) * octs], masks[r]))
+            self._index[family] = array(self._ASN_TYPECODE, rows)
+
+    def _find(self, prefix):
+        split = self._split(prefix)
+        return self._find_packed(*split) if split else None
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, prefix):
+        split = self._split(prefix)
+        return bool(split) and self.has_packed(*split)
+
+    def __getitem__(self, prefix):
+        found = self._find(prefix)
+        if not found:
+            raise KeyError(prefix)
+        return self._row(*found)[2]
+
+    def __setitem__(self, prefix, origin):
+        split = self._split(prefix)
+        if not split:
+            raise ValueError("Invalid prefix '%s'" % prefix)
+        self.set_packed(*(split + (origin,)))
+
+    def __delitem__(self, prefix):
+        split = self._split(prefix)
+        if not split or not self.discard_packed(*split):
+            raise KeyError(prefix)
+
+    def get(self, prefix, default=None):
+        found = self._find(prefix)
+        return self._row(*found)[2] if found else default
+
+    def family_counts(self):
+        """Returns (IPv4, IPv6) prefix counts"""
+        deleted6 = sum(1 for family, _ in self._deleted if family == 6)
+        return (len(self._masks[4]) - len(self._deleted) + deleted6,
+                len(self._masks[6]) - deleted6)
+
+    def iter_packed(self):
+        """Yields (family, packed network, mask length, origin) of all prefixes"""
+        for family in (4, 6):
+            for row in range(len(self._masks[family])):
+                if self._deleted and (family, row) in self._deleted:
+                    continue
+                network, masklen, origin = self._row(family, row)
+                yield family, network, masklen, origin
+
+    def iter_sorted(self):
+        """Like iter_packed(), but in order: IPv4 then IPv6, each by network then mask length"""
+        if self._index is None:
+            self._build_index()
+        for family in (4, 6):
+            for row in self._index[family]:
+                if self._deleted and (family, row) in self._deleted:
+                    continue  # removed after the index was built
+                network, masklen, origin = self._row(family, row)
+                yield family, network, masklen, origin
+
+    def items(self):
+        for family, network, masklen, origin in self.iter_packed():
+            yield self.format_prefix(family, network, masklen), origin
+
+    def keys(self):
+        for prefix, _ in self.items():
+            yield prefix
+
+    def values(self):
+        for _, _, _, origin in self.iter_packed():
+            yield origin
+
+    def __iter__(self):
+        return self.keys()
+
+    def __repr__(self):
+        return "CompactPrefixTable (%d IPV4 + %d IPV6 prefixes)" % self.family_counts()
 
 
 def is_asn_bogus(asn):
@@ -252,9 +2079,11 @@ def is_asn_bogus(asn):
 
 class MrtRecord:
     """Class for generic MRT Records. Implements common header, and methods for some sub-types"""
-    # We are interested in MRT-record types Table_Dump, Table_Dump_V2, and some sub-types
+    # We are interested in MRT-record types Table_Dump, Table_Dump_V2, BGP4MP(_ET) & some sub-types
     TYPE_TABLE_DUMP = 12
     TYPE_TABLE_DUMP_V2 = 13
+    TYPE_BGP4MP = 16
+    TYPE_BGP4MP_ET = 17  # BGP4MP with an extra microseconds timestamp
     T1_AFI_IPv4 = 1
     T1_AFI_IPv6 = 2
     T2_PEER_INDEX = 1
@@ -266,7 +2095,7 @@ class MrtRecord:
         self.detail = None
 
     @staticmethod
-    def next_dump_table_record(f, optimize_parse=True):
+    def next_dump_table_record(f, optimize_parse=True, prefix_filter=None):
         header_len = 12
         buf = f.read(header_len)  # read table-header
         if not buf:  # EOF
@@ -274,18 +2103,25 @@ class MrtRecord:
         mrt = MrtRecord(buf)
         buf = f.read(mrt.data_len)  # read table-data
         assert len(buf) == mrt.data_len
-        if mrt.type == MrtRecord.TYPE_TABLE_DUMP:
-            assert mrt.sub_type in (MrtRecord.T1_AFI_IPv4, MrtRecord.T1_AFI_IPv6)
-            mrt.detail = MrtTD1Record(buf, mrt.sub_type, optimize_parse)
-        elif mrt.type == MrtRecord.TYPE_TABLE_DUMP_V2:
+        mrt.parse_detail(buf, optimize_parse, prefix_filter)
+        return mrt
+
+    def parse_detail(self, buf, optimize_parse=True, prefix_filter=None):
+        # parses the record's data (read after the header) into self.detail
+        if self.type == MrtRecord.TYPE_TABLE_DUMP:
+            assert self.sub_type in (MrtRecord.T1_AFI_IPv4, MrtRecord.T1_AFI_IPv6)
+            self.detail = MrtTD1Record(buf, self.sub_type, optimize_parse, prefix_filter)
+        elif self.type == MrtRecord.TYPE_TABLE_DUMP_V2:
             # only allow these types
-            assert mrt.sub_type in (MrtRecord.T2_PEER_INDEX,
-                                    MrtRecord.T2_RIB_IPV4,
-                                    MrtRecord.T2_RIB_IPV6)
-            mrt.detail = MrtTD2Record(buf, mrt.sub_type, optimize_parse)
+            assert self.sub_type in (MrtRecord.T2_PEER_INDEX,
+                                     MrtRecord.T2_RIB_IPV4,
+                                     MrtRecord.T2_RIB_IPV6)
+            self.detail = MrtTD2Record(buf, self.sub_type, optimize_parse, prefix_filter)
+        elif self.type in (MrtRecord.TYPE_BGP4MP, MrtRecord.TYPE_BGP4MP_ET):
+            self.detail = MrtBgp4mpRecord(buf, self.sub_type,
+                                          self.type == MrtRecord.TYPE_BGP4MP_ET)
         else:
-            raise Exception("MrtTableHeader got an unknown MRT table dump TYPE <%d>!" % mrt.type)
-        return mrt
+            raise Exception("MrtTableHeader got an unknown MRT table dump TYPE <%d>!" % self.type)
 
     def __repr__(self):
         if self.detail:
@@ -299,45 +2135,113 @@ class MrtRecord:
     def prefix(self):
         return self.detail.prefix if self.detail else None  # CIDR/MASK string
 
-    def get_first_origin_as(self, ignore_exception=False):
+    @property
+    def packed_prefix(self):
+        return self.detail.packed_prefix if self.detail else None  # (family, network, masklen)
+
+    def get_first_origin_as(self, ignore_exception=False, peer_indexes=None):
         # For TableDumpV2 we only use entry 0's attributes... (TD1 have single entry)
+        # With peer_indexes, the first entry of those peers (None if there's none); see
+        # MrtTD2Record.select_peers()
         try:
-            path = None
+            if peer_indexes is not None and self.type == MrtRecord.TYPE_TABLE_DUMP_V2:
+                return self.detail.get_peer_origin(peer_indexes)
             attrs = self.detail.attrs if self.type == MrtRecord.TYPE_TABLE_DUMP else \
                 self.detail.entries[0].attrs
-            for a in attrs:
-                if a.bgp_type == BgpAttribute.ATTR_AS_PATH:
-                    assert not path  # only one as-path attribute in each entry
-                    path = a.path_detail()
-            assert path
-            return path.get_origin_as()
+            return self._origin_as_from_attrs(attrs)
         except:
             if not ignore_exception:
                 raise
             else:
                 return "<exception>"
 
+    def get_all_origins(self, ignore_exception=False):
+        # Origins of all entries (peers) of a record (TD1 records have a single entry).
+        # Entries that fail to parse are left out if ignore_exception is set.
+        if self.detail._optimize:
+            # parsed entries/attributes are incomplete; decode origins from the raw record
+            return self.detail.get_entry_origins(ignore_exception)
+        if self.type == MrtRecord.TYPE_TABLE_DUMP:
+            all_attrs = [self.detail.attrs]
+        else:
+            all_attrs = (entry.attrs for entry in self.detail.entries)
+        origins = []
+        for attrs in all_attrs:
+            try:
+                origins.append(self._origin_as_from_attrs(attrs))
+            except:
+                if not ignore_exception:
+                    raise
+        return origins
+
+    @staticmethod
+    def _origin_as_from_attrs(attrs):
+        path = None
+        for a in attrs:
+            if a.bgp_type == BgpAttribute.ATTR_AS_PATH:
+                assert not path  # only one as-path attribute in each entry
+                path = a.path_detail()
+        assert path
+        return path.get_origin_as()
+
 
 class MrtTD1Record:
     """MrtTD1Record: class to hold and parse MRT Table_Dumps records"""
 
-    def __init__(self, buf, sub_type, optimize_parse=True):
-        self.sub_type, self.seq, self.prefix, self.attr_len = sub_type, None, None, None
+    def __init__(self, buf, sub_type, optimize_parse=True, prefix_filter=None):
+        self.sub_type, self.seq, self._prefix, self.attr_len = sub_type, None, None, None
         self.view, self.seq = unpack('>HH', buf[:4])
         assert self.sub_type in (MrtRecord.T1_AFI_IPv4, MrtRecord.T1_AFI_IPv6)
         octs = 4 if self.sub_type == MrtRecord.T1_AFI_IPv4 else 16
-        prefix = inet_ntoa(buf[4:4+octs]) if self.sub_type == MrtRecord.T1_AFI_IPv4 \
-            else inet_ntop(AF_INET6, buf[4:4+octs])  # FIXME: ntop() on Windows?
-        prefix_len, status, self.orig_ts = unpack('>BBI', buf[4+octs:10+octs])
+        self._network = buf[4:4+octs]
+        self.filtered_out = prefix_filter is not None and not prefix_filter.match(
+            4 if octs == 4 else 6, self._network, _UNPACK_B(buf, 4 + octs)[0])
+        if self.filtered_out:
+            return  # skip the rest
+        self.prefix_len, status, self.orig_ts = unpack('>BBI', buf[4+octs:10+octs])
         assert status == 1  # status octet is unused in TDv1 and SHOULD be set to 1
         # assert self.view == 0  # view is normally 0, used when having multiple RIB views
-        # we ignore peer-ip - it can be 4 or 16 octets.
+        self._peer_ip = buf[10+octs:10+octs*2]  # 4 or 16 octets, formatted on demand
         self.peer_as, self.attr_len = unpack('>HH', buf[10+octs*2:14+octs*2])
-        self.prefix = "%s/%d" % (prefix, prefix_len)
         self._attrs = []
         self._data_buf = buf[14+octs*2:]
         self._optimize = optimize_parse
 
+    @property
+    def prefix(self):
+        if not self._prefix:  # formatted on demand; compact conversions never need the string
+            s = inet_ntoa(self._network) if self.sub_type == MrtRecord.T1_AFI_IPv4 \
+                else inet_ntop(AF_INET6, self._network)  # FIXME: ntop() on Windows?
+            self._prefix = "%s/%d" % (s, self.prefix_len)
+        return self._prefix
+
+    @property
+    def packed_prefix(self):
+        return 4 if self.sub_type == MrtRecord.T1_AFI_IPv4 else 6, self._network, self.prefix_len
+
+    def get_entry_origins(self, ignore_exception=False):
+        # see MrtTD2Record.get_entry_origins(); TD1 records hold one entry, with 16bit ASNs
+        try:
+            return [fast_origin_as(self._data_buf, 0, self.attr_len, is32=False)]
+        except:
+            if not ignore_exception:
+                raise
+            return []
+
+    @property
+    def peer_ip(self):
+        return inet_ntoa(self._peer_ip) if len(self._peer_ip) == 4 \
+            else inet_ntop(AF_INET6, self._peer_ip)
+
+    def get_entry_paths(self, ignore_exception=False):
+        # see MrtTD2Record.get_entry_paths()
+        try:
+            return [fast_as_path(self._data_buf, 0, self.attr_len, is32=False)]
+        except:
+            if not ignore_exception:
+                raise
+            return []
+
     @property
     def attrs(self):
         # The BGP Attribute fields contains information for the RIB entry (parsed on demand)
@@ -365,27 +2269,37 @@ class MrtTD2Record:
     # Main difference between MTD1 and MTD2 is support of 4-byte ASNs, BGP multiprotocol
     # extensions, and that an MRT record can encode multiple table entries for one prefix.
 
-    def __init__(self, buf, sub_type, optimize_parse=True):
-        self.prefix, self.sub_type, self._optimize = None, sub_type, optimize_parse
+    def __init__(self, buf, sub_type, optimize_parse=True, prefix_filter=None):
+        self._prefix, self.sub_type, self._optimize = None, sub_type, optimize_parse
+        self._network, self.prefix_len, self.filtered_out = None, None, False
 
         if self.sub_type == MrtRecord.T2_PEER_INDEX:
             # PEER_INDEX_TABLE provides BGP ID of the collector and list of peers
             self.collector, vn_len = unpack('>IH', buf[0:6])
             self.peer_count = unpack('>H', buf[6+vn_len:6+vn_len+2])[0]
+            # (BGP ID, IP address, ASN) of each peer; RIB entries refer to peers by position
+            self.peers, offset = [], 8 + vn_len
+            for i in range(self.peer_count):
+                peer_type = _UNPACK_B(buf, offset)[0]
+                ip_len, as_fmt = 16 if peer_type & 1 else 4, '>I' if peer_type & 2 else '>H'
+                bgp_id, ip = inet_ntoa(buf[offset+1:offset+5]), buf[offset+5:offset+5+ip_len]
+                ip = inet_ntoa(ip) if ip_len == 4 else inet_ntop(AF_INET6, ip)
+                asn = unpack_from(as_fmt, buf, offset + 5 + ip_len)[0]
+                self.peers.append((bgp_id, ip, asn))
+                offset += 5 + ip_len + (4 if peer_type & 2 else 2)
 
         elif self.sub_type in (MrtRecord.T2_RIB_IPV4, MrtRecord.T2_RIB_IPV6):
             self.seq, mask = unpack('>IB', buf[0:5])
 
             octets = (mask + 7) // 8
-            max_octs = 16 if sub_type == MrtRecord.T2_RIB_IPV6 else 4
-            padding = bytes(max_octs - octets) if not IS_PYTHON2 else '\0'*(max_octs - octets)
-            if sub_type == MrtRecord.T2_RIB_IPV4:
-                s = inet_ntoa(buf[5:5+octets] + padding)  # ntoa() faster than IPAddress class
-            elif sub_type == MrtRecord.T2_RIB_IPV6:
-                s = inet_ntop(AF_INET6, buf[5:5+octets] + padding)  # FIXME: ntop() on Windows?
-            self.prefix = s + "/%d" % mask
+            self._network, self.prefix_len = buf[5:5+octets], mask  # string formatted on demand
+            if prefix_filter is not None and not prefix_filter.match(
+                    4 if self.sub_type == MrtRecord.T2_RIB_IPV4 else 6, self._network, mask):
+                self.filtered_out, self.entries = True, []
+                return  # skip the entries
 
             self.entry_count = unpack('>H', buf[5 + octets:7 + octets])[0]
+            self._buf, self._entries_offset = buf, 7 + octets  # for get_entry_origins()
             buf = buf[7 + octets:]
             self.entries = []
             for i in range(self.entry_count):
@@ -400,6 +2314,79 @@ class MrtTD2Record:
             # Unknown / unsupported sub-type
             pass
 
+    @property
+    def prefix(self):
+        if not self._prefix and self._network is not None:
+            max_octs = 16 if self.sub_type == MrtRecord.T2_RIB_IPV6 else 4
+            padding = b'\0' * (max_octs - len(self._network))
+            if self.sub_type == MrtRecord.T2_RIB_IPV4:
+                s = inet_ntoa(self._network + padding)  # ntoa() faster than IPAddress class
+            else:
+                s = inet_ntop(AF_INET6, self._network + padding)  # FIXME: ntop() on Windows?
+            self._prefix = s + "/%d" % self.prefix_len
+        return self._prefix
+
+    @property
+    def packed_prefix(self):
+        # (family, network octets covered by the mask, masklen); None for non-RIB sub-types
+        if self._network is None:
+            return None
+        return 4 if self.sub_type == MrtRecord.T2_RIB_IPV4 else 6, self._network, self.prefix_len
+
+    def get_entry_origins(self, ignore_exception=False):
+        """
+        Returns the origins of all RIB entries (one per peer). Rather than parsing the entries and
+        their attributes, this jumps from entry to entry in the raw record, and decodes only the
+        AS_PATH's last segment(s). Entries that fail are left out if ignore_exception is set.
+        """
+        buf, offset, origins = self._buf, self._entries_offset, []
+        for i in range(self.entry_count):
+            attr_len = _UNPACK_H(buf, offset + 6)[0]  # skip peer index & originated time
+            try:
+                origins.append(fast_origin_as(buf, offset + 8, offset + 8 + attr_len, is32=True))
+            except:
+                if not ignore_exception:
+                    raise
+            offset += 8 + attr_len
+        return origins
+
+    def select_peers(self, peers):
+        """
+        (PEER_INDEX_TABLE) Returns the positions of the peers whose IP, BGP ID or ASN is in peers,
+        for get_peer_origin() and MrtRecord.get_first_origin_as()
+        """
+        return frozenset(i for i, (bgp_id, ip, asn) in enumerate(self.peers)
+                         if ip in peers or bgp_id in peers or asn in peers)
+
+    def get_peer_origin(self, peer_indexes):
+        """
+        Returns the origin of the first RIB entry of one of the peers in peer_indexes, or None if
+        there's none. Entries of other peers are skipped by their length, without decoding.
+        """
+        buf, offset = self._buf, self._entries_offset
+        for i in range(self.entry_count):
+            peer, attr_len = _UNPACK_H(buf, offset)[0], _UNPACK_H(buf, offset + 6)[0]
+            if peer in peer_indexes:
+                return fast_origin_as(buf, offset + 8, offset + 8 + attr_len, is32=True)
+            offset += 8 + attr_len
+        return None
+
+    def get_entry_paths(self, ignore_exception=False):
+        """
+        Returns the AS_PATHs of all RIB entries (see fast_as_path()), walking the raw record like
+        get_entry_origins(). Entries that fail are left out if ignore_exception is set.
+        """
+        buf, offset, paths = self._buf, self._entries_offset, []
+        for i in range(self.entry_count):
+            attr_len = _UNPACK_H(buf, offset + 6)[0]
+            try:
+                paths.append(fast_as_path(buf, offset + 8, offset + 8 + attr_len, is32=True))
+            except:
+                if not ignore_exception:
+                    raise
+            offset += 8 + attr_len
+        return paths
+
     def __repr__(self):
         if self.sub_type in (MrtRecord.T2_RIB_IPV4, MrtRecord.T2_RIB_IPV6):
             ipv = "IPV4" if self.sub_type == MrtRecord.T2_RIB_IPV4 else "IPV6"
@@ -443,6 +2430,202 @@ class MrtTD2Record:
                                                                       self.peer, self.orig_ts)
 
 
+_UNPACK_BB = Struct('>BB').unpack_from  # precompiled for the hot paths
+_UNPACK_MRT_HEADER = Struct('>IHHI').unpack
+_UNPACK_B = Struct('>B').unpack_from
+_UNPACK_H = Struct('>H').unpack_from
+_UNPACK_I = Struct('>I').unpack_from
+
+
+
+def _find_as_path(buf, offset, end):
+    # (offset, length) of the AS_PATH attribute value, among the BGP attributes in buf[offset:end]
+    while offset < end:
+        flags, attr_type = _UNPACK_BB(buf, offset)
+        if flags & 0x10:  # extended length
+            attr_len = _UNPACK_H(buf, offset + 2)[0]
+            offset += 4
+        else:
+            attr_len = _UNPACK_B(buf, offset + 2)[0]
+            offset += 3
+        if attr_type == BgpAttribute.ATTR_AS_PATH:
+            return offset, attr_len
+        offset += attr_len
+    raise AssertionError("No AS_PATH attribute found")
+
+
+def fast_as_path(buf, offset, end, is32):
+    """
+    Returns the AS_PATH from the BGP attributes in buf[offset:end], as a list of (segment type,
+    tuple of ASNs); each path segment is bulk-unpacked straight from the raw bytes.
+    """
+    offset, attr_len = _find_as_path(buf, offset, end)
+    as_len, as_fmt = (4, 'I') if is32 else (2, 'H')
+    segments, end = [], offset + attr_len
+    while offset < end:
+        seg_type, count = _UNPACK_BB(buf, offset)
+        segments.append((seg_type, unpack_from('>%d%s' % (count, as_fmt), buf, offset + 2)))
+        offset += 2 + count * as_len
+    if offset != end:
+        raise AssertionError("Malformed AS_PATH")
+    return segments
+
+
+def fast_origin_as(buf, offset, end, is32):
+    """
+    Returns the originating AS from the BGP attributes in buf[offset:end], the same way as
+    BgpAttrASPath.get_origin_as(), but without building attribute and path objects: attribute and
+    path-segment headers are skipped by length, and only the last segment(s) are decoded.
+    """
+    offset, attr_len = _find_as_path(buf, offset, end)
+    segment = BgpAttribute.BgpAttrASPath.BgpPathSegment
+    as_len, as_fmt = (4, 'I') if is32 else (2, 'H')
+    if attr_len:
+        # most paths are one AS_SEQUENCE, whose last ASN is the origin: read just that one
+        seg_type, count = _UNPACK_BB(buf, offset)
+        if seg_type == segment.AS_SEQUENCE and count and 2 + count * as_len == attr_len:
+            asn = (_UNPACK_I if is32 else _UNPACK_H)(buf, offset + attr_len - as_len)[0]
+            if not is_asn_bogus(asn):
+                return asn
+    segments, end = [], offset + attr_len
+    while offset < end:
+        seg_type, count = _UNPACK_BB(buf, offset)
+        assert seg_type in (segment.AS_SET, segment.AS_SEQUENCE,
+                            segment.AS_CONFED_SEQUENCE, segment.AS_CONFED_SET)
+        segments.append((seg_type, count, offset + 2))
+        offset += 2 + count * as_len
+    assert segments[0][0] == segment.AS_SEQUENCE
+
+    for seg_type, count, start in reversed(segments):
+        path = unpack_from('>%d%s' % (count, as_fmt), buf, start)
+        if seg_type == segment.AS_SEQUENCE:
+            for asn in reversed(path):
+                if not is_asn_bogus(asn):
+                    return int(asn)
+        elif seg_type == segment.AS_SET:
+            origin = set(asn for asn in path if not is_asn_bogus(asn))
+            if origin:
+                return origin
+        else:
+            raise Exception("Invalid/Legacy BGP Path Segment: %d" % seg_type)
+    raise AssertionError("No valid origin AS in AS_PATH")
+
+
+class MrtBgp4mpRecord:
+    """MrtBgp4mpRecord: class to hold and parse MRT BGP4MP/BGP4MP_ET records (BGP messages)"""
+    # See rfc6396 (section 4.4), and rfc8050 for the ADD-PATH sub-types.
+    # Of the BGP messages we parse only UPDATEs: withdrawn routes, attributes, and announced
+    # routes (NLRI), including the MP_REACH_NLRI/MP_UNREACH_NLRI attributes used for IPv6.
+    STATE_CHANGE, MESSAGE, MESSAGE_AS4, STATE_CHANGE_AS4, MESSAGE_LOCAL, MESSAGE_AS4_LOCAL = \
+        0, 1, 4, 5, 6, 7
+    MESSAGE_ADDPATH, MESSAGE_AS4_ADDPATH, MESSAGE_LOCAL_ADDPATH, MESSAGE_AS4_LOCAL_ADDPATH = \
+        8, 9, 10, 11
+    AS4_SUB_TYPES = (MESSAGE_AS4, STATE_CHANGE_AS4, MESSAGE_AS4_LOCAL, MESSAGE_AS4_ADDPATH,
+                     MESSAGE_AS4_LOCAL_ADDPATH)
+    ADDPATH_SUB_TYPES = (MESSAGE_ADDPATH, MESSAGE_AS4_ADDPATH, MESSAGE_LOCAL_ADDPATH,
+                         MESSAGE_AS4_LOCAL_ADDPATH)
+    BGP_UPDATE = 2
+    AFI_IPv4, AFI_IPv6, SAFI_UNICAST = 1, 2, 1
+
+    def __init__(self, buf, sub_type, extended_ts=False):
+        self.sub_type, self.prefix, self.packed_prefix = sub_type, None, None  # not a RIB entry
+        self.usec, self.msg_type, self.attrs, self.announced, self.withdrawn = None, None, [], [], []
+        if extended_ts:
+            self.usec = unpack('>I', buf[:4])[0]
+            buf = buf[4:]
+        is32 = sub_type in self.AS4_SUB_TYPES
+        self.peer_as, self.local_as = unpack('>II' if is32 else '>HH', buf[:8 if is32 else 4])
+        offset = 8 if is32 else 4
+        self.if_index, afi = unpack('>HH', buf[offset:offset + 4])
+        offset += 4
+        octs = 4 if afi == self.AFI_IPv4 else 16
+        self.peer_ip = inet_ntoa(buf[offset:offset + octs]) if afi == self.AFI_IPv4 \
+            else inet_ntop(AF_INET6, buf[offset:offset + octs])
+        offset += 2 * octs  # we ignore local-ip
+
+        if sub_type in (self.STATE_CHANGE, self.STATE_CHANGE_AS4):
+            self.old_state, self.new_state = unpack('>HH', buf[offset:offset + 4])
+            return
+
+        # BGP message header: 16 bytes marker, length, type
+        msg_len, self.msg_type = unpack('>HB', buf[offset + 16:offset + 19])
+        if self.msg_type != self.BGP_UPDATE:
+            return
+        addpath = sub_type in self.ADDPATH_SUB_TYPES
+        end, offset = offset + msg_len, offset + 19
+        withdrawn_len = unpack('>H', buf[offset:offset + 2])[0]
+        offset += 2
+        self.withdrawn = self._parse_nlri(buf, offset, offset + withdrawn_len, 4, addpath)
+        offset += withdrawn_len
+        attrs_len = unpack('>H', buf[offset:offset + 2])[0]
+        offset += 2
+        data, j = buf[offset:offset + attrs_len], attrs_len
+        while j > 0:
+            attr = BgpAttribute(data, is32=is32)
+            data = data[len(attr):]
+            j -= len(attr)
+            self.attrs.append(attr)
+            if attr.bgp_type == BgpAttribute.ATTR_MP_REACH_NLRI:
+                afi, safi, nh_len = unpack('>HBB', attr.data[:4])
+                if safi == self.SAFI_UNICAST:
+                    self.announced += self._parse_nlri(attr.data, 5 + nh_len, len(attr.data),
+                                                       6 if afi == self.AFI_IPv6 else 4, addpath)
+            elif attr.bgp_type == BgpAttribute.ATTR_MP_UNREACH_NLRI:
+                afi, safi = unpack('>HB', attr.data[:3])
+                if safi == self.SAFI_UNICAST:
+                    self.withdrawn += self._parse_nlri(attr.data, 3, len(attr.data),
+                                                       6 if afi == self.AFI_IPv6 else 4, addpath)
+        offset += attrs_len
+        self.announced += self._parse_nlri(buf, offset, end, 4, addpath)
+
+    @staticmethod
+    def _parse_nlri(buf, offset, end, family, addpath):
+        # NLRI is a list of (length in bits, prefix octets); with ADD-PATH preceded by a path-id
+        prefixes = []
+        while offset < end:
+            if addpath:
+                offset += 4
+            masklen = _UNPACK_B(buf, offset)[0]
+            octets = (masklen + 7) // 8
+            prefixes.append((family, buf[offset + 1:offset + 1 + octets], masklen))
+            offset += 1 + octets
+        return prefixes
+
+    @property
+    def is_update(self):
+        return self.msg_type == self.BGP_UPDATE
+
+    def get_origin_as(self):
+        """
+        Origin of the announced prefixes; AS4_PATH is preferred on 2-byte ASN sessions.
+        None if the AS_PATH is empty (iBGP & some route-server sessions) or missing.
+        """
+        path = as4_path = None
+        for attr in self.attrs:
+            if attr.bgp_type == BgpAttribute.ATTR_AS_PATH:
+                path = attr.path_detail()
+            elif attr.bgp_type == BgpAttribute.ATTR_AS4_PATH:
+                as4_path = attr.path_detail()
+        path = path if path is not None and path.pathsegs else None
+        as4_path = as4_path if as4_path is not None and as4_path.pathsegs else None
+        if path is None and as4_path is None:
+            return None
+        if as4_path and path and \
+                path.pathsegs[-1].path and path.pathsegs[-1].path[-1] != AS_TRANS:
+            as4_path = None  # origin has a 2-byte ASN, no need for AS4_PATH (rfc6793)
+        return (as4_path or path).get_origin_as()
+
+    def __repr__(self):
+        if not self.is_update:
+            return "MrtBgp4mpRecord (sub-type %d, peer %s AS%d)" % (self.sub_type, self.peer_ip,
+                                                                    self.peer_as)
+        return "MrtBgp4mpRecord (UPDATE, peer %s AS%d, %d announced, %d withdrawn)" % \
+            (self.peer_ip, self.peer_as, len(self.announced), len(self.withdrawn))
+
+
+AS_TRANS = 23456  # placeholder for 4-byte ASNs on 2-byte sessions (rfc6793)
+
+
 class BgpAttribute:
     # BGP attributes are defined here:
     #   http://tools.ietf.org/html/rfc4271  (Section 5)
@@ -450,6 +2633,9 @@ class BgpAttribute:
     # They are part of BGP UPDATE messages.
     # We are mainly interested in parsing the AS_PATH attribute.
     ATTR_AS_PATH = 2
+    ATTR_MP_REACH_NLRI = 14
+    ATTR_MP_UNREACH_NLRI = 15
+    ATTR_AS4_PATH = 17
     ATTR_NAMES = ("TYPE-0", "ORIGIN", "AS_PATH", "NEXT_HOP", "MULTI_EXIT_DISC", "LOCAL_PREF",
                   "ATOMIC_AGGREGATE", "AGGREGATOR", "COMMUNITIES", "ORIGINATOR_ID",
                   "CLUSTER_LIST", "TYPE-11", "TYPE-12", "TYPE-13", "MP_REACH_NLRI",
@@ -477,7 +2663,7 @@ class BgpAttribute:
     def __repr__(self):
         t = self.bgp_type
         ret = "BGPAttribute({}): ".format((self.ATTR_NAMES[t] if 0 <= t <= 18 else "TYPE-%d" % t))
-        if t == self.ATTR_AS_PATH:
+        if t in (self.ATTR_AS_PATH, self.ATTR_AS4_PATH):
             ret += str(self.path_detail())
         elif 0 < len(self.data) <= 4:
             l = len(self.data)
@@ -488,9 +2674,10 @@ class BgpAttribute:
         return ret
 
     def path_detail(self):
-        assert self.bgp_type == self.ATTR_AS_PATH
+        assert self.bgp_type in (self.ATTR_AS_PATH, self.ATTR_AS4_PATH)
         if not self._detail:  # lazy conversion on request; speeds up TD1 parse by 20%
-            self._detail = self.BgpAttrASPath(self.data, self._is32)
+            is32 = self._is32 or self.bgp_type == self.ATTR_AS4_PATH  # AS4_PATH is always 4-byte
+            self._detail = self.BgpAttrASPath(self.data, is32)
         return self._detail
 
     class BgpAttrASPath:
@@ -595,16 +2782,11 @@ class BgpAttribute:
                                          self.AS_SEQUENCE,
                                          self.AS_CONFED_SEQUENCE,
                                          self.AS_CONFED_SET)
-                self.path = []
                 self.as_len = 4 if is32 else 2
-                for i in range(cnt):
-                    asn = unpack('>I' if is32 else '>H', data[:self.as_len])[0]
-                    # assert asn > 0
-                    # moved to origin_as() method to ignore strange asns in the middle of as-path.
-                    # e.g. in rib.20141014.0600.bz2, 193.104.137.128/25 has [20912, 0, 50112].
-                    # won't effect the origin
-                    data = data[self.as_len:]
-                    self.path.append(asn)
+                # unpacked in one go. (no assert asn > 0: moved to origin_as() method to ignore
+                # strange asns in the middle of as-path. e.g. in rib.20141014.0600.bz2,
+                # 193.104.137.128/25 has [20912, 0, 50112]. won't effect the origin)
+                self.path = list(unpack_from('>%d%s' % (cnt, 'I' if is32 else 'H'), data))
 
             def __len__(self):
                 return 2 + self.as_len * len(self.path)
@@ -0,0 +1,309 @@
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""pyasn.shard
+Module to serve lookups in many (historical) IPASN databases from several processes or nodes:
+each database (snapshot) is split by address range into shards, each loaded by a worker, and a
+router sends the addresses of a batch query to the workers of their shards, in parallel.
+
+Address ranges are made of buckets: the first 16 bits of an IPv4 address (buckets 0-65535) or
+of an IPv6 address (65536-131071). A prefix shorter than /16 spans several buckets, and is
+loaded by each shard it overlaps; so every shard answers the longest match of its addresses.
+
+Functions:
+  plan_shards()  -- splits the buckets of an IPASN database into ranges of about equal prefixes
+  load_shard()  -- loads the prefixes of an IPASN database that overlap a bucket range
+  serve_shard()  -- runs a shard worker, answering a router's batches (e.g. on another node)
+  address_bucket(), prefix_buckets()  -- buckets of an address, and of a prefix
+
+Other objects:
+   ShardRouter: splits batch queries over the shard workers, and merges their answers in order;
+                start_local() starts the workers of a set of snapshots as local processes
+"""
+
+from __future__ import print_function, division
+from multiprocessing import Process, Pipe
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from threading import Thread, Event
+from bisect import bisect_right
+from array import array
+from os import urandom
+from sys import stderr
+from ipaddress import ip_address
+from . import pyasn, mrtx
+
+SHARD_BUCKETS = 1 << 17
+_V6_BUCKETS = 1 << 16
+
+
+def address_bucket(ip_address):
+    """Returns the bucket of an IP address (string); raises ValueError if it isn't one"""
+    if ':' in ip_address:
+        head = ip_address.split(':', 1)[0]
+        bucket = int(head, 16) if head else 0
+        if not 0 <= bucket <= 0xffff:
+            raise ValueError("Invalid IP address '%s'" % ip_address)
+        return _V6_BUCKETS + bucket
+    a, b, _ = ip_address.split('.', 2)
+    a, b = int(a), int(b)
+    if not (0 <= a <= 255 and 0 <= b <= 255):
+        raise ValueError("Invalid IP address '%s'" % ip_address)
+    return a << 8 | b
+
+
+def prefix_buckets(prefix):
+    """Returns (first bucket, number of buckets) covered by a prefix ("NETWORK/MASK")"""
+    network, masklen = prefix.split('/')
+    masklen = int(masklen)
+    if ':' in network:
+        head = network.split(':', 1)[0]
+        first = _V6_BUCKETS + (int(head, 16) if head else 0)
+    else:
+        a, b, _ = (network + '.0.0').split('.', 2)
+        first = int(a) << 8 | int(b)
+    return first, 1 << (16 - masklen) if masklen < 16 else 1
+
+
+def _iter_ipasn_lines(ipasn_file):
+    # (prefix, line) of the prefixes of a text IPASN file (plain, .gz or .zst)
+    f = mrtx._open_compressed(ipasn_file, 'rb')
+    try:
+        for line in f:
+            line = line.decode('ascii')
+            if line and line[0] not in ';\n':
+                yield line.split('\t', 1)[0], line
+    finally:
+        f.close()
+
+
+def plan_shards(ipasn_file, shards):
+    """
+    Splits the buckets into `shards` contiguous ranges with about as many prefixes each, as
+    found in an IPASN file (a typical snapshot; plans can be reused across snapshots).
+    :return: list of (first bucket, last bucket + 1) ranges, covering all buckets
+    """
+    counts = array('L', [0]) * SHARD_BUCKETS
+    total = 0
+    for prefix, _ in _iter_ipasn_lines(ipasn_file):
+        counts[prefix_buckets(prefix)[0]] += 1
+        total += 1
+    ranges, lo, seen = [], 0, 0
+    for bucket in range(SHARD_BUCKETS):
+        seen += counts[bucket]
+        if len(ranges) < shards - 1 and seen >= total * (len(ranges) + 1) / shards:
+            ranges.append((lo, bucket + 1))
+            lo = bucket + 1
+    ranges.append((lo, SHARD_BUCKETS))
+    return ranges
+
+
+def load_shard(ipasn_file, lo, hi):
+    """Returns a pyasn of the prefixes of a (text) IPASN file that overlap buckets lo to hi - 1"""
+    lines = []
+    for prefix, line in _iter_ipasn_lines(ipasn_file):
+        first, count = prefix_buckets(prefix)
+        if first < hi and first + count > lo:
+            lines.append(line)
+    return pyasn(None, ipasn_string=''.join(lines))
+
+
+def serve_shard(ipasn_file, lo, hi, address=('127.0.0.1', 0), authkey=None, ready=None):
+    """
+    Loads a shard, and answers the batches of routers connecting to address (host, port), until
+    a router sends None. Each batch is a list of addresses, answered with the list of their
+    (asn, prefix), or with the ValueError of an invalid one. Connections are served in threads.
+    ready: a connection to send the listening address to, once loaded.
+    Connections carry pickles, so workers listening on other than a loopback address need an
+    authkey (the routers' authentication key).
+    :raises: ValueError if address is not a loopback address, and there is no authkey
+    """
+    if authkey is None and not _is_loopback(address):
+        raise ValueError("Listening on %s needs an authkey: any router could run code here"
+                         % (address,))
+    asndb = load_shard(ipasn_file, lo, hi)
+    listener = Listener(address, authkey=authkey)
+    if ready is not None:
+        ready.send(listener.address)
+        ready.close()
+
+    stopped = Event()
+
+    def serve(conn):
+        try:
+            while True:
+                batch = conn.recv()
+                if batch is None:
+                    stopped.set()
+                    break
+                try:
+                    conn.send(asndb.lookup_many(batch))
+                except ValueError as e:
+                    conn.send(e)
+        except (EOFError, IOError):
+            pass  # the router went away
+        finally:
+            conn.close()
+
+    def accept():
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                continue
+            except (EOFError, IOError, OSError) as e:
+                if stopped.is_set():
+                    return  # the listener is closed
+                print("  WARNING: shard worker failed to accept a connection (%s: %s)"
+                      % (type(e).__name__, e), file=stderr)
+                continue  # e.g. a router that went away during authentication
+
+            thread = Thread(target=serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+    thread = Thread(target=accept)
+    thread.daemon = True
+    thread.start()
+    stopped.wait()
+    listener.close()
+
+
+def _is_loopback(address):
+    # whether a listener address (host, port) only accepts connections from this node
+    host = address[0]
+    if host == 'localhost':
+        return True
+    try:
+        return ip_address(u'%s' % host).is_loopback
+    except ValueError:
+        return False  # another host name
+
+
+class ShardRouter(object):
+    """
+    Answers lookups in sharded snapshots: splits each batch by snapshot & shard, sends the parts
+    to the shard workers (all at once, so they work in parallel), and merges their answers back
+    in the order of the batch. A router is not thread-safe; use one per thread.\n
+    shards: list of (snapshot, first bucket, last bucket + 1, worker address), the buckets of
+    each snapshot covering all buckets. Snapshots are comparable keys, e.g. dates. Workers are
+    started with serve_shard() (e.g. on other nodes), or by ShardRouter.start_local().
+    """
+
+    def __init__(self, shards, authkey=None):
+        self.snapshots = sorted(set(shard[0] for shard in shards))
+        self.connections = []
+        self._tables = {}  # {snapshot: connection index of each bucket}
+        for snapshot, lo, hi, address in shards:
+            table = self._tables.get(snapshot)
+            if table is None:
+                table = self._tables[snapshot] = array('H', [0]) * SHARD_BUCKETS
+            table[lo:hi] = array('H', [len(self.connections)]) * (hi - lo)
+            self.connections.append(Client(address, authkey=authkey))
+        self.processes = []  # local workers, by start_local()
+
+    @staticmethod
+    def start_local(databases, shards=4, plan=None, authkey=None):
+        """
+        Starts a worker process for each shard of each database, and returns their router.
+        databases: {snapshot: IPASN file}; shards: number of shards of each; plan: the bucket
+        ranges (by default planned on the newest database).
+        """
+        authkey = authkey or urandom(16)
+        if plan is None:
+            plan = plan_shards(databases[max(databases)], shards)
+        started = []
+        for snapshot in sorted(databases):
+            for lo, hi in plan:
+                ready, ready_child = Pipe(duplex=False)
+                process = Process(target=serve_shard, args=(databases[snapshot], lo, hi),
+                                  kwargs={'authkey': authkey, 'ready': ready_child})
+                process.daemon = True
+                process.start()
+                started.append((snapshot, lo, hi, process, ready))
+        shards = []
+        for snapshot, lo, hi, process, ready in started:  # the workers load in parallel
+            shards.append((snapshot, lo, hi, ready.recv()))
+        router = ShardRouter(shards, authkey)
+        router.processes = [process for _, _, _, process, _ in started]
+        return router
+
+    def snapshot_for(self, date=None):
+        """Returns the snapshot to answer for date: the newest one not after it (None: newest)"""
+        if date is None:
+            return self.snapshots[-1]
+        i = bisect_right(self.snapshots, date)
+        if not i:
+            raise LookupError("No snapshot on or before %s" % (date,))
+        return self.snapshots[i - 1]
+
+    def lookup_many(self, ip_addresses, date=None):
+        """
+        Returns the (asn, prefix) of each address, in order, as pyasn.lookup() would in the
+        snapshot of date (see snapshot_for()); date can also be a list, one per address.
+        :raises: ValueError if an invalid IP address is passed.
+        """
+        ip_addresses = list(ip_addresses)
+        parts = {}  # {connection index: ([positions], [addresses])}
+        if isinstance(date, (list, tuple)):
+            tables = [self._tables[self.snapshot_for(d)] for d in date]
+        else:
+            tables = [self._tables[self.snapshot_for(date)]] * len(ip_addresses)
+        for i, (ip, table) in enumerate(zip(ip_addresses, tables)):
+            conn = table[address_bucket(ip)]
+            part = parts.get(conn)
+            if part is None:
+                part = parts[conn] = ([], [])
+            part[0].append(i)
+            part[1].append(ip)
+        for conn, (_, ips) in parts.items():
+            self.connections[conn].send(ips)
+        results, error = [None] * len(ip_addresses), None
+        for conn, (positions, _) in parts.items():
+            answer = self.connections[conn].recv()  # receive all, to keep the workers in step
+            if isinstance(answer, ValueError):
+                error = answer
+                continue
+            for i, found in zip(positions, answer):
+                results[i] = found
+        if error is not None:
+            raise error
+        return results
+
+    def lookup(self, ip_address, date=None):
+        """Returns the (asn, prefix) of an address, as pyasn.lookup() would (see lookup_many())"""
+        return self.lookup_many([ip_address], date)[0]
+
+    def close(self, stop_workers=None):
+        """
+        Closes the connections to the workers; stop_workers: also stop them (by default, only
+        the local workers of start_local())
+        """
+        if stop_workers is None:
+            stop_workers = bool(self.processes)
+        for conn in self.connections:
+            try:
+                if stop_workers:
+                    conn.send(None)
+                conn.close()
+            except (IOError, OSError):
+                pass
+        for process in self.processes:
+            process.join(5)
+        self.connections, self.processes = [], []
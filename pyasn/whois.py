@@ -0,0 +1,232 @@
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""pyasn.whois
+Module to answer IP to ASN queries over the Team Cymru whois protocol, from a loaded pyasn; a
+local, offline stand-in for whois.cymru.com, used by pyasn_util_whois. Requires
+Python 3.7+ (asyncio; not installed on older versions).
+
+Protocol (TCP, port 43; one query, or one bulk request, per connection):
+  single query:  "[-v] [-p] [-f] IP" or "[-v] ASN" (e.g. " -f 8.8.8.8", "-v AS15169")
+  bulk request:  "begin", options, one IP or ASN per line, "end". Options (one per line) are
+                 verbose, prefix/noprefix, asname/noasname, header/noheader; they apply to the
+                 lines after them. Text after an IP (a date, a comment) is ignored: the lookups
+                 are made in the loaded database.
+  answers:       "AS | IP | [BGP Prefix | CC | Registry | Allocated |] AS Name" for IPs, and
+                 "AS | [CC | Registry | Allocated |] AS Name" for ASNs; NA for what isn't known.
+                 CC is taken from the AS name (", CC" at its end); Registry & Allocated are NA.
+
+Other objects:
+   BulkWhoisServer: asyncio server of the protocol, for many concurrent clients
+"""
+
+import asyncio
+from datetime import datetime
+
+WHOIS_PORT = 43
+MAX_LINE = 1024  # longest query line accepted
+
+
+class _Options(object):
+    # output options of a query or bulk request
+    def __init__(self):
+        self.verbose, self.prefix, self.asname, self.header = False, False, True, True
+
+
+class BulkWhoisServer(object):
+    """
+    Answers the Team Cymru whois protocol from a pyasn, on an asyncio event loop, so that many
+    clients are served concurrently. The lines of a bulk request are looked up in batches (of
+    batch_size) as they arrive, and the loop runs other clients between batches; each batch's
+    AS names are fetched at once (pyasn.get_as_names()).\n
+    Use start() and close() on a running loop, or serve_forever() to run one.
+    """
+
+    def __init__(self, asndb, host='127.0.0.1', port=WHOIS_PORT, batch_size=1000, timeout=60,
+                 max_lines=10000000):
+        self.asndb, self.host, self.port = asndb, host, port
+        self.batch_size, self.timeout, self.max_lines = batch_size, timeout, max_lines
+        self.clients = self.queries = 0  # served so far, for diagnostics
+        self._server = None
+
+    async def start(self):
+        """Starts listening; the port is updated when 0 (any free port) was given"""
+        self._server = await asyncio.start_server(self._serve_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def serve_forever(self):
+        """Runs the server on a new event loop, until interrupted"""
+        async def run():
+            await self.start()
+            async with self._server:
+                await self._server.serve_forever()
+        asyncio.run(run())
+
+    async def _serve_client(self, reader, writer):
+        self.clients += 1
+        lines = self._lines(reader)
+        try:
+            line = await lines.__anext__()
+            if line.strip().lower() == 'begin':
+                await self._serve_bulk(lines, writer)
+            else:
+                options, words = _Options(), line.split()
+                while words and words[0].startswith('-'):
+                    flags = words.pop(0)
+                    options.verbose |= 'v' in flags
+                    options.prefix |= 'p' in flags
+                    options.header &= 'f' not in flags
+                if words:
+                    self.queries += 1
+                    writer.write(self._answer([words[0]], options, options.header).encode())
+            await writer.drain()
+        except (StopAsyncIteration, ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            await lines.aclose()
+            writer.close()
+
+    async def _lines(self, reader):
+        # the lines a client sends, read in blocks: waiting for each line would cost more than
+        # looking it up. Stops at a line over MAX_LINE bytes.
+        pending = b''
+        while True:
+            block = await asyncio.wait_for(reader.read(1 << 16), self.timeout)
+            if not block:
+                break
+            lines = (pending + block).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.decode('latin-1')
+            if len(pending) > MAX_LINE:
+                return
+        if pending:
+            yield pending.decode('latin-1')
+
+    async def _serve_bulk(self, lines, writer):
+        writer.write(('Bulk mode; %s [%s]\n' % (
+            self.host, datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S +0000'))).encode())
+        options, batch, n, header = _Options(), [], 0, True
+        async for line in lines:
+            word = line.split('#')[0].strip()
+            if not word:
+                continue
+            keyword = word.lower()
+            if keyword in ('end', 'verbose', 'prefix', 'noprefix', 'asname', 'noasname',
+                           'header', 'noheader'):
+                if batch:  # options apply to the lines after them
+                    writer.write(self._answer(batch, options, header).encode())
+                    batch, header = [], False
+                    await writer.drain()
+                if keyword == 'end':
+                    break
+                if keyword == 'verbose':
+                    options.verbose = True
+                elif keyword.endswith('prefix'):
+                    options.prefix = keyword == 'prefix'
+                elif keyword.endswith('asname'):
+                    options.asname = keyword == 'asname'
+                else:
+                    options.header = keyword == 'header'
+                continue
+            batch.append(word.split()[0])
+            n += 1
+            if len(batch) >= self.batch_size:
+                writer.write(self._answer(batch, options, header).encode())
+                batch, header = [], False
+                await writer.drain()
+                await asyncio.sleep(0)  # let other clients run between batches
+            if n >= self.max_lines:
+                break
+        if batch:  # no 'end' (or too many lines): answer what was read
+            writer.write(self._answer(batch, options, header).encode())
+        self.queries += n
+
+    def _answer(self, queries, options, header):
+        # the answer lines of a batch of queries (IPs or ASNs), with a header if asked for
+        ips = [q for q in queries if not _is_asn(q)]
+        found = dict((ip, self._lookup(ip)) for ip in ips)
+        asns = set(asn for asn, _ in found.values() if asn is not None)
+        asns.update(_asn(q) for q in queries if _is_asn(q))
+        names = self._names(sorted(asns)) if options.asname or options.verbose else {}
+        lines = []
+        if header and options.header:
+            if ips:
+                columns = ['AS      ', 'IP               ']
+                if options.prefix or options.verbose:
+                    columns.append('BGP Prefix         ')
+                if options.verbose:
+                    columns += ['CC', 'Registry', 'Allocated ']
+                if options.asname or options.verbose:
+                    columns.append('AS Name')
+                lines.append(' | '.join(columns).rstrip())
+            else:
+                columns = ['AS      ']
+                if options.verbose:
+                    columns += ['CC', 'Registry', 'Allocated ']
+                lines.append(' | '.join(columns + ['AS Name']))
+        for query in queries:
+            if _is_asn(query):
+                asn = _asn(query)
+                fields = ['%-8s' % asn]
+            else:
+                asn, prefix = found[query]
+                fields = ['%-8s' % ('NA' if asn is None else asn), '%-16s' % query]
+                if options.prefix or options.verbose:
+                    fields.append('%-18s' % (prefix or 'NA'))
+            name = names.get(asn)
+            if options.verbose:
+                fields += [_country(name), 'NA', 'NA']
+            if options.asname or options.verbose or _is_asn(query):
+                fields.append(name or 'NA')
+            lines.append(' | '.join(fields))
+        return ''.join(line + '\n' for line in lines)
+
+    def _lookup(self, ip):
+        try:
+            return self.asndb.lookup(ip)
+        except ValueError:  # not an IP address
+            return None, None
+
+    def _names(self, asns):
+        if not self.asndb.has_as_names():
+
+            return {}
+        return dict(zip(asns, self.asndb.get_as_names(asns)))
+
+
+def _is_asn(query):
+    return query[:2].upper() == 'AS' and query[2:].isdigit()
+
+
+def _asn(query):
+    return int(query[2:])
+
+
+def _country(name):
+    # country code at the end of an AS name, as in "GOOGLE - Google Inc., US"
+    if name and len(name) > 4 and name[-4:-2] == ', ' and name[-2:].isalpha():
+        return name[-2:]
+    return 'NA'
@@ -4,6 +4,7 @@ import sys
 import platform
 import glob
 from setuptools import setup, find_packages, Extension
+from setuptools.command.build_py import build_py
 from os.path import abspath, dirname, join
 
 here = abspath(dirname(__file__))
@@ -25,7 +26,23 @@ if sys.version_info[0] == 2:
     reqs.append('backport-ipaddress')
 
 
+# modules using async syntax (whois server, asyncio lookups), and the util running them, need
+# Python 3.7+; they aren't installed on older versions, where they wouldn't compile
+py37_modules = [('pyasn', 'whois'), ('pyasn', 'aio')]
+py37_utils = ['pyasn-utils/pyasn_util_whois.py']
+
+
+class BuildPy(build_py):
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 7):
+            modules = [m for m in modules if (m[0], m[1]) not in py37_modules]
+        return modules
+
+
 utils = glob.glob('pyasn-utils/*.py')
+if sys.version_info < (3, 7):
+    utils = [u for u in utils if u.replace('\\', '/') not in py37_utils]
 
 __version__ = None
 exec(open('pyasn/_version.py').read())  # load the actual __version__
@@ -55,6 +72,7 @@ setup(
     scripts=utils,
     setup_requires=[],
     packages=find_packages(exclude=['tests', 'tests.*']),
+    cmdclass={'build_py': BuildPy},
     zip_safe=False,
     # 20230901 switch from nose to pytest for running the tests
     # tests_require=['nose', 'coverage'],
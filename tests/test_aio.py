@@ -0,0 +1,76 @@
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, division
+from unittest import TestCase, skipIf
+from pyasn import pyasn
+from os import path
+import sys
+if sys.version_info >= (3, 7):
+    import asyncio
+    from pyasn.aio import AsyncPyasn
+
+IPASN_DB_PATH = path.join(path.dirname(__file__), "../data/ipasn_20140513.dat.gz")
+STATIC_CYMRUWHOIS_PATH = path.join(path.dirname(__file__), "../data/cymru.map")
+
+
+@skipIf(sys.version_info < (3, 7), "AsyncPyasn needs asyncio")
+class TestAsyncPyasn(TestCase):
+    asndb = pyasn(IPASN_DB_PATH)
+
+    def setUp(self):
+        with open(STATIC_CYMRUWHOIS_PATH, "r") as f:
+            self.ips = sorted(eval(f.read()))
+        self.expected = [self.asndb.lookup(ip) for ip in self.ips]
+
+    def test_coalescing(self):
+        """
+            Tests that concurrent lookups are answered correctly, in micro-batches
+        """
+        for offload in (True, False):
+            aio = AsyncPyasn(self.asndb, max_batch=64, offload=offload)
+            found = asyncio.run(aio.lookup_many(self.ips))
+            self.assertEqual(found, self.expected)
+            self.assertEqual(aio.lookups, len(self.ips))
+            self.assertEqual((aio.batches, aio.largest_batch), ((len(self.ips) + 63) // 64, 64))
+            self.assertTrue(0 < aio.max_loop_time <= aio.loop_time)
+            aio.close()
+
+    def test_latency_and_errors(self):
+        """
+            Tests that a lone lookup waits at most max_delay, and that invalid IPs raise
+        """
+        aio = AsyncPyasn(self.asndb, max_batch=1000, max_delay=0.01)
+
+        async def run():
+            lone = await aio.lookup(self.ips[0])
+            loop = asyncio.get_running_loop()
+            t0 = loop.time()
+            results = await asyncio.gather(aio.lookup('8.8.8.8'), aio.lookup('not-an-ip'),
+                                           aio.lookup('1.0.0.1'), return_exceptions=True)
+            return lone, loop.time() - t0, results
+        lone, elapsed, results = asyncio.run(run())
+        self.assertEqual(lone, self.expected[0])
+        self.assertTrue(elapsed < 1)
+        self.assertEqual(results[0], self.asndb.lookup('8.8.8.8'))
+        self.assertTrue(isinstance(results[1], ValueError))
+        self.assertEqual(results[2], self.asndb.lookup('1.0.0.1'))
+        self.assertEqual(aio.batches, 2)
+        aio.close()
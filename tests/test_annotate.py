@@ -0,0 +1,111 @@
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, division
+from unittest import TestCase, skipIf
+from random import Random
+from os import path
+import csv
+import json
+import sys
+from pyasn import pyasn
+if sys.version_info >= (3, 4):
+    from io import StringIO
+    from pyasn.annotate import annotate_file, _read_chunks
+
+IPASN_DB_PATH = path.join(path.dirname(__file__), "../data/ipasn_20140513.dat.gz")
+AS_NAMES_FILE_PATH = path.join(path.dirname(__file__), "../data/asnames.json")
+
+
+@skipIf(sys.version_info < (3, 4), "pyasn.annotate requires Python 3")
+class TestAnnotate(TestCase):
+    asndb = pyasn(IPASN_DB_PATH, as_names_file=AS_NAMES_FILE_PATH)
+
+    def setUp(self):
+        rnd = Random(5)
+        self.ips = ['%d.%d.%d.%d' % (rnd.randint(1, 223), rnd.randint(0, 255),
+                                     rnd.randint(0, 255), rnd.randint(0, 255))
+                    for _ in range(500)]
+        self.ips[7], self.ips[100] = 'not-an-ip', ''
+
+    def annotate(self, text, fmt, column, **kwargs):
+        out = StringIO()
+        rows, _ = annotate_file(self.asndb, StringIO(text), out, fmt, column, **kwargs)
+        return rows, out.getvalue()
+
+    def test_csv(self):
+        lines = ['id,note,ip\n']
+        for i, ip in enumerate(self.ips):
+            note = '"two\nlines, quoted"' if i % 50 == 3 else 'n%d' % i  # records across lines
+            note = '5" disk' if i % 50 == 10 else '"a ""5"" disk"' if i % 50 == 20 else note
+            lines.append('%d,%s,%s\n' % (i, note, ip))
+        text = ''.join(lines)
+        chunks = list(_read_chunks(StringIO(text), 'csv', 37))
+        self.assertEqual([n for _, n in chunks], [37] * 13 + [501 - 13 * 37])  # with the header
+        rows, serial = self.annotate(text, 'csv', 'ip', processes=0, chunk_rows=37)
+        self.assertEqual(rows, len(self.ips))  # records, not lines
+        rows, parallel = self.annotate(text, 'csv', 'ip', names=True, processes=2, chunk_rows=37)
+        self.assertEqual(rows, len(self.ips))
+
+        for out, names in ((serial, False), (parallel, True)):
+            records = list(csv.reader(StringIO(out)))
+            self.assertEqual(records[0], ['id', 'note', 'ip', 'asn', 'prefix'] +
+                             (['as_name'] if names else []))
+            self.assertEqual(len(records), len(self.ips) + 1)
+            for i, record in enumerate(records[1:]):
+                self.assertEqual(record[0], str(i))  # in order
+                asn, prefix = (None, None) if i in (7, 100) else self.asndb.lookup(self.ips[i])
+                self.assertEqual(record[3:5], ['' if asn is None else str(asn), prefix or ''])
+                if names:
+                    self.assertEqual(record[5], self.asndb.get_as_name(asn) or '')
+
+    def test_tsv_and_jsonl(self):
+        text = ''.join('%s\t%d\n' % (ip, i) for i, ip in enumerate(self.ips))
+        rows, out = self.annotate(text, 'tsv', 0, header=False, processes=2, chunk_rows=64)
+        self.assertEqual(rows, len(self.ips))
+        for i, line in enumerate(out.splitlines()):
+            fields = line.split('\t')
+            asn, prefix = (None, None) if i in (7, 100) else self.asndb.lookup(self.ips[i])
+            self.assertEqual(fields[1:], [str(i), '' if asn is None else str(asn), prefix or ''])
+
+        text = ''.join(json.dumps({'n': i, 'src': ip}) + '\n' for i, ip in enumerate(self.ips))
+        rows, out = self.annotate(text, 'jsonl', 'src', names=True, processes=2, chunk_rows=64)
+        for i, line in enumerate(out.splitlines()):
+            record = json.loads(line)
+            asn, prefix = (None, None) if i in (7, 100) else self.asndb.lookup(self.ips[i])
+            self.assertEqual(record, {'n': i, 'src': self.ips[i], 'asn': asn, 'prefix': prefix,
+                                      'as_name': self.asndb.get_as_name(asn)})
+
+    def test_line_separators(self):
+        """
+            Tests that only '\\n' ends lines: other separators are data of csv fields and JSON
+        """
+        rows, out = self.annotate('8.8.8.8,x\x1cy\n1.1.1.1,z\n', 'csv', 0, header=False,
+                                  processes=0)
+        self.assertEqual(rows, 2)
+        self.assertEqual([record[:2] for record in csv.reader(StringIO(out, newline=''))],
+                         [['8.8.8.8', 'x\x1cy'], ['1.1.1.1', 'z']])
+
+        text = json.dumps({'src': '8.8.8.8', 'note': 'a\u2028b\x85c'}, ensure_ascii=False)
+        rows, out = self.annotate(text + '\n', 'jsonl', 'src', processes=0)
+        self.assertEqual(rows, 1)
+        record = json.loads(out)
+        self.assertEqual(record['note'], 'a\u2028b\x85c')
+        self.assertEqual(record['asn'], self.asndb.lookup('8.8.8.8')[0])
@@ -0,0 +1,462 @@
+# Copyright (c) 2014-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, division
+from unittest import TestCase
+from pyasn.download import *
+from pyasn.mrtx import parse_mrt_file, read_ipasn_binary_file, ConversionCheckpoint, \
+    ConversionStats
+from datetime import date, datetime
+from threading import Thread
+from shutil import rmtree
+from tempfile import mkdtemp
+from os import path, makedirs, listdir
+from bz2 import BZ2File, compress as compress_bz2
+from struct import unpack
+import socket
+import json
+import re
+import sys
+if sys.version_info[0] < 3:
+    from SocketServer import ThreadingTCPServer, StreamRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+else:
+    from socketserver import ThreadingTCPServer, StreamRequestHandler
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+RIB_TD2_PARTDUMP = path.join(path.dirname(__file__), "../data/rib.20140523.0600_firstMB.bz2")
+
+
+class StandInHTTPServer(ThreadingTCPServer, HTTPServer):
+    # local stand-in for the archive's web server: serves `root`, with keep-alive connections,
+    # and Range requests (unless ranges=False). break_after=N drops the next file transfer after
+    # N bytes, as a broken connection
+    daemon_threads, allow_reuse_address = True, True
+
+    def __init__(self, root, ranges=True):
+        class Handler(SimpleHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(handler):
+                self.connections += 1
+                SimpleHTTPRequestHandler.setup(handler)
+
+            def do_GET(handler):
+                self.requests += 1
+                local_file = handler.translate_path(handler.path)
+                if not ranges or not path.isfile(local_file):
+                    return SimpleHTTPRequestHandler.do_GET(handler)
+                with open(local_file, 'rb') as f:
+                    data = f.read()
+                start = re.match(r'bytes=(\d+)-$', handler.headers.get('Range', ''))
+                start = int(start.group(1)) if start else None
+                if start is not None and start >= len(data):
+                    handler.send_response(416)
+                    handler.send_header('Content-Range', 'bytes */%d' % len(data))
+                    handler.send_header('Content-Length', '0')
+                    handler.end_headers()
+                    return
+                if start is not None:
+                    handler.send_response(206)
+                    handler.send_header('Content-Range', 'bytes %d-%d/%d'
+                                        % (start, len(data) - 1, len(data)))
+                else:
+                    handler.send_response(200)
+                data = data[start or 0:]
+                handler.send_header('Content-Length', str(len(data)))
+                handler.end_headers()
+                if self.break_after is not None:
+                    data, self.break_after = data[:self.break_after], None
+                    handler.close_connection = True
+                handler.wfile.write(data)
+
+            def translate_path(handler, url_path):
+                return path.join(root, *url_path.split('?')[0].strip('/').split('/'))
+
+            def log_message(handler, *args):
+                pass
+        self.connections = self.requests = 0
+        self.break_after = None
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/' % self.server_address[1]
+        Thread(target=self.serve_forever).start()
+
+
+class StandInFTPServer(ThreadingTCPServer):
+    # local stand-in for the archive's (anonymous, passive mode) FTP server, serving `root`
+    daemon_threads, allow_reuse_address = True, True
+
+    def __init__(self, root):
+        self.root, self.connections, self.requests, self.break_after = root, 0, 0, None
+        ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), _FTPHandler)
+        self.url = 'ftp://127.0.0.1:%d/' % self.server_address[1]
+        Thread(target=self.serve_forever).start()
+
+
+class _FTPHandler(StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('ascii'))
+
+    def local_path(self, arg):
+        return path.join(self.server.root, *arg.strip('/').split('/'))
+
+    def send_data(self, data):
+        conn, _ = self.pasv.accept()
+        self.reply('150 Opening data connection')
+        broken = self.server.break_after is not None
+        if broken:
+            data, self.server.break_after = data[:self.server.break_after], None
+        conn.sendall(data)
+        conn.close()
+        self.pasv.close()
+        self.reply('426 Transfer aborted' if broken else '226 Transfer complete')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 stand-in FTP server')
+        self.rest = 0
+        for line in self.rfile:
+            cmd, _, arg = line.decode('ascii').strip().partition(' ')
+            cmd = cmd.upper()
+            if cmd == 'USER':
+                self.reply('331 Password required')
+            elif cmd == 'PASS':
+                self.reply('230 Logged in')
+            elif cmd in ('TYPE', 'CWD'):
+                self.reply('200 OK')
+            elif cmd == 'PASV':
+                self.pasv = socket.socket()
+                self.pasv.bind(('127.0.0.1', 0))
+                self.pasv.listen(1)
+                port = self.pasv.getsockname()[1]
+                self.reply('227 Entering Passive Mode (127,0,0,1,%d,%d)' % (port >> 8, port & 255))
+            elif cmd == 'NLST':
+                names = sorted(listdir(self.local_path(arg)))
+                self.send_data(''.join(name + '\r\n' for name in names).encode('ascii'))
+            elif cmd == 'SIZE' and not path.isfile(self.local_path(arg)):
+                self.reply('550 No such file')
+            elif cmd == 'SIZE':
+                self.reply('213 %d' % path.getsize(self.local_path(arg)))
+            elif cmd == 'REST':
+                self.rest = int(arg)
+                self.reply('350 Restarting')
+            elif cmd == 'RETR':
+                self.server.requests += 1
+                if not path.exists(self.local_path(arg)):
+                    self.pasv.close()
+                    self.reply('550 No such file')
+                    continue
+                with open(self.local_path(arg), 'rb') as f:
+                    f.seek(self.rest)
+                    self.rest = 0
+                    self.send_data(f.read())
+            elif cmd == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('502 Not implemented')
+
+
+def first_records(archive_path, count):
+    # the first 'count' MRT records of a (truncated) archive, uncompressed
+    f = BZ2File(archive_path, 'rb')
+    records = []
+    for i in range(count):
+        header = f.read(12)
+        records.append(header + f.read(unpack('>IHHI', header)[3]))
+    f.close()
+    return b''.join(records)
+
+
+def make_archive_tree(root):
+    # a RouteViews-like tree: a month of IPv4 RIBs, with several archives on one date
+    with open(RIB_TD2_PARTDUMP, 'rb') as f:
+        data = f.read()
+    month = path.join(root, 'bgpdata', '2014.05', 'RIBS')
+    makedirs(month)
+    files = {}
+    for name, content in (('rib.20140523.0000.bz2', b'midnight'),
+                          ('rib.20140523.0600.bz2', data),
+                          ('rib.20140523.1200.bz2', b'noon'),
+                          ('rib.20140524.0000.bz2', data[:1000]),
+                          ('rib.20140525.0559.bz2', data[:2000])):
+        with open(path.join(month, name), 'wb') as f:
+            f.write(content)
+        files[name] = content
+    return files
+
+
+class TestDownload(TestCase):
+
+    def setUp(self):
+        self.root, self.out_dir = mkdtemp(), mkdtemp()
+        self.files = make_archive_tree(self.root)
+
+    def tearDown(self):
+        rmtree(self.root)
+        rmtree(self.out_dir)
+
+    def test_pick_rib_for_date(self):
+        """
+            Tests choosing the archive of a date, by its time of day
+        """
+        names = sorted(self.files)
+        self.assertEqual(pick_rib_for_date(names, date(2014, 5, 23)), 'rib.20140523.0600.bz2')
+        self.assertEqual(pick_rib_for_date(names, date(2014, 5, 24)), 'rib.20140524.0000.bz2')
+        self.assertEqual(pick_rib_for_date(names, date(2014, 5, 25)), 'rib.20140525.0559.bz2')
+        self.assertEqual(pick_rib_for_date(names, date(2014, 5, 26)), None)
+        self.assertEqual(routeviews_dir_url(date(2014, 5, 1), '6'),
+                         'http://archive.routeviews.org/route-views6/bgpdata/2014.05/RIBS/')
+
+    def check_download_ribs(self, server, workers):
+        dates = [date(2014, 5, day) for day in (23, 24, 25, 26)]
+        results = sorted(download_ribs(dates, '4', workers, server.url, self.out_dir))
+        self.assertEqual([(dt, error) for dt, _, _, _, error in results],
+                         [(dates[0], None), (dates[1], None), (dates[2], None),
+                          (dates[3], 'not found')])
+        for dt, url, local_file, size, _ in results[:3]:
+            name = path.basename(local_file)
+            self.assertEqual(url, routeviews_dir_url(dt, '4', server.url) + name)
+            with open(local_file, 'rb') as f:
+                self.assertEqual(f.read(), self.files[name])
+            self.assertEqual(size, len(self.files[name]))
+        self.assertEqual(len(listdir(self.out_dir)), 3)  # and no .part files left behind
+        # each worker reuses its connection
+        self.assertTrue(server.connections <= workers)
+
+    def test_download_ribs_http(self):
+        """
+            Tests downloading the archives of several dates over HTTP, from a local stand-in
+        """
+        server = StandInHTTPServer(self.root)
+        try:
+            self.check_download_ribs(server, 2)
+            downloader = Downloader()
+            self.assertRaises(DownloadError, downloader.fetch, server.url + 'missing.bz2')
+            self.assertEqual(downloader.fetch(server.url + 'bgpdata/2014.05/RIBS/'
+                                              'rib.20140523.1200.bz2'), b'noon')
+            downloader.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_download_ribs_ftp(self):
+        """
+            Tests downloading the archives of several dates over FTP, from a local stand-in
+        """
+        server = StandInFTPServer(self.root)
+        try:
+            self.check_download_ribs(server, 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def check_resume(self, server):
+        url = server.url + 'bgpdata/2014.05/RIBS/rib.20140523.0600.bz2'
+        content = self.files['rib.20140523.0600.bz2']
+        local_file = path.join(self.out_dir, 'rib.bz2')
+        downloader = Downloader()
+        # the .part file of an interrupted run is continued
+        with open(local_file + '.part', 'wb') as f:
+            f.write(content[:1000])
+        self.assertEqual(downloader.download(url, local_file), len(content) - 1000)
+        with open(local_file, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        # as is a transfer that breaks off
+        server.break_after = 5000
+        self.assertEqual(downloader.download(url, local_file), len(content))
+        with open(local_file, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        # a complete .part file is only checked
+        with open(local_file + '.part', 'wb') as f:
+            f.write(content)
+        self.assertEqual(downloader.download(url, local_file), 0)
+        # checksums
+        self.assertRaises(DownloadError, downloader.download, url, local_file, sha256='00' * 32)
+        self.assertFalse(path.exists(local_file + '.part'))
+        downloader.download(url, local_file, sha256=file_sha256(RIB_TD2_PARTDUMP))
+        downloader.close()
+
+    def test_resume_http(self):
+        """
+            Tests resuming interrupted downloads with HTTP ranges
+        """
+        server = StandInHTTPServer(self.root)
+        try:
+            self.check_resume(server)
+        finally:
+            server.shutdown()
+            server.server_close()
+        # without range support, a download starts over
+        server = StandInHTTPServer(self.root, ranges=False)
+        try:
+            local_file = path.join(self.out_dir, 'rib.bz2')
+            with open(local_file + '.part', 'wb') as f:
+                f.write(b'x' * 1000)
+            downloader = Downloader()
+            downloader.download(server.url + 'bgpdata/2014.05/RIBS/rib.20140524.0000.bz2',
+                                local_file)
+            with open(local_file, 'rb') as f:
+                self.assertEqual(f.read(), self.files['rib.20140524.0000.bz2'])
+            downloader.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_resume_ftp(self):
+        """
+            Tests resuming interrupted downloads with FTP REST
+        """
+        server = StandInFTPServer(self.root)
+        try:
+            self.check_resume(server)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_archive_cache(self):
+        """
+            Tests that archives in the cache are verified, and not downloaded again
+        """
+        server = StandInHTTPServer(self.root)
+        cache_dir = path.join(self.out_dir, 'cache')
+        try:
+            dates = [date(2014, 5, 23), date(2014, 5, 24)]
+            results = list(download_ribs(dates, base_url=server.url, cache_dir=cache_dir))
+            self.assertEqual([error for _, _, _, _, error in results], [None, None])
+            requests = server.requests
+            results2 = list(download_ribs(dates, base_url=server.url, cache_dir=cache_dir))
+            self.assertEqual(sorted(results2), sorted(results))
+            self.assertEqual(server.requests, requests + 1)  # only the month is listed again
+            cache = ArchiveCache(cache_dir)
+            with open(path.join(cache_dir, ArchiveCache.MANIFEST)) as f:
+                self.assertEqual(json.load(f), cache.entries)
+            url = results[0][1]
+            self.assertEqual(cache.lookup(url), results[0][2])
+            self.assertEqual(cache.entries[ArchiveCache._key(url)]['sha256'],
+                             file_sha256(results[0][2]))
+            # a damaged file is downloaded again
+            with open(results[0][2], 'r+b') as f:
+                f.write(b'BAD')
+            self.assertEqual(cache.lookup(url, verify=True), None)
+            downloader = Downloader()
+            cache.fetch(downloader, url, verify=True)
+            self.assertEqual(server.requests, requests + 2)
+            self.assertEqual(cache.lookup(url, verify=True), results[0][2])
+            downloader.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_archive_index(self):
+        """
+            Tests finding archives through the index, without listing unchanged months again
+        """
+        today = datetime.utcnow().date()
+        current = path.join(self.root, 'bgpdata', '%d.%02d' % (today.year, today.month), 'RIBS')
+        makedirs(current)
+        latest = 'rib.%d%02d%02d.0000.bz2' % (today.year, today.month, today.day)
+        open(path.join(current, latest), 'wb').close()
+        makedirs(path.join(self.root, 'bgpdata', '2099.01', 'RIBS'))  # no archives yet
+        server = StandInHTTPServer(self.root)
+        index_file = path.join(self.out_dir, 'index.json')
+        try:
+            index = ArchiveIndex(server.url, index_file)
+            self.assertEqual(index.latest(), routeviews_dir_url(today, '4', server.url) + latest)
+            self.assertEqual(index.for_date(date(2014, 5, 23)),
+                             server.url + 'bgpdata/2014.05/RIBS/rib.20140523.0600.bz2')
+            self.assertEqual(index.for_date(date(2014, 5, 25), hour=6),
+                             server.url + 'bgpdata/2014.05/RIBS/rib.20140525.0559.bz2')
+            self.assertEqual(index.for_date(date(2014, 5, 26)), None)
+            self.assertEqual((index.listed, server.requests), (4, 4))  # root and three months
+            index.latest()
+            index.close()
+            # another host, sharing the index file: all listings are fresh
+            index2 = ArchiveIndex(server.url, index_file)
+            self.assertEqual(index2.latest(), index.latest())
+            self.assertEqual(index2.for_date(date(2014, 5, 24)),
+                             server.url + 'bgpdata/2014.05/RIBS/rib.20140524.0000.bz2')
+            self.assertEqual((index2.listed, server.requests), (0, 4))
+            # once they expire, only the root and the months not over yet are listed again
+            index3 = ArchiveIndex(server.url, index_file, ttl=0)
+            index3.latest()
+            index3.for_date(date(2014, 5, 23))
+            self.assertEqual((index3.listed, server.requests), (3, 7))
+            with open(index_file) as f:
+                self.assertEqual(sorted(json.load(f)), sorted(index3.listings))
+            # download_ribs() finds archives through an index too
+            results = list(download_ribs([date(2014, 5, 23)], index=index2,
+                                         out_dir=self.out_dir))
+            self.assertEqual(results[0][1:4:2], (index.for_date(date(2014, 5, 23)),
+                                                 len(self.files['rib.20140523.0600.bz2'])))
+            self.assertEqual(server.requests, 8)
+            index2.close()
+            index3.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_download_and_convert(self):
+        """
+            Tests converting archives while they download, and keeping them
+        """
+        records = first_records(RIB_TD2_PARTDUMP, 2000)
+        month = path.join(self.root, 'bgpdata', '2014.05', 'RIBS')
+        for name, data in (('rib.20140526.0600.bz2', compress_bz2(records)),
+                           ('rib.20140526.0600', records)):
+            with open(path.join(month, name), 'wb') as f:
+                f.write(data)
+        expected = parse_mrt_file(path.join(month, 'rib.20140526.0600'), compact=True)
+        ipasn_file = path.join(self.out_dir, 'ipasn.dat')
+        server = StandInHTTPServer(self.root)
+        try:
+            for name in ('rib.20140526.0600.bz2', 'rib.20140526.0600'):
+                url = server.url + 'bgpdata/2014.05/RIBS/' + name
+                archive_file = path.join(self.out_dir, name)
+                server.break_after = 100000  # the download resumes, under the parser
+                checkpoint = ConversionCheckpoint(ipasn_file + '.ckpt', interval=500)
+                stats = ConversionStats()
+                prefixes = download_and_convert(url, ipasn_file, archive_file, binary=True,
+                                                checkpoint=checkpoint, stats=stats)
+                self.assertEqual(list(prefixes.items()), list(expected.items()))
+                # checkpoints of the stream hold the offset of their record in the archive
+                self.assertEqual((checkpoint.saved, stats.records), (3, 2000))
+                self.assertTrue(0 < checkpoint.load()[1]['offset'] < len(records))
+                checkpoint.remove()
+
+                self.assertEqual(list(read_ipasn_binary_file(ipasn_file).keys()),
+                                 list(expected.keys()))
+                with open(archive_file, 'rb') as f1:
+                    with open(path.join(month, name), 'rb') as f2:
+                        self.assertEqual(f1.read(), f2.read())
+            # a failed download stops the conversion
+            self.assertRaises(DownloadError, download_and_convert, server.url + 'missing.bz2',
+                              ipasn_file, path.join(self.out_dir, 'missing.bz2'))
+            # with a cache, the archive is kept there, and converted without downloading again
+            cache = ArchiveCache(path.join(self.out_dir, 'cache'))
+            download_and_convert(url, ipasn_file, cache=cache)
+            requests = server.requests
+            self.assertEqual(len(download_and_convert(url, ipasn_file, cache=cache)),
+                             len(expected))
+            self.assertEqual(server.requests, requests)
+        finally:
+            server.shutdown()
+            server.server_close()
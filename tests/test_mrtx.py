@@ -22,8 +22,19 @@ from __future__ import print_function, division
 from unittest import TestCase
 from pyasn.mrtx import *
 from bz2 import BZ2File
+from io import BytesIO, StringIO
+import json
+import pickle
+from struct import unpack, pack
 import gzip
-from os import path
+from os import path, remove, listdir, environ
+from ipaddress import ip_network
+from sys import stderr, executable
+import sys
+from subprocess import check_output
+from runpy import run_path
+from shutil import rmtree
+from tempfile import mkdtemp
 import logging
 
 RIB_TD1_PARTDUMP = path.join(path.dirname(__file__), "../data/rib.20080501.0644_firstMB.bz2")
@@ -39,6 +50,48 @@ RIB6_TD2_FULLDUMP = path.join(path.dirname(__file__), "../data/rib6.20151101.060
 IPASN_TD1_DB = path.join(path.dirname(__file__), "../data/ipasn_20080501_v12.dat.gz")
 IPASN_TD2_DB = path.join(path.dirname(__file__), "../data/ipasn_20140513_v12.dat.gz")
 TEMP_IPASNDAT = path.join(path.dirname(__file__), "ipasn_test.tmp")
+TEMP_RIB_ARCHIVES = [path.join(path.dirname(__file__), "rib_test_%d.tmp.gz" % i) for i in (1, 2)]
+CONVERT_UTIL = path.join(path.dirname(__file__), "../pyasn-utils/pyasn_util_convert.py")
+
+
+def first_records(archive_path, count):
+    """Returns the first 'count' MRT records of an archive as a file-like object.
+    (The *_firstMB test archives are truncated, so can't be parsed to the end.)"""
+    f = BZ2File(archive_path, 'rb')
+    records = []
+    for i in range(count):
+        header = f.read(12)
+        records.append(header + f.read(unpack('>IHHI', header)[3]))
+    f.close()
+    return BytesIO(b''.join(records))
+
+
+def bgp4mp_update(peer_as, peer_ip, announced=(), withdrawn=(), path=None, announced6=(),
+                  extended_ts=False):
+    """Returns a BGP4MP(_ET) MESSAGE_AS4 record holding a BGP UPDATE, built from prefix tuples
+    (packed network, masklen) and an AS_PATH sequence (empty AS_PATH if [], none if None)"""
+    def nlri(prefixes):
+        return b''.join(pack('B', masklen) + net[:(masklen + 7) // 8] for net, masklen in prefixes)
+    attrs = b'\x40\x01\x01\x00'  # ORIGIN: IGP
+    if path is not None:
+        seg = pack('>BB%dI' % len(path), 2, len(path), *path) if path else b''
+        attrs += pack('>BBB', 0x40, 2, len(seg)) + seg
+    if announced6:
+        mp = pack('>HBB', 2, 1, 16) + b'\x20\x01' + b'\0' * 14 + b'\0' + nlri(announced6)
+        attrs += pack('>BBB', 0x80, 14, len(mp)) + mp
+    w, a = nlri(withdrawn), nlri(announced)
+    msg = b'\xff' * 16 + pack('>HB', 23 + len(w) + len(attrs) + len(a), 2) + \
+        pack('>H', len(w)) + w + pack('>H', len(attrs)) + attrs + a
+    body = pack('>IIHH', peer_as, 6447, 0, 1) + peer_ip + b'\x0a\0\0\x01' + msg
+    if extended_ts:
+        body = pack('>I', 500) + body
+    return pack('>IHHI', 1500000000, 17 if extended_ts else 16, 4, len(body)) + body
+
+
+def write_gzip_archive(file_obj, archive_path):
+    f = gzip.open(archive_path, 'wb')
+    f.write(file_obj.read())
+    f.close()
 
 
 class TestMrtx(TestCase):
@@ -489,3 +542,683 @@ class TestMrtx(TestCase):
             Tests pyasn.mrtx.parse_mrt_file() with routeviews WIDE archive TD1 (bug #42)
         """
         self.dotest_converter_full(RIB_TD1_WIDE_FULLDUMP)
+
+    def test_compact_prefix_table(self):
+        """
+            Tests pyasn.mrtx.parse_mrt_file(compact=True) gives the same results as the dict output
+        """
+        for archive, count in ((RIB_TD1_PARTDUMP, 20000),
+                               (RIB_TD2_PARTDUMP, 9000),
+                               (RIB6_TD2_PARTDUMP, 6800)):
+            expected = parse_mrt_file(first_records(archive, count))
+            compact = parse_mrt_file(first_records(archive, count), compact=True)
+            self.assertTrue(isinstance(compact, CompactPrefixTable))
+            self.assertEqual(len(compact), len(expected))
+            self.assertEqual(count_prefixes(compact), count_prefixes(expected))
+            self.assertEqual(list(compact.items()), list(expected.items()))
+            for prefix, origin in expected.items():
+                self.assertTrue(prefix in compact)
+                self.assertEqual(compact[prefix], origin)
+        self.assertTrue('0.0.0.0/0' not in compact and '::/0' not in compact)
+        self.assertEqual(compact.get('10.0.0.0/8'), None)
+        self.assertRaises(KeyError, compact.__getitem__, 'not-a-prefix')
+
+        table = CompactPrefixTable()
+        self.assertTrue(table.add(4, b'\x01\x26', 17, set([38266])))
+        self.assertFalse(table.add(4, b'\x01\x26\x00\x00', 17, 1))  # repeated prefix
+        self.assertTrue(table.add(6, b'\x20\x01', 32, 1101))
+        self.assertEqual(list(table.items()), [('1.38.0.0/17', set([38266])), ('2001::/32', 1101)])
+        self.assertEqual(table.family_counts(), (1, 1))
+        self.assertTrue(table.add(4, b'\x01\x02\x03', 24, 0))  # AS0, not an AS_SET
+        self.assertEqual((table['1.2.3.0/24'], table.get('1.2.3.0/24')), (0, 0))
+        table['1.2.3.0/24'] = set([0, 1])
+        table['1.2.3.0/24'] = 0
+        self.assertEqual(list(table.items())[1], ('1.2.3.0/24', 0))
+        del table['1.2.3.0/24']
+
+
+        # removed & re-added prefixes, across rehashes of the packed hash of rows
+        grown = CompactPrefixTable()
+        for i in range(3000):
+            grown.add(4, pack('>H', i), 16, i + 1)
+        for i in range(0, 3000, 3):
+            del grown['%d.%d.0.0/16' % (i >> 8, i & 255)]
+        for i in range(0, 3000, 6):
+            self.assertTrue(grown.add(4, pack('>H', i), 16, 7))
+        self.assertEqual(len(grown), 2500)
+        self.assertEqual(grown['0.0.0.0/16'], 7)
+        self.assertEqual(grown['0.1.0.0/16'], 2)
+        self.assertTrue('0.3.0.0/16' not in grown)
+        self.assertEqual(dict(pickle.loads(pickle.dumps(grown)).items()), dict(grown.items()))
+
+        # withdraw/re-announce churn: removed rows are dropped, so rehashes stay occasional
+        churned, rehashes = CompactPrefixTable(), []
+        rehash = churned._rehash
+        churned._rehash = lambda family: (rehashes.append(family), rehash(family))
+        for i in range(10000):
+            churned.add(4, pack('>H', i), 16, set([i, i + 1]) if i % 100 == 0 else i)
+        del rehashes[:]
+        for _ in range(10):  # 50000 updates
+            for i in range(0, 10000, 2):
+                del churned['%d.%d.0.0/16' % (i >> 8, i & 255)]
+                churned['%d.%d.0.0/16' % (i >> 8, i & 255)] = set([i, i + 1]) \
+                    if i % 100 == 0 else i
+        self.assertTrue(len(rehashes) <= 5)  # not one per update
+        self.assertEqual(len(churned), 10000)
+        self.assertTrue(len(churned._masks[4]) < 40000 and len(churned._deleted) < 30000)
+        self.assertEqual(dict(churned.items()),
+                         dict(('%d.%d.0.0/16' % (i >> 8, i & 255),
+                               set([i, i + 1]) if i % 100 == 0 else i) for i in range(10000)))
+
+
+        dump_prefixes_to_file(table, TEMP_IPASNDAT, "test")
+        with open(TEMP_IPASNDAT) as f:
+            lines = f.read().splitlines()
+        remove(TEMP_IPASNDAT)
+        self.assertTrue('; Prefixes-v4   : 1' in lines and '; Prefixes-v6   : 1' in lines)
+        self.assertEqual(lines[-2:], ['1.38.0.0/17\t38266', '2001::/32\t1101'])
+
+    def test_merge_multiple_archives(self):
+        """
+            Tests pyasn.mrtx.parse_mrt_files_merged() with its different origin-voting policies
+        """
+        write_gzip_archive(first_records(RIB_TD2_PARTDUMP, 1000), TEMP_RIB_ARCHIVES[0])
+        write_gzip_archive(first_records(RIB_TD2_PARTDUMP, 500), TEMP_RIB_ARCHIVES[1])
+        try:
+            single = parse_mrt_file(TEMP_RIB_ARCHIVES[0])
+            counts = parse_mrt_file_origin_counts(TEMP_RIB_ARCHIVES[0])
+            self.assertEqual(list(counts), list(single))
+            self.assertEqual(counts['1.0.0.0/24'], {15169: 32})
+
+            for policy in MERGE_POLICIES:
+                merged, stats = parse_mrt_files_merged(TEMP_RIB_ARCHIVES, policy, processes=2)
+                self.assertEqual(list(merged), list(single))
+                self.assertEqual(merged['1.0.0.0/24'], 15169)
+                self.assertEqual(merged['1.38.0.0/17'], set([38266]))
+                if policy == 'peer-count':
+                    self.assertEqual(stats['1.0.0.0/24'], (64, 64, 2))
+                else:
+                    self.assertEqual(stats['1.0.0.0/24'], (2, 2, 2))
+                last = list(single)[-1]  # only in the first archive
+                self.assertEqual(stats[last][2], 1)
+
+            self.assertRaises(ValueError, parse_mrt_files_merged, TEMP_RIB_ARCHIVES, 'random')
+        finally:
+            for archive in TEMP_RIB_ARCHIVES:
+                remove(archive)
+
+    def test_fast_origin_counts(self):
+        """
+            Tests pyasn.mrtx.parse_mrt_file_origin_counts() - the fast (raw) decoding of origins of
+            all RIB entries should give the same results as fully parsing them
+        """
+        for archive, count in ((RIB_TD1_PARTDUMP, 5000),
+                               (RIB_TD2_PARTDUMP, 2000),
+                               (RIB6_TD2_PARTDUMP, 1000)):
+            fast = parse_mrt_file_origin_counts(first_records(archive, count))
+            slow = parse_mrt_file_origin_counts(first_records(archive, count), optimize_parse=False)
+            self.assertEqual(fast, slow)
+        self.assertEqual(fast["2001:4:112::/48"], {112: 23})
+        # one AS_SEQUENCE: its last ASN, unless bogus (then decoded like longer paths)
+        for path, origin in (([3356, 15169], 15169), ([3356, 64512], 3356), ([0], None)):
+            attrs = b'\x40\x01\x01\x00' + pack('>5B%dI' % len(path), 0x40, 2, 2 + 4 * len(path),
+                                               2, len(path), *path)
+            if origin is None:
+                self.assertRaises(AssertionError, fast_origin_as, attrs, 0, len(attrs), True)
+            else:
+                self.assertEqual(fast_origin_as(attrs, 0, len(attrs), True), origin)
+
+
+        f = first_records(RIB_TD2_PARTDUMP, 3)
+        MrtRecord.next_dump_table_record(f)  # peer-index
+        MrtRecord.next_dump_table_record(f)
+        mrt = MrtRecord.next_dump_table_record(f)
+        self.assertEqual(mrt.prefix, "1.0.0.0/24")
+        origins = mrt.get_all_origins()
+        self.assertEqual(len(origins), mrt.detail.entry_count)
+        self.assertEqual(origins[0], mrt.get_first_origin_as())
+
+    def test_bgp_updates(self):
+        """
+            Tests pyasn.mrtx.apply_bgp_updates() - BGP4MP/BGP4MP_ET updates applied to live tables
+        """
+        peer1, peer2 = b'\xc0\x00\x02\x01', b'\xc0\x00\x02\x02'
+        updates = b''.join([
+            bgp4mp_update(3356, peer1, announced=[(b'\x01\x00\x00\x00', 24)], path=[3356, 15169]),
+            bgp4mp_update(3356, peer1, withdrawn=[(b'\x02\x00\x00\x00', 16)]),
+            bgp4mp_update(174, peer2, announced=[(b'\x04\x00\x00\x00', 8)], path=[174, 3356]),
+            bgp4mp_update(3356, peer1, announced6=[(b'\x2a\x00\x14\x50', 32)], path=[3356, 15169],
+                          extended_ts=True),
+        ])
+
+        mrt = MrtRecord.next_dump_table_record(BytesIO(updates))
+        self.assertEqual(mrt.type, MrtRecord.TYPE_BGP4MP)
+        self.assertTrue(mrt.detail.is_update)
+        self.assertEqual((mrt.detail.peer_ip, mrt.detail.peer_as), ("192.0.2.1", 3356))
+        self.assertEqual(mrt.detail.announced, [(4, b'\x01\x00\x00', 24)])
+        self.assertEqual(mrt.detail.get_origin_as(), 15169)
+        self.assertEqual(len(list(iter_bgp_updates(BytesIO(updates)))), 4)
+        self.assertEqual(len(parse_mrt_file(BytesIO(updates))), 0)  # no RIB entries
+
+        from pyasn import pyasn
+        asndb = pyasn(None, ipasn_string="1.0.0.0/24\t1\n2.0.0.0/16\t2\n")
+        self.assertEqual(apply_bgp_updates(BytesIO(updates), asndb), (3, 1))
+        self.assertEqual(asndb.lookup("1.0.0.1"), (15169, "1.0.0.0/24"))
+        self.assertEqual(asndb.lookup("2.0.0.1"), (None, None))
+        self.assertEqual(asndb.lookup("4.1.2.3"), (3356, "4.0.0.0/8"))
+        self.assertEqual(asndb.lookup("2a00:1450::1"), (15169, "2a00:1450::/32"))
+        self.assertEqual(asndb._records, 3)
+
+        # announcements with an empty AS_PATH (iBGP) are skipped; malformed messages too, if asked
+        ibgp = bgp4mp_update(3356, peer1, announced=[(b'\x05\x00\x00\x00', 8)], path=[])
+        self.assertEqual(MrtRecord.next_dump_table_record(BytesIO(ibgp)).detail.get_origin_as(),
+                         None)
+        broken = bgp4mp_update(3356, peer1, announced=[(b'\x06\x00\x00\x00', 24)], path=[1])
+        broken = broken.replace(b'\x40\x02\x06\x02', b'\x40\x02\x06\x09')  # bad segment type
+        self.assertEqual(apply_bgp_updates(BytesIO(ibgp + updates), asndb), (3, 1))
+        self.assertEqual(asndb.lookup("5.1.2.3"), (None, None))
+        self.assertRaises(Exception, apply_bgp_updates, BytesIO(broken + updates), asndb)
+        self.assertEqual(apply_bgp_updates(BytesIO(broken + updates), asndb,
+                                           skip_record_on_error=True), (3, 1))
+        self.assertTrue(asndb.set_prefix("6.0.0.0", 8, 64))
+        self.assertFalse(asndb.set_prefix("6.0.0.0", 8, 65))
+        self.assertEqual(asndb.lookup("6.0.0.1"), (65, "6.0.0.0/8"))
+        self.assertTrue(asndb.remove_prefix("6.0.0.0", 8))
+        self.assertFalse(asndb.remove_prefix("6.0.0.0", 8))
+        self.assertEqual(asndb._records, 3)
+
+        table = CompactPrefixTable()
+        table.add(4, b'\x02\x00', 16, 2)
+        apply_bgp_updates(BytesIO(updates), table, peers=["192.0.2.1"])
+        self.assertEqual(dict(table.items()), {"1.0.0.0/24": 15169, "2a00:1450::/32": 15169})
+
+        prefixes = {"2.0.0.0/16": 2}
+        apply_bgp_updates(BytesIO(updates), prefixes, peers=[174])
+        self.assertEqual(prefixes, {"2.0.0.0/16": 2, "4.0.0.0/8": 3356})
+
+        table = CompactPrefixTable()
+        for i in range(256):
+            table["10.%d.0.0/16" % i] = i + 1
+        self.assertEqual(table["10.5.0.0/16"], 6)  # builds the index
+        del table["10.5.0.0/16"]
+        table["10.5.0.0/16"] = set([7, 8])
+        table["10.6.0.0/16"] = 9
+        self.assertEqual(table["10.5.0.0/16"], set([7, 8]))
+        self.assertEqual(table["10.6.0.0/16"], 9)
+        self.assertEqual(len(table), 256)
+        self.assertEqual(table.family_counts(), (256, 0))
+        self.assertRaises(KeyError, table.__delitem__, "10.0.0.0/8")
+
+        # rounds of withdrawals & re-announcements (e.g. every 15 minutes) keep a compact table
+        # the size of its prefixes, and don't rehash it on every update
+        nets = [(pack('>H', i), 16) for i in range(4096)]
+        table, prefixes, rehashes = CompactPrefixTable(), {}, []
+        rehash = table._rehash
+        table._rehash = lambda family: (rehashes.append(family), rehash(family))
+        for target in (table, prefixes):
+            apply_bgp_updates(BytesIO(bgp4mp_update(3356, peer1, announced=nets, path=[1])),
+                              target)
+        del rehashes[:]
+        for i in range(30):
+            churn = bgp4mp_update(3356, peer1, withdrawn=nets[i::2], announced=nets[i::3],
+                                  path=[3356, i]) + \
+                bgp4mp_update(3356, peer1, announced=nets[i::2], path=[174, i + 1])
+            for target in (table, prefixes):
+                apply_bgp_updates(BytesIO(churn), target)
+        self.assertEqual(list(table.items()), list(prefixes.items()))
+        self.assertTrue(len(rehashes) <= 10)
+        self.assertTrue(len(table._masks[4]) < 4 * 4096)
+
+
+    def test_bulk_conversion(self):
+        """
+            Tests pyasn_util_convert.py --bulk: archives of a date range converted by a pool
+        """
+        tmp = mkdtemp()
+        try:
+            for day, count in ((23, 300), (24, 200)):
+                write_gzip_archive(first_records(RIB_TD2_PARTDUMP, count),
+                                   path.join(tmp, "rib.201405%d.0600.gz" % day))
+            truncated = first_records(RIB_TD2_PARTDUMP, 100).read()[:-10]
+            write_gzip_archive(BytesIO(truncated), path.join(tmp, "rib.20140525.0600.gz"))
+            root = path.join(path.dirname(path.abspath(__file__)), "..")
+            out = check_output([executable, path.abspath(CONVERT_UTIL), "--bulk", "2014-05-23",
+                                "2014-05-26", "--processes", "2"], cwd=tmp,
+                               env=dict(environ, PYTHONPATH=root)).decode()
+            self.assertTrue("2 converted, 1 failed, 0 skipped" in out, out)
+            for day, count in ((23, 300), (24, 200)):
+                expected = parse_mrt_file(first_records(RIB_TD2_PARTDUMP, count), compact=True)
+                self.assertEqual(check_ipasn_file(path.join(tmp, "ipasn_201405%d.dat" % day)),
+                                 count_prefixes(expected))
+            self.assertEqual(sorted(f for f in listdir(tmp) if f.startswith("ipasn")),
+                             ["ipasn_20140523.dat", "ipasn_20140524.dat"])
+
+            # outputs that fail while written, or are incomplete, are removed
+            argv, sys.argv = sys.argv, ["pyasn_util_convert.py", "--version"]
+            try:
+                util = run_path(CONVERT_UTIL, run_name="pyasn_util_convert")
+            finally:
+                sys.argv = argv
+            mrtx, dump = util['mrtx'], util['mrtx'].dump_prefixes_to_file
+
+            def failing_dump(prefixes, file_name, *args, **kwargs):
+                with open(file_name, 'w') as f:
+                    f.write("; IPASN-DATA-FILE\n; Prefixes-v4   : 5\n")  # truncated
+                if kwargs.get('binary'):
+                    raise IOError("disk full")
+            out_file = path.join(tmp, "ipasn_20140523.dat")
+            remove(out_file)
+            try:
+                mrtx.dump_prefixes_to_file = failing_dump
+                for binary in (False, True):
+                    result = util['convert_bulk_file']((path.join(tmp, "rib.20140523.0600.gz"),
+                                                        out_file, False, binary, False))
+                    self.assertEqual(result[2], None)
+                    self.assertFalse(path.exists(out_file) or path.exists(out_file + ".part"))
+            finally:
+                mrtx.dump_prefixes_to_file = dump
+        finally:
+            rmtree(tmp)
+
+    def test_compressed_dump_and_check(self):
+
+        """
+            Tests pyasn.mrtx.dump_prefixes_to_file() gzip output, and check_ipasn_file()
+        """
+        prefixes = parse_mrt_file(first_records(RIB_TD2_PARTDUMP, 100), compact=True)
+        gz_file = TEMP_IPASNDAT + '.gz'
+        dump_prefixes_to_file(prefixes, gz_file, "test")
+        self.assertEqual(check_ipasn_file(gz_file), (98, 0))
+        f = gzip.open(gz_file, 'rb')
+        data = f.read()
+        f.close()
+        f = gzip.open(gz_file, 'wb')
+        f.write(data[:-100])  # truncated conversion
+        f.close()
+        self.assertEqual(check_ipasn_file(gz_file), None)
+        remove(gz_file)
+        self.assertEqual(check_ipasn_file(gz_file), None)
+
+    def test_binary_dump(self):
+        """
+            Tests pyasn.mrtx.dump_prefixes_to_file() binary output, and read_ipasn_binary_file()
+        """
+        prefixes = parse_mrt_file(first_records(RIB6_TD2_PARTDUMP, 200), compact=True)  # 199 prefixes
+        prefixes["10.0.0.0/8"] = set(range(7, 307))  # AS_SETs are kept in the binary format
+        prefixes["1.2.3.4/32"] = 4200000000
+        for name in (TEMP_IPASNDAT, TEMP_IPASNDAT + '.gz'):
+            dump_prefixes_to_file(prefixes, name, "test", binary=True)
+            self.assertEqual(check_ipasn_file(name), prefixes.family_counts())
+            table = read_ipasn_binary_file(name)
+            self.assertEqual(list(table.items()), list(prefixes.items()))
+        # dict input, text and binary output should agree
+        prefixes = OrderedDict(prefixes.items())
+        dump_prefixes_to_file(prefixes, TEMP_IPASNDAT, "test", binary=True)
+        self.assertEqual(dict(read_ipasn_binary_file(TEMP_IPASNDAT).items()), prefixes)
+        with open(TEMP_IPASNDAT, 'rb') as f:
+            data = f.read()
+        with open(TEMP_IPASNDAT, 'wb') as f:
+            f.write(data[:-20])  # truncated conversion
+        self.assertRaises(ValueError, read_ipasn_binary_file, TEMP_IPASNDAT)
+        self.assertEqual(check_ipasn_file(TEMP_IPASNDAT), None)
+        dump_prefixes_to_file(prefixes, TEMP_IPASNDAT, "test")
+        self.assertEqual(check_ipasn_file(TEMP_IPASNDAT), (2, 199))
+        self.assertRaises(ValueError, read_ipasn_binary_file, TEMP_IPASNDAT)
+        writer = IpasnWriter(TEMP_IPASNDAT, "test", (1, 0))
+        self.assertRaises(ValueError, writer.close)  # no prefixes written
+        with open(TEMP_IPASNDAT, 'wb') as f:  # version 1 files have 8-bit AS counts
+            f.write(BINARY_IPASN_MAGIC + pack('>BIH', 1, 0, 0) + pack('>BBBBI', 4, 8, 10, 1, 5) +
+                    pack('>BBII', 0, 0, 1, 0))
+        self.assertEqual(dict(read_ipasn_binary_file(TEMP_IPASNDAT).items()), {"10.0.0.0/8": 5})
+        remove(TEMP_IPASNDAT)
+        remove(TEMP_IPASNDAT + '.gz')
+        if zstandard is None:
+            print("SKIPPING zstd test - the 'zstandard' module is not installed", file=stderr)
+            return
+        dump_prefixes_to_file(prefixes, TEMP_IPASNDAT + '.zst', "test")
+        self.assertEqual(check_ipasn_file(TEMP_IPASNDAT + '.zst'), (2, 199))
+        remove(TEMP_IPASNDAT + '.zst')
+
+    def test_conversion_stats(self):
+        """
+            Tests pyasn.mrtx.parse_mrt_file() instrumentation with ConversionStats
+        """
+        reports = []
+        stats = ConversionStats(lambda st: reports.append(st.as_dict()), interval=1000)
+        prefixes = parse_mrt_file(first_records(RIB_TD2_PARTDUMP, 2500), stats=stats)
+        self.assertEqual(prefixes, parse_mrt_file(first_records(RIB_TD2_PARTDUMP, 2500)))
+        self.assertEqual(len(reports), 3)
+        self.assertEqual([r['finished'] for r in reports], [False, False, True])
+        final = reports[-1]
+        self.assertEqual(final['records'], 2500)
+        self.assertEqual(final['prefixes'], len(prefixes))
+        self.assertEqual(final['as_sets'], sum(1 for x in prefixes.values() if type(x) is set))
+        self.assertEqual(final['duplicates'], 0)
+        self.assertEqual(final['uncompressed_bytes'], len(first_records(RIB_TD2_PARTDUMP,
+                                                                        2500).read()))
+        self.assertEqual(final['compressed_bytes'], None)  # file object, not a path
+        self.assertEqual(sorted(final['phase_seconds']), ['origins', 'other', 'read', 'records'])
+        self.assertTrue(final['records_per_sec'] > 0)
+        # path: compressed bytes are counted too; repeated TDv1 prefixes are duplicates
+        out = StringIO()
+        stats = ConversionStats(json_lines_callback(out), interval=10**9)
+        with open(TEMP_IPASNDAT, 'wb') as f:
+            f.write(first_records(RIB_TD1_PARTDUMP, 3000).read())
+        prefixes = parse_mrt_file(TEMP_IPASNDAT, stats=stats)
+        remove(TEMP_IPASNDAT)
+        final = json.loads(out.getvalue())  # a single (final) JSON line
+        self.assertEqual(final['archive'], TEMP_IPASNDAT)
+        self.assertEqual(final['compressed_bytes'], final['uncompressed_bytes'])  # uncompressed
+        self.assertEqual(final['records'], 3000)
+        self.assertTrue(final['duplicates'] > 0)
+        self.assertEqual(final['prefixes'], len(prefixes))
+
+    def test_record_index(self):
+        """
+            Tests random access to MRT archives with pyasn.mrtx.MrtIndex and get_record()
+        """
+        archive = TEMP_RIB_ARCHIVES[0].replace('.gz', '.bz2')
+        with open(RIB_TD2_PARTDUMP, 'rb') as fr, open(archive, 'wb') as fw:
+            fw.write(fr.read())  # truncated bz2 archive: only complete blocks get indexed
+        index = build_mrt_index(archive, every=100)
+        self.assertEqual(index.kind, 'bz2')
+        self.assertEqual(index.records, 9073)  # as counted in test_all_records_td2_partial
+        self.assertTrue(len(index.block_starts) > 10)
+        f = open_archive(RIB_TD2_PARTDUMP)
+        records = [repr(MrtRecord.next_dump_table_record(f, optimize_parse=False))
+                   for _ in range(index.records)]
+        f.close()
+        for n in (1, 2, 100, 101, 5555, 9073):
+            self.assertEqual(repr(get_record(archive, n)), records[n - 1])
+        self.assertRaises(IndexError, get_record, archive, 9074)
+        mrt = get_record(archive, "1.0.4.0/24")
+        self.assertEqual(mrt.prefix, "1.0.4.0/24")
+        self.assertEqual(repr(mrt), records[index.find_prefix("1.0.4.0/24") - 1])
+        self.assertEqual(get_record(archive, "10.0.0.0/8"), None)
+        self.assertRaises(ValueError, index.find_prefix, "10.0.0.0")
+        self.assertRaises(ValueError, get_record, archive, "not-a-prefix/8")
+        # dump_screen_mrt_file() seeks with the index; same output as reading from the start
+        out1, out2 = StringIO(), StringIO()
+        dump_screen_mrt_file(archive, record_from=4321, record_to=4323, screen=out1)
+        dump_screen_mrt_file(open_archive(archive), record_from=4321, record_to=4323, screen=out2)
+        self.assertEqual(out1.getvalue(), out2.getvalue())
+        self.assertTrue("Record #004321" in out1.getvalue())
+        # an index of a changed archive isn't used
+        with open(archive, 'ab') as fw:
+            fw.write(b'\0')
+        self.assertEqual(load_mrt_index(archive), None)
+        remove(archive)
+        remove(archive + '.idx')
+        # uncompressed archives are seeked directly
+        with open(TEMP_IPASNDAT, 'wb') as fw:
+            fw.write(first_records(RIB_TD1_PARTDUMP, 1000).read())
+        index = MrtIndex.build(TEMP_IPASNDAT, every=10)
+        self.assertEqual((index.kind, index.records, len(index.checkpoints)), ('raw', 1000, 100))
+        f, n = index.open_at(995)
+        self.assertEqual(n, 991)
+        self.assertEqual(f.tell(), index.checkpoints[99])
+        f.close()
+        remove(TEMP_IPASNDAT)
+
+    def test_prefix_filter(self):
+        """
+            Tests pyasn.mrtx.parse_mrt_file() with a PrefixFilter
+        """
+        prefixes = parse_mrt_file(first_records(RIB_TD2_PARTDUMP, 3000))
+        networks = ["1.0.4.0/22", "1.0.6.0/24", "2.95.0.0/16", "1.10.202.10/32"]
+        kept = parse_mrt_file(first_records(RIB_TD2_PARTDUMP, 3000),
+                              prefix_filter=PrefixFilter(networks))
+        nets = [ip_network(n) for n in networks]
+        expected = [p for p in prefixes if any(ip_network(p).overlaps(n) for n in nets)]
+        self.assertTrue(len(expected) > 10 and len(expected) < len(prefixes) / 10)
+        self.assertTrue("1.10.202.0/24" in expected)  # a less specific of 1.10.202.10/32
+        self.assertEqual(list(kept), expected)
+        for prefix in kept:
+            self.assertEqual(kept[prefix], prefixes[prefix])
+        # raw-byte checks, also for less-specifics and IPv6
+        f = PrefixFilter(["10.1.0.0/16", "2001:db8::/32"])
+        self.assertTrue(f.match(4, b'\x0a\x01\x02', 24))
+        self.assertTrue(f.match(4, b'\x0a', 8))
+        self.assertFalse(f.match(4, b'\x0a\x02', 16))
+        self.assertFalse(f.match(4, b'\x0b', 8))
+        self.assertTrue(f.match(6, b'\x20\x01\x0d\xb8\x01', 40))
+        self.assertTrue(f.match(6, b'\x20', 3))
+        self.assertFalse(f.match(6, b'\x20\x01\x0d\xb9', 32))
+        # address families
+        v6 = parse_mrt_file(first_records(RIB6_TD2_PARTDUMP, 100), compact=True,
+                            prefix_filter=PrefixFilter(family=6))
+        self.assertEqual(v6.family_counts(), (0, 99))
+        v4 = parse_mrt_file(first_records(RIB6_TD2_PARTDUMP, 100), compact=True,
+                            prefix_filter=PrefixFilter(family=4))
+        self.assertEqual(len(v4), 0)
+        self.assertRaises(ValueError, PrefixFilter, ["10.0.0.0/x"])
+
+    def test_as_graph(self):
+        """
+            Tests AS_PATH extraction and pyasn.mrtx.AsGraph
+        """
+        graph = AsGraph()
+        graph.add_path([(2, (701, 701, 3356, 15169))])  # prepending ignored
+        graph.add_path([(2, (1299, 3356, 15169, 15169))])
+        graph.add_path([(2, (174, 64512, 15169))])  # private ASN breaks the path
+        graph.add_path([(2, (6939, 3356)), (1, (15169, 36040))])  # AS_SET: no origin
+        self.assertEqual(graph.paths, 4)
+        self.assertEqual(list(graph.links()), [(701, 3356, 1), (1299, 3356, 1),
+                                               (3356, 15169, 2), (6939, 3356, 1)])
+        self.assertEqual(graph.link_count(3356, 15169), 2)
+        self.assertEqual(graph.link_count(15169, 3356), 0)
+        self.assertEqual(graph.upstreams(15169), {3356: 2})
+        self.assertEqual(graph.upstreams(3356), {})  # path ends in an AS_SET
+        self.assertEqual(graph.origins(), set([15169]))
+        self.assertEqual(graph.neighbours(3356), {701: 1, 1299: 1, 6939: 1, 15169: 2})
+        self.assertEqual(graph.as_count(), 5)
+        # raw path extraction matches the full attribute parse, for all entries
+        f = first_records(RIB_TD2_PARTDUMP, 300)
+        paths = list(iter_as_paths(first_records(RIB_TD2_PARTDUMP, 300)))
+        while True:
+            mrt = MrtRecord.next_dump_table_record(f, optimize_parse=False)
+            if not mrt:
+                break
+            if mrt.sub_type == MrtRecord.T2_PEER_INDEX:
+                continue
+            packed, entry_paths = paths.pop(0)
+            self.assertEqual(packed, mrt.packed_prefix)
+            self.assertEqual(len(entry_paths), mrt.detail.entry_count)
+            for entry, path in zip(mrt.detail.entries, entry_paths):
+                segments = [attr.path_detail().pathsegs for attr in entry.attrs
+                            if attr.bgp_type == BgpAttribute.ATTR_AS_PATH][0]
+                self.assertEqual(path, [(seg.seg_type, tuple(seg.path)) for seg in segments])
+        self.assertEqual(paths, [])
+        graph = build_as_graph(first_records(RIB_TD1_PARTDUMP, 1000))
+        self.assertEqual(graph.paths, 1000)
+        self.assertTrue(len(graph) > 100)
+        folded = AsGraph()
+        folded._links.buffered = folded._upstreams.buffered = 7  # counts folded into the arrays
+        build_as_graph(first_records(RIB_TD1_PARTDUMP, 1000), folded)
+        self.assertEqual(list(folded.links()), list(graph.links()))
+        self.assertEqual(folded.upstreams(3356), graph.upstreams(3356))
+        self.assertEqual(folded.neighbours(3356), graph.neighbours(3356))
+
+    def test_td1_repeated_prefixes_skipped(self):
+        """
+            Tests that parse_mrt_file() skips repeated TDv1 prefixes, keeping the first's origin
+        """
+        f, expected = first_records(RIB_TD1_PARTDUMP, 20000), OrderedDict()
+        while True:
+            mrt = MrtRecord.next_dump_table_record(f)
+            if not mrt:
+                break
+            if mrt.prefix not in expected:
+                expected[mrt.prefix] = mrt.get_first_origin_as()
+        n_prefixes = len(expected)
+        del expected['0.0.0.0/0']
+        stats = ConversionStats()
+        prefixes = parse_mrt_file(first_records(RIB_TD1_PARTDUMP, 20000), stats=stats)
+        self.assertEqual(prefixes, expected)
+        self.assertEqual(stats.records, 20000)
+        self.assertEqual(stats.duplicates, 20000 - n_prefixes)
+        self.assertTrue(stats.duplicates > 10000)
+        compact = parse_mrt_file(first_records(RIB_TD1_PARTDUMP, 20000), compact=True)
+        self.assertEqual(list(compact.items()), list(prefixes.items()))
+
+    def test_peer_selection(self):
+        """
+            Tests the TDv2 peer index table, and parse_mrt_file() with chosen peers
+        """
+        f = first_records(RIB_TD2_PARTDUMP, 1000)
+        peer_index = MrtRecord.next_dump_table_record(f)
+        peers = peer_index.detail.peers
+        self.assertEqual(len(peers), peer_index.detail.peer_count)
+        self.assertEqual(peers[1], ('4.69.184.193', '4.69.184.193', 3356))
+        self.assertEqual(peer_index.detail.select_peers(set([3356, '12.0.1.63'])),
+                         frozenset([1, 2]))
+        # expected: the origin of the first entry of the chosen peers, from the full parse
+        chosen, expected = peer_index.detail.select_peers(set([3356, '64.57.28.241'])), {}
+        while True:
+            mrt = MrtRecord.next_dump_table_record(f, optimize_parse=False)
+            if not mrt:
+                break
+            for entry in mrt.detail.entries:
+                if entry.peer in chosen:
+                    expected[mrt.prefix] = MrtRecord._origin_as_from_attrs(entry.attrs)
+                    break
+        prefixes = parse_mrt_file(first_records(RIB_TD2_PARTDUMP, 1000),
+                                  peers=set([3356, '64.57.28.241']))
+        self.assertEqual(dict(prefixes), expected)
+        self.assertTrue(0 < len(prefixes) < 999)
+        self.assertEqual(len(parse_mrt_file(first_records(RIB_TD2_PARTDUMP, 1000),
+                                            peers=set(['192.0.2.1']))), 0)
+        # TDv1 records hold one peer's route each
+        f = first_records(RIB_TD1_PARTDUMP, 3000)
+        for _ in range(4):
+            mrt = MrtRecord.next_dump_table_record(f)  # 3.0.0.0/8, the 2nd peer's route of it
+        prefixes = parse_mrt_file(first_records(RIB_TD1_PARTDUMP, 3000),
+                                  peers=set([mrt.detail.peer_ip]))
+        self.assertEqual(prefixes[mrt.prefix], mrt.get_first_origin_as())
+        self.assertTrue(0 < len(prefixes) < len(parse_mrt_file(first_records(RIB_TD1_PARTDUMP,
+                                                                             3000))))
+
+    def test_archive_formats(self):
+        """
+            Tests reading xz, zstd and uncompressed (memory-mapped) MRT archives
+        """
+        data = first_records(RIB_TD2_PARTDUMP, 500).read()
+        expected = parse_mrt_file(BytesIO(data))
+        archive = TEMP_RIB_ARCHIVES[0].replace('.gz', '')
+        with open(archive, 'wb') as f:
+            f.write(data)
+        f = open_archive(archive)
+        self.assertEqual(f.read(12), data[:12])
+        f.close()
+        self.assertEqual(parse_mrt_file(archive), expected)
+        f = BytesIO(data)
+        for _ in range(321):
+            mrt = MrtRecord.next_dump_table_record(f, optimize_parse=False)
+        self.assertEqual(repr(get_record(archive, 321)), repr(mrt))  # seeks in the mmap
+        remove(archive + '.idx')
+        if LZMAFile is not None:
+            import lzma
+            with open(archive, 'wb') as f:
+                f.write(lzma.compress(data))
+            self.assertEqual(parse_mrt_file(archive), expected)
+            self.assertEqual(repr(get_record(archive, 321)), repr(mrt))
+            remove(archive + '.idx')
+        if zstandard is not None:
+            with open(archive, 'wb') as f:
+                f.write(zstandard.ZstdCompressor().compress(data))
+            self.assertEqual(parse_mrt_file(archive), expected)
+        else:
+            print("SKIPPING zstd archive test - the 'zstandard' module is not installed",
+                  file=stderr)
+        remove(archive)
+        with open(archive, 'wb') as f:
+            f.write(b'not an MRT archive')
+        self.assertRaises(TypeError, open_archive, archive)
+        remove(archive)
+
+    def test_diff_prefixes(self):
+        """
+            Tests diffing prefix tables, and IPASN files or RIB archives, in one linear merge
+        """
+        from pyasn import pyasn
+        old = parse_mrt_file(first_records(RIB_TD2_PARTDUMP, 1000), compact=True)
+        new = CompactPrefixTable()
+        for family, network, masklen, origin in old.iter_packed():
+            new.add(family, network, masklen, origin)
+        prefixes = list(old.keys())
+        new[prefixes[10]] = 64512
+        del new[prefixes[20]]
+        new['1.0.0.0/8'] = 1
+        new['2001:db8::/32'] = {2, 3}
+        expected = [PrefixChange(PrefixChange.ADDED, '1.0.0.0/8', None, 1),
+                    PrefixChange(PrefixChange.CHANGED, prefixes[10], old[prefixes[10]], 64512),
+                    PrefixChange(PrefixChange.REMOVED, prefixes[20], old[prefixes[20]], None),
+                    PrefixChange(PrefixChange.ADDED, '2001:db8::/32', None, {2, 3})]
+        counts = {}
+        self.assertEqual(list(diff_prefixes(old, new, counts)), expected)
+        self.assertEqual(counts, {'added': 2, 'removed': 1, 'changed': 1,
+                                  'unchanged': len(old) - 2})
+        self.assertEqual(list(diff_prefixes(dict(old.items()), new)), expected)
+        # text files keep one AS of an AS_SET, which isn't a change; and radix trees are walked
+        dump_prefixes_to_file(old, TEMP_IPASNDAT, "test")
+        self.assertEqual(list(diff_prefixes(TEMP_IPASNDAT, old)), [])
+        self.assertEqual(list(diff_prefixes(pyasn(TEMP_IPASNDAT), new)), expected)
+        dump_prefixes_to_file(new, TEMP_IPASNDAT, "test", binary=True)
+        self.assertEqual(list(diff_prefixes(old, TEMP_IPASNDAT)), expected)
+        remove(TEMP_IPASNDAT)
+        write_gzip_archive(first_records(RIB_TD2_PARTDUMP, 1000), TEMP_RIB_ARCHIVES[0])
+        self.assertEqual(list(diff_prefixes(TEMP_RIB_ARCHIVES[0], new)), expected)
+        remove(TEMP_RIB_ARCHIVES[0])
+        self.assertEqual([c.kind for c in diff_prefixes({}, old)], ['added'] * len(old))
+
+    def test_checkpoint_resume(self):
+        """
+            Tests resuming an interrupted conversion from its last checkpoint
+        """
+        class Interrupted(Exception):
+            pass
+
+        class InterruptedCheckpoint(ConversionCheckpoint):
+            def save(self, prefixes, state, archive=None):
+                ConversionCheckpoint.save(self, prefixes, state, archive)
+                if self.saved == 2:
+                    raise Interrupted()
+
+        data = first_records(RIB_TD2_PARTDUMP, 3000).read()
+        expected = parse_mrt_file(BytesIO(data), compact=True)
+        checkpoint = InterruptedCheckpoint(TEMP_IPASNDAT, interval=1000)
+        self.assertRaises(Interrupted, parse_mrt_file, BytesIO(data), compact=True,
+                          checkpoint=checkpoint)
+        partial, state = checkpoint.load()
+        self.assertEqual(state['records'], 2000)
+        self.assertEqual(len(partial), 2000)
+        # resuming skips the records before the checkpoint
+        checkpoint = ConversionCheckpoint(TEMP_IPASNDAT, interval=1000, resume=True)
+        stats = ConversionStats()
+        prefixes = parse_mrt_file(BytesIO(data), compact=True, checkpoint=checkpoint,
+                                  stats=stats)
+        self.assertEqual(stats.records, 998)  # the peer index and default route aren't counted
+        self.assertEqual(list(prefixes.keys()), list(expected.keys()))
+        self.assertEqual(list(diff_prefixes(prefixes, expected)), [])
+        self.assertRaises(ValueError, parse_mrt_file, BytesIO(data), checkpoint=checkpoint)
+        self.assertRaises(ValueError, parse_mrt_file, BytesIO(data), compact=True,
+                          checkpoint=checkpoint, prefix_filter=PrefixFilter(["10.0.0.0/8"]))
+        checkpoint.remove()
+        self.assertEqual(checkpoint.load(), None)
+        # the same in dict mode, with prefixes in the same order
+        expected = parse_mrt_file(BytesIO(data))
+        checkpoint = InterruptedCheckpoint(TEMP_IPASNDAT, interval=1000)
+        self.assertRaises(Interrupted, parse_mrt_file, BytesIO(data), checkpoint=checkpoint)
+        checkpoint = ConversionCheckpoint(TEMP_IPASNDAT, interval=1000, resume=True)
+        self.assertEqual(list(parse_mrt_file(BytesIO(data), checkpoint=checkpoint).items()),
+                         list(expected.items()))
+        # insertion order and single-AS sets survive a checkpoint
+        table = OrderedDict([("2001:db8::/32", 64500), ("10.0.0.0/8", set([64501])),
+                             ("192.0.2.0/24", set([64502, 64503]))])
+        checkpoint.save(table, {'records': 3})
+        loaded, _ = checkpoint.load(compact=False)
+        self.assertEqual(list(loaded.items()), list(table.items()))
+        loaded, _ = checkpoint.load()
+
+        self.assertEqual(loaded["10.0.0.0/8"], set([64501]))
+        checkpoint.remove()
@@ -0,0 +1,150 @@
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, division
+from unittest import TestCase
+from pyasn import pyasn
+from pyasn.shard import ShardRouter, plan_shards, load_shard, serve_shard, address_bucket, \
+    prefix_buckets, SHARD_BUCKETS
+from shutil import rmtree
+from tempfile import mkdtemp
+from random import Random
+from os import path
+from threading import Thread
+from time import sleep
+from multiprocessing.connection import Client
+import socket
+import gzip
+
+IPASN_DB_PATH = path.join(path.dirname(__file__), "../data/ipasn_20140513.dat.gz")
+IPASN6_DB_PATH = path.join(path.dirname(__file__), "../data/ipasn6_20151101.dat.gz")
+IPASN_2008_DB_PATH = path.join(path.dirname(__file__), "../data/ipasn_20080501_v12.dat.gz")
+
+
+def sample_ipasn_file(source, target, every):
+    # writes every Nth prefix of an IPASN file, and all prefixes shorter than /16, to target
+    with gzip.open(source, 'rt') as f:
+        lines = [line for line in f if line[0] != ';']
+    with open(target, 'w') as f:
+        f.writelines(line for i, line in enumerate(lines)
+                     if i % every == 0 or int(line.split('\t')[0].split('/')[1]) < 16)
+
+
+class TestShard(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.databases = {}
+        for snapshot, source in (('20080501', IPASN_2008_DB_PATH), ('20140513', IPASN_DB_PATH),
+                                 ('20151101', IPASN6_DB_PATH)):
+            self.databases[snapshot] = path.join(self.tmp_dir, snapshot + '.dat')
+            sample_ipasn_file(source, self.databases[snapshot], 20)
+        self.asndbs = dict((snapshot, pyasn(db)) for snapshot, db in self.databases.items())
+        rnd = Random(49)
+        self.ips = ['%d.%d.%d.%d' % tuple(rnd.randint(0, 255) for _ in range(4))
+                    for _ in range(5000)]
+        self.ips += ['%x:%x::%x' % (rnd.choice((0x2001, 0x2a00, 0x2c0f)), rnd.randint(0, 0xffff),
+                                    rnd.randint(0, 0xffff)) for _ in range(1000)]
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_buckets(self):
+        """
+            Tests the bucket plan, and that shards hold the prefixes overlapping their buckets
+        """
+        self.assertEqual(address_bucket('130.161.1.2'), 130 * 256 + 161)
+        self.assertEqual(address_bucket('::1'), 65536)
+        self.assertEqual(address_bucket('2001:610::1'), 65536 + 0x2001)
+        self.assertRaises(ValueError, address_bucket, '1.300.1.1')
+        self.assertEqual(prefix_buckets('12.0.0.0/8'), (12 * 256, 256))
+        self.assertEqual(prefix_buckets('2a00::/12'), (65536 + 0x2a00, 16))
+        plan = plan_shards(self.databases['20140513'], 3)
+        self.assertEqual(len(plan), 3)
+        self.assertEqual((plan[0][0], plan[-1][1]), (0, SHARD_BUCKETS))
+        self.assertTrue(all(a[1] == b[0] for a, b in zip(plan, plan[1:])))
+        total = len(list(self.asndbs['20140513']))
+        shards = [load_shard(self.databases['20140513'], lo, hi) for lo, hi in plan]
+        self.assertTrue(sum(len(list(shard)) for shard in shards) >= total)
+        for ip in self.ips[:500]:
+            shard = [s for (lo, hi), s in zip(plan, shards) if lo <= address_bucket(ip) < hi][0]
+            self.assertEqual(shard.lookup(ip), self.asndbs['20140513'].lookup(ip))
+
+    def test_router(self):
+        """
+            Tests batch lookups through local shard workers, by snapshot date, in order
+        """
+        router = ShardRouter.start_local(self.databases, shards=2)
+        processes = router.processes
+        try:
+            self.assertEqual(len(router.processes), 6)
+            self.assertEqual(router.snapshots, ['20080501', '20140513', '20151101'])
+            for date, snapshot in ((None, '20151101'), ('20140601', '20140513'),
+                                   ('20080501', '20080501')):
+                self.assertEqual(router.lookup_many(self.ips, date),
+                                 self.asndbs[snapshot].lookup_many(self.ips))
+            dates = ['20100101', '20151231'] * (len(self.ips) // 2)
+            self.assertEqual(router.lookup_many(self.ips, dates),
+                             [self.asndbs['20080501' if d == '20100101' else '20151101'].lookup(ip)
+                              for ip, d in zip(self.ips, dates)])
+            self.assertEqual(router.lookup('8.8.8.8', '20140513'),
+                             self.asndbs['20140513'].lookup('8.8.8.8'))
+            self.assertRaises(ValueError, router.lookup_many, ['8.8.8.8', '8.8.8.300'])
+            self.assertRaises(LookupError, router.lookup, '8.8.8.8', '20000101')
+            self.assertEqual(router.lookup_many([]), [])
+        finally:
+            router.close()
+        self.assertFalse(any(process.is_alive() for process in processes))
+
+    def test_serve_needs_authkey(self):
+        """
+            Tests that workers don't listen on other than loopback addresses without an authkey
+        """
+        for host in ('0.0.0.0', '192.0.2.1', '::', 'example.com'):
+            self.assertRaises(ValueError, serve_shard, self.databases['20140513'], 0, 1,
+                              (host, 0))
+
+    def test_serve_after_dropped_connection(self):
+        """
+            Tests that a worker keeps serving after a client drops during authentication
+        """
+        class Ready(object):
+            def send(self, address):
+                self.address = address
+
+            def close(self):
+                pass
+        ready, authkey = Ready(), b'secret'
+        worker = Thread(target=serve_shard, args=(self.databases['20140513'], 0, SHARD_BUCKETS,
+                                                  ('127.0.0.1', 0), authkey, ready))
+        worker.start()
+        try:
+            while not hasattr(ready, 'address'):
+                sleep(0.01)
+            for _ in range(2):
+                socket.create_connection(ready.address).close()
+            client = Client(ready.address, authkey=authkey)
+            client.send(['8.8.8.8'])
+            self.assertEqual(client.recv(), [self.asndbs['20140513'].lookup('8.8.8.8')])
+        finally:
+            client = Client(ready.address, authkey=authkey)
+            client.send(None)
+            client.close()
+            worker.join()
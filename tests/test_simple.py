@@ -25,6 +25,9 @@ import pickle
 from unittest import TestCase
 
 from pyasn import pyasn, pyasn_radix
+from pyasn.asnames import AsNamesStore, AsNameIndex, iter_autnums, write_asnames_store
+from shutil import rmtree
+from tempfile import mkdtemp
 
 FAKE_IPASN_DB_PATH = os.path.join(os.path.dirname(__file__), "../data/ipasn.fake")
 IPASN_DB_PATH = os.path.join(os.path.dirname(__file__), "../data/ipasn_20140513.dat.gz")
@@ -164,6 +167,15 @@ class TestSimple(TestCase):
             asn, prefix = db.lookup(ip)
             self.assertEqual(asn, known_as)
 
+    def test_lookup_many(self):
+        """
+            Tests that batched lookups match single lookups, in order
+        """
+        ips = ['8.8.8.8', '130.161.0.1', '10.0.0.1', '2001:610:188:400::1', '8.8.4.4']
+        self.assertEqual(self.asndb.lookup_many(ips), [self.asndb.lookup(ip) for ip in ips])
+        self.assertEqual(self.asndb.lookup_many([]), [])
+        self.assertRaises(ValueError, self.asndb.lookup_many, ['8.8.8.8', '8.8.8.300'])
+
     def test_asnames(self):
         """
             Test functionality of AS Name Lookup.
@@ -175,6 +187,8 @@ class TestSimple(TestCase):
 
         name = db_with_names.get_as_name(-1)
         self.assertTrue(name is None, "ASN Name Incorrect! Should be None")
+        self.assertTrue(db_with_names.has_as_names())
+        self.assertFalse(self.asndb.has_as_names())
 
     def test_asnames_compressed(self):
         """
@@ -188,6 +202,77 @@ class TestSimple(TestCase):
         name = db_with_names.get_as_name(-1)
         self.assertTrue(name is None, "ASN Name Incorrect! Should be None")
 
+    def test_asnames_store(self):
+        """
+            Test AS Name Lookup from a binary names store, built from streamed autnums.html lines
+        """
+        tmp_dir = mkdtemp()
+        try:
+            with codecs.open(AS_NAMES_FILE_PATH, 'r', encoding='utf-8') as fs:
+                names = json.load(fs)
+            html = [b'<html><pre>\n',
+                    b'<a href="/as-report?as=AS1.10">AS1.10  </a> ASDOT-AS \xe9, NL\n']
+            html += [('<a href="/as-report?as=AS%s">AS%s</a> %s\n' % (k, k, v)).encode('utf-8')
+                     for k, v in names.items()]
+            parsed = list(iter_autnums(html, 'utf-8'))
+            self.assertEqual(parsed[0], (65546, u'ASDOT-AS \ufffd, NL'))  # not utf-8: replaced
+            self.assertEqual(list(iter_autnums(html[:2]))[0], (65546, u'ASDOT-AS \xe9, NL'))
+            self.assertEqual(dict(parsed[1:]), dict((int(k), v) for k, v in names.items()))
+
+            store_path = os.path.join(tmp_dir, 'asnames.bin')
+            self.assertEqual(write_asnames_store(parsed, store_path), len(names) + 1)
+            db_json = pyasn(IPASN_DB_PATH, as_names_file=AS_NAMES_FILE_PATH)
+            db_store = pyasn(IPASN_DB_PATH, as_names_file=store_path)
+            self.assertTrue(isinstance(db_store._asnames, AsNamesStore))
+            self.assertTrue(db_store.has_as_names())
+
+            asn, prefix = db_store.lookup('8.8.8.8')
+            self.assertEqual(db_store.get_as_name(asn), db_json.get_as_name(asn))
+            self.assertEqual(db_store.get_as_name(-1), None)
+            self.assertEqual(db_store.get_as_name(65546), u'ASDOT-AS \ufffd, NL')
+            asns = [int(k) for k in sorted(names)[::50]] + [None, 4294967295, 15169]
+            self.assertEqual(db_store.get_as_names(asns), db_json.get_as_names(asns))
+            self.assertEqual(db_store.get_as_names(asns[-3:]),
+                             [None, None, db_json.get_as_name(15169)])
+            self.assertEqual(dict(db_store._asnames.items()), dict(parsed))
+            db_store = pickle.loads(pickle.dumps(db_store))  # the store is mapped again
+            self.assertEqual(db_store.get_as_name(asn), db_json.get_as_name(asn))
+            db_store._asnames.close()
+        finally:
+            rmtree(tmp_dir)
+
+    def test_asnames_search(self):
+        """
+            Test AS Name search through the trigram index, from json names and a names store
+        """
+        db = pyasn(IPASN_DB_PATH, as_names_file=AS_NAMES_FILE_PATH)
+        names = db._asnames
+        for query in ('amazon', 'TELECOM', 'deutsche telekom', 'de', 'xyzzy-no-such-as'):
+            words = query.lower().split()
+            expected = sorted(asn for asn, name in names.items()
+                              if all(word in name.lower() for word in words))
+            self.assertEqual(sorted(asn for asn, _ in db.search_as_names(query, None)), expected)
+        found = db.search_as_names('google', 5)
+        self.assertEqual(len(found), 5)
+        self.assertTrue(all(name.lower().startswith('google') for _, name in found[:4]))
+        self.assertTrue((15169, names[15169]) in db.search_as_names('google', None))
+        self.assertEqual(db.search_as_names('Amazon.com', 3, details=True)[0],
+                         (7224, names[7224], db.get_as_prefixes(7224), db.get_as_size(7224)))
+        self.assertEqual(db.search_as_names(' '), [])
+
+        tmp_dir = mkdtemp()
+        try:
+            store_path = os.path.join(tmp_dir, 'asnames.bin')
+            write_asnames_store(names, store_path)
+            AsNameIndex.build(AsNamesStore(store_path)).save(store_path + '.tri')
+            db_store = pyasn(IPASN_DB_PATH, as_names_file=store_path)
+            for query in ('amazon', 'telecom', 'deutsche telekom', 'de'):
+                self.assertEqual(db_store.search_as_names(query, 50),
+                                 db.search_as_names(query, 50))
+            db_store._asnames_index.close()
+        finally:
+            rmtree(tmp_dir)
+
     def test_assize(self):
         """
             Test AS Size calculation correctness
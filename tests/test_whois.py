@@ -0,0 +1,100 @@
+# Copyright (c) 2009-2017 Hadi Asghari
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import print_function, division
+from unittest import TestCase, skipIf
+from pyasn import pyasn
+from os import path
+import sys
+if sys.version_info >= (3, 7):
+    import asyncio
+    from pyasn.whois import BulkWhoisServer
+
+IPASN_DB_PATH = path.join(path.dirname(__file__), "../data/ipasn_20140513.dat.gz")
+AS_NAMES_FILE_PATH = path.join(path.dirname(__file__), "../data/asnames.json")
+STATIC_CYMRUWHOIS_PATH = path.join(path.dirname(__file__), "../data/cymru.map")
+
+
+def query(port, text):
+    # sends text to the whois server, returns its answer (lines) once it closes the connection
+    async def ask():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(text.encode())
+        await writer.drain()
+        answer = await reader.read()
+        writer.close()
+        return answer.decode().splitlines()
+    return ask()
+
+
+@skipIf(sys.version_info < (3, 7), "the whois server needs asyncio")
+class TestWhois(TestCase):
+    asndb = pyasn(IPASN_DB_PATH, as_names_file=AS_NAMES_FILE_PATH)
+
+    def serve(self, *requests, **kwargs):
+        # starts a server, sends it all requests at once (one client each), returns the answers
+        async def run():
+            server = await BulkWhoisServer(self.asndb, port=0, **kwargs).start()
+            try:
+                return server, await asyncio.gather(*[query(server.port, r) for r in requests])
+            finally:
+                await server.close()
+        return asyncio.run(run())
+
+    def test_bulk(self):
+        """
+            Tests answering bulk requests, for many clients at once, as Team Cymru would
+        """
+        with open(STATIC_CYMRUWHOIS_PATH, "r") as f:
+            ips = sorted(eval(f.read()))
+        request = 'begin\nverbose\n%s\nend\n' % '\n'.join(ip + ' 2014-05-13 06:00:00 GMT'
+                                                         for ip in ips)
+        server, answers = self.serve(*([request] * 20), batch_size=100)
+        self.assertEqual((server.clients, server.queries), (20, 20 * len(ips)))
+        for lines in answers:
+            self.assertEqual(lines, answers[0])
+        lines = answers[0]
+        self.assertTrue(lines[0].startswith('Bulk mode;'))
+        self.assertEqual([c.strip() for c in lines[1].split('|')],
+                         ['AS', 'IP', 'BGP Prefix', 'CC', 'Registry', 'Allocated', 'AS Name'])
+        self.assertEqual(len(lines), len(ips) + 2)
+        for ip, line in zip(ips, lines[2:]):
+            fields = [field.strip() for field in line.split('|')]
+            asn, prefix = self.asndb.lookup(ip)
+            name = self.asndb.get_as_name(asn) if asn else None
+            self.assertEqual(fields[:3], [str(asn or 'NA'), ip, prefix or 'NA'])
+            self.assertEqual(fields[6], name or 'NA')
+            self.assertEqual(fields[3], name[-2:] if name else 'NA')
+
+    def test_queries(self):
+        """
+            Tests single queries, bulk options, and AS number queries
+        """
+        _, answers = self.serve(' -f 8.8.8.8\n', '-v AS15169\n', 'not-an-ip\n',
+                                'begin\nnoheader\nnoasname\n8.8.8.8\n# comment\nprefix\n'
+                                '10.0.0.1\nasname\nAS1133\nend\n')
+        name = self.asndb.get_as_name(15169)
+        self.assertEqual(answers[0], ['15169    | 8.8.8.8          | ' + name])
+        self.assertEqual([c.strip() for c in answers[1][1].split('|')],
+                         ['15169', 'US', 'NA', 'NA', name])
+        self.assertEqual([c.strip() for c in answers[2][1].split('|')], ['NA', 'not-an-ip', 'NA'])
+        bulk = [[c.strip() for c in line.split('|')] for line in answers[3][1:]]
+        self.assertEqual(bulk, [['15169', '8.8.8.8'], ['NA', '10.0.0.1', 'NA'],
+                                ['1133', self.asndb.get_as_name(1133)]])